@@ -0,0 +1,204 @@
+"""Admission control: shed excess requests early instead of queueing them on the MongoDB pool.
+
+Each route's ASGI app is wrapped once at startup (admit_routes), like the
+metrics instrumentation, so a request is admitted or rejected before its body
+is read or validated. Requests count against a global concurrency limit until
+their response is sent; each priority may only fill its share of that limit,
+which keeps headroom for cheap reads when writes and recommendations pile up.
+Routes can also get their own concurrency limit, and clients an optional
+token-bucket rate.
+
+    ADMISSION_ENABLED           wrap the routes at all (true)
+    ADMISSION_MAX_CONCURRENCY   requests in flight per worker (200; 0 disables)
+    ADMISSION_SHARES            share of that limit each priority may fill
+    ADMISSION_PRIORITIES        "METHOD /route/template=priority" overrides
+    ADMISSION_ROUTE_LIMITS      "METHOD /route/template=limit" per-route concurrency
+    ADMISSION_CLIENT_RATE       requests per second per client address (0: off)
+    ADMISSION_CLIENT_BURST      bucket size per client
+    ADMISSION_RETRY_AFTER       Retry-After seconds on 503
+
+Over a concurrency limit the answer is 503, over the client rate 429, both
+with Retry-After and without touching the database. Shed counts, in-flight
+requests and the limits are exported on /metrics. All state is per worker
+process and only touched from the event loop.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+from starlette.routing import Route
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true") == "true"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "200"))
+ADMISSION_SHARES = os.getenv("ADMISSION_SHARES", "high=1.0,normal=0.8,low=0.5")
+ADMISSION_PRIORITIES = os.getenv("ADMISSION_PRIORITIES", "")  # e.g. "GET /books/search/=low"
+ADMISSION_ROUTE_LIMITS = os.getenv("ADMISSION_ROUTE_LIMITS", "")  # e.g. "GET /users/recommend/=32,POST /books/=16"
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "0"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "20"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_MAX_CLIENTS = 10000  # token buckets kept; the least recently seen client is evicted beyond it
+
+PRIORITIES = ('high', 'normal', 'low')
+# Probes and scrapes must get through, especially while overloaded
+EXEMPT_PATHS = frozenset({'/health', '/metrics'})
+# A cached point read costs next to nothing, recommendations and writes the most
+DEFAULT_PRIORITIES = {'GET /books/{book_id}': 'high', 'GET /users/recommend/': 'low'}
+WRITE_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
+
+OVERLOADED_BODY = b'{"detail":"Server is overloaded, retry later"}'
+RATE_LIMITED_BODY = b'{"detail":"Too many requests, retry later"}'
+
+
+def parse_mapping(spec, convert):
+    # "key=value,key=value"; keys are "METHOD /route/template" and may contain spaces
+    mapping = {}
+    for item in spec.split(','):
+        if '=' in item:
+            key, value = item.rsplit('=', 1)
+            mapping[' '.join(key.split())] = convert(value.strip())
+    return mapping
+
+def route_priority(key, method, overrides):
+    if key in overrides:
+        return overrides[key]
+    if key in DEFAULT_PRIORITIES:
+        return DEFAULT_PRIORITIES[key]
+    return 'low' if method in WRITE_METHODS else 'normal'
+
+
+class RouteAdmission:
+    __slots__ = ('priority', 'limit', 'in_flight', 'shed')
+
+    def __init__(self, priority, limit):
+        self.priority = priority
+        self.limit = limit  # 0: only the global limit applies
+        self.in_flight = 0
+        self.shed = {}  # reason -> count
+
+
+class AdmissionControl:
+    """Global and per-route concurrency limits by priority, plus per-client token buckets."""
+
+    def __init__(self, max_concurrency=ADMISSION_MAX_CONCURRENCY, shares=ADMISSION_SHARES, priorities=ADMISSION_PRIORITIES,
+                 route_limits=ADMISSION_ROUTE_LIMITS, client_rate=ADMISSION_CLIENT_RATE, client_burst=ADMISSION_CLIENT_BURST,
+                 retry_after=ADMISSION_RETRY_AFTER):
+        shares = parse_mapping(shares, float)
+        self.max_concurrency = max_concurrency
+        # Requests in flight at which a priority stops being admitted; high keeps the whole limit
+        self.thresholds = {
+            priority: max(1, int(max_concurrency * shares.get(priority, 1.0))) if max_concurrency > 0 else math.inf
+            for priority in PRIORITIES
+        }
+        self.priorities = parse_mapping(priorities, str.lower)
+        self.route_limits = parse_mapping(route_limits, int)
+        self.client_rate = client_rate
+        self.client_burst = max(client_burst, 1.0)
+        self.retry_after = str(max(retry_after, 1)).encode()
+        self.in_flight = 0
+        self.routes = {}  # "METHOD /route/template" -> RouteAdmission
+        self.buckets = OrderedDict()  # client address -> [tokens, last refill], least recently seen first
+
+    def route(self, method, path):
+        if path in EXEMPT_PATHS:
+            return None
+        key = f"{method} {path}"
+        admission = self.routes.get(key)
+        if admission is None:
+            priority = route_priority(key, method, self.priorities)
+            if priority not in PRIORITIES:
+                raise ValueError(f"Unknown admission priority {priority!r} for {key}; expected one of {', '.join(PRIORITIES)}")
+            admission = self.routes[key] = RouteAdmission(priority, self.route_limits.get(key, 0))
+        return admission
+
+    def take_token(self, client):
+        # Returns 0 when the request may pass, otherwise the seconds until a token is available
+        now = time.monotonic()
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            # An evicted client starts again with a full bucket, as it would after idling
+            if len(self.buckets) >= ADMISSION_MAX_CLIENTS:
+                self.buckets.popitem(last=False)
+            bucket = self.buckets[client] = [self.client_burst, now]
+        else:
+            self.buckets.move_to_end(client)
+            bucket[0] = min(self.client_burst, bucket[0] + (now - bucket[1]) * self.client_rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0
+        return (1.0 - bucket[0]) / self.client_rate
+
+    def snapshot(self):
+        return {
+            'in_flight': self.in_flight,
+            'max_concurrency': self.max_concurrency,
+            'thresholds': {priority: limit if limit != math.inf else None for priority, limit in self.thresholds.items()},
+            'clients': len(self.buckets),
+            'routes': {key: {'priority': route.priority, 'limit': route.limit, 'in_flight': route.in_flight, 'shed': dict(route.shed)}
+                       for key, route in self.routes.items()}
+        }
+
+
+admission_control = AdmissionControl()
+
+
+async def reject(send, status, body, retry_after):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'retry-after', retry_after)
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AdmittedRoute:
+    """Wraps one route's ASGI app; admission state for each of its methods is resolved up front."""
+
+    def __init__(self, app, path, methods, control):
+        self.app = app
+        self.control = control
+        self.admissions = {method: control.route(method, path) for method in methods}
+
+    async def __call__(self, scope, receive, send):
+        admission = self.admissions.get(scope['method'])
+        if admission is None:
+            await self.app(scope, receive, send)
+            return
+
+        control = self.control
+        if control.in_flight >= control.thresholds[admission.priority]:
+            admission.shed['overloaded'] = admission.shed.get('overloaded', 0) + 1
+            await reject(send, 503, OVERLOADED_BODY, control.retry_after)
+            return
+        if admission.limit and admission.in_flight >= admission.limit:
+            admission.shed['route_limit'] = admission.shed.get('route_limit', 0) + 1
+            await reject(send, 503, OVERLOADED_BODY, control.retry_after)
+            return
+        if control.client_rate > 0:
+            client = scope.get('client')
+            wait = control.take_token(client[0] if client else '')
+            if wait:
+                admission.shed['rate_limited'] = admission.shed.get('rate_limited', 0) + 1
+                await reject(send, 429, RATE_LIMITED_BODY, str(math.ceil(wait)).encode())
+                return
+
+        control.in_flight += 1
+        admission.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            control.in_flight -= 1
+            admission.in_flight -= 1
+
+
+def admit_routes(app, enabled=ADMISSION_ENABLED, control=admission_control):
+    # Called once after every router is included, before instrument_routes so shed requests are counted there too
+    if not enabled:
+        return
+    for route in app.routes:
+        if isinstance(route, Route) and route.methods and not isinstance(route.app, AdmittedRoute):
+            route.app = AdmittedRoute(route.app, route.path, route.methods, control)
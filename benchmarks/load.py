@@ -0,0 +1,291 @@
+"""Load and latency benchmark covering every endpoint in routing.py.
+
+Seeds a disposable database (MONGODB_DB, default "pythonlib_bench") with a
+catalog grown from pythonlib.books.json, then drives each endpoint with a
+fixed number of concurrent clients and reports p50/p95/p99 latency and
+throughput per endpoint as JSON.
+
+    # in-process over ASGI, against the local mongod
+    python -m benchmarks.load --books 5000 --requests 500 --concurrency 20
+
+    # hermetic run on the embedded backend; the difference to the run above is
+    # the driver and network round-trip share of each endpoint's latency
+    python -m benchmarks.load --backend memory --books 5000 --requests 500 --concurrency 20
+
+    # over HTTP against a running server (seeded through the same database settings)
+    python -m benchmarks.load --url http://127.0.0.1:8000
+
+    # flag regressions against a stored baseline
+    python -m benchmarks.load --baseline benchmarks/baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Benchmark defaults; set before the app modules read their configuration
+os.environ.setdefault("MONGODB_DB", "pythonlib_bench")
+os.environ.setdefault("PROFILER_ENABLED", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LOG_CONSOLE", "false")
+
+import httpx
+
+SOURCE_BOOKS = Path(__file__).resolve().parent.parent / "pythonlib.books.json"
+FIRST_NEW_ID = 10_000_000  # ids for books and users created during the run
+ASYNC_BATCH = 100  # items per ?async=true write; the 202 is timed, not the job behind it
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def load_source_books():
+    # The export is Mongo extended JSON with string ids; keep the fields models.Book expects
+    with open(SOURCE_BOOKS) as f:
+        return [{key: book[key] for key in ('title', 'author', 'year', 'isbn')} for book in json.load(f)]
+
+async def seed(repo, books, users, reviews_per_book, seed_value):
+    rng = random.Random(seed_value)
+    source = load_source_books()
+    await repo.reset()
+
+    catalog = []
+    for book_id in range(1, books + 1):
+        template = source[(book_id - 1) % len(source)]
+        edition = (book_id - 1) // len(source)
+        title = template['title'] if edition == 0 else f"{template['title']} (edition {edition + 1})"
+        catalog.append({
+            **template, 'id': book_id, 'title': title, 'isbn': f"{template['isbn']}-{book_id}",
+            'review_count': 0, 'review_histogram': {}, 'latest_reviews': []
+        })
+    await repo.books.insert_unique(catalog)
+
+    people = [
+        {'id': user_id, 'name': f"User {user_id}", 'favorite_books': rng.sample(range(1, books + 1), min(5, books))}
+        for user_id in range(1, users + 1)
+    ]
+    await repo.users.insert_unique(people)
+
+    created_at = datetime.now(timezone.utc)
+    reviews = [
+        {'user_id': rng.randint(1, max(users, 1)), 'book_id': book_id, 'content': f"Review {n} of book {book_id}",
+         'rating': rng.randint(1, 5), 'created_at': created_at}
+        for book_id in range(1, books + 1) for n in range(reviews_per_book)
+    ]
+    await repo.reviews.insert_many(reviews)
+    # Embedded summaries are maintained by the API's write path, so mirror it here
+    from service import summarize_reviews, REVIEW_SUMMARY_SIZE
+    await repo.books.add_review_summaries(summarize_reviews(reviews), REVIEW_SUMMARY_SIZE)
+    return {'books': books, 'users': users, 'reviews': len(reviews), 'titles': [book['title'] for book in source]}
+
+
+def scenarios(dataset, rng):
+    """Endpoint scenarios in execution order; writes create the rows later scenarios delete."""
+    books, users = dataset['books'], dataset['users']
+    new_books = itertools.count(FIRST_NEW_ID)
+    new_users = itertools.count(FIRST_NEW_ID)
+    created_books, created_users = [], []
+    ids = {'cleanup': [], 'jobs': []}  # filled from the responses of earlier scenarios
+
+    def new_book():
+        book_id = next(new_books)
+        created_books.append(book_id)
+        return {'id': book_id, 'title': f"Bench Book {book_id}", 'author': "Bench Author", 'year': 2024, 'isbn': f"BENCH-{book_id}"}
+
+    def book_update():
+        return {'id': rng.randint(1, books), 'year': rng.randint(1900, 2024)}
+
+    def rating():
+        return {'book_id': rng.randint(1, books), 'value': rng.randint(1, 5)}
+
+    def review():
+        return {'user_id': rng.randint(1, users), 'book_id': rng.randint(1, books), 'content': "Benchmark review", 'rating': rng.randint(1, 5)}
+
+    def submit(method, path, make_item):
+        return method, path, {'async': 'true'}, [make_item() for _ in range(ASYNC_BATCH)]
+
+    def add_user():
+        user_id = next(new_users)
+        created_users.append(user_id)
+        return "POST", "/users/", None, [{'id': user_id, 'name': f"Bench User {user_id}", 'favorite_books': rng.sample(range(1, books + 1), min(3, books))}]
+
+    def delete_books():
+        return "DELETE", "/books/", None, [created_books.pop()] if created_books else [rng.randint(1, books)]
+
+    def delete_users():
+        return "DELETE", "/users/", None, [created_users.pop()] if created_users else [rng.randint(1, users)]
+
+    def cleanup_status():
+        task_id = rng.choice(ids['cleanup']) if ids['cleanup'] else "missing"
+        return "GET", f"/cleanup/{task_id}", None, None
+
+    def job_status():
+        job_id = rng.choice(ids['jobs']) if ids['jobs'] else "missing"
+        return "GET", f"/jobs/{job_id}", None, None
+
+    return [
+        ("GET /books/{book_id}", lambda: ("GET", f"/books/{rng.randint(1, books)}", None, None)),
+        ("GET /books/{book_id}/reviews", lambda: ("GET", f"/books/{rng.randint(1, books)}/reviews", {'limit': 20}, None)),
+        ("GET /books/", lambda: ("GET", "/books/", {'after': rng.randint(0, books), 'limit': 50}, None)),
+        ("GET /books/?stream", lambda: ("GET", "/books/", {'after': rng.randint(0, books), 'limit': 100, 'stream': 'true'}, None)),
+        ("GET /books/search/", lambda: ("GET", "/books/search/", {'q': rng.choice(dataset['titles'])[:rng.randint(3, 8)], 'limit': 10}, None)),
+        ("POST /books/", lambda: ("POST", "/books/", None, [new_book()])),
+        ("PUT /books/", lambda: ("PUT", "/books/", None, [book_update()])),
+        ("POST /books/rate/", lambda: ("POST", "/books/rate/", None, [rating()])),
+        ("POST /reviews/", lambda: ("POST", "/reviews/", None, [review()])),
+        ("POST /books/?async", lambda: submit("POST", "/books/", new_book)),
+        ("PUT /books/?async", lambda: submit("PUT", "/books/", book_update)),
+        ("POST /books/rate/?async", lambda: submit("POST", "/books/rate/", rating)),
+        ("POST /reviews/?async", lambda: submit("POST", "/reviews/", review)),
+        ("GET /jobs/{job_id}", job_status),
+        ("POST /users/", add_user),
+        ("PUT /users/progress/", lambda: ("PUT", "/users/progress/", {'user_id': rng.randint(1, users)}, [{'book_id': rng.randint(1, books), 'percentage_read': rng.randint(0, 100)}])),
+        ("GET /users/progress/", lambda: ("GET", "/users/progress/", {'user_id': rng.randint(1, users)}, None)),
+        ("GET /users/recommend/", lambda: ("GET", "/users/recommend/", {'user_id': rng.randint(1, users)}, None)),
+        ("GET /cache/stats", lambda: ("GET", "/cache/stats", None, None)),
+        ("GET /health", lambda: ("GET", "/health", None, None)),
+        ("GET /metrics", lambda: ("GET", "/metrics", None, None)),
+        ("DELETE /books/", delete_books),
+        ("DELETE /users/", delete_users),
+        ("POST /cleanup/orphans", lambda: ("POST", "/cleanup/orphans", None, None)),
+        ("GET /cleanup/{task_id}", cleanup_status),
+    ], ids
+
+async def run_scenario(client, build_request, requests, concurrency, ids):
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, path, params, body = build_request()
+            start = time.perf_counter()
+            response = await client.request(method, path, params=params, json=body)
+            await response.aread()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 500:
+                errors += 1
+            elif response.headers.get('content-type', '').startswith('application/json'):
+                payload = response.json()
+                if isinstance(payload, dict) and payload.get('cleanup_task'):
+                    ids['cleanup'].append(payload['cleanup_task'])
+                elif response.status_code == 202:
+                    ids['jobs'].append(payload['job'])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(latencies[-1], 3)
+    }
+
+async def benchmark(args):
+    # Imported here so --backend is applied before the storage backend is chosen
+    from storage import repo
+    dataset = await seed(repo, args.books, args.users, args.reviews_per_book, args.seed)
+    rng = random.Random(args.seed)
+    plan, ids = scenarios(dataset, rng)
+    only = set(args.only or [])
+
+    results = {}
+    if args.url:
+        client_context = httpx.AsyncClient(base_url=args.url, timeout=60)
+        app_context = None
+    else:
+        from main import app
+        client_context = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+        app_context = app.router.lifespan_context(app)
+
+    async with client_context as client:
+        if app_context is not None:
+            await app_context.__aenter__()
+        try:
+            for name, build_request in plan:
+                if only and name not in only:
+                    continue
+                results[name] = await run_scenario(client, build_request, args.requests, args.concurrency, ids)
+                print(f"{name:<30} p50 {results[name]['p50_ms']:8.2f} ms  p95 {results[name]['p95_ms']:8.2f} ms  "
+                      f"p99 {results[name]['p99_ms']:8.2f} ms  {results[name]['throughput_rps']:8.1f} req/s  errors {results[name]['errors']}")
+        finally:
+            if app_context is not None:
+                await app_context.__aexit__(None, None, None)
+
+    if not args.keep_data:
+        await repo.reset()
+    await repo.close()
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'target': args.url or 'in-process',
+        'dataset': {key: value for key, value in dataset.items() if key != 'titles'},
+        'results': results
+    }
+
+def compare(report, baseline, tolerance):
+    # A regression is a p95 that got slower, or throughput that dropped, by more than tolerance
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        if result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {result['p95_ms']} ms")
+        if result['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {result['throughput_rps']} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-endpoint load and latency benchmark")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--backend", choices=("mongo", "memory"), default=os.getenv("STORAGE_BACKEND", "mongo"),
+                        help="storage backend of the in-process app")
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--reviews-per-book", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", action="append", help="run only this scenario (repeatable)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before flagging")
+    parser.add_argument("--keep-data", action="store_true", help="don't drop the benchmark database afterwards")
+    args = parser.parse_args()
+    if args.url and args.backend == "memory":
+        parser.error("the memory backend lives in the server process; it can only be benchmarked in-process")
+    os.environ["STORAGE_BACKEND"] = args.backend
+    # Start from the seeded data only, never from a stored snapshot
+    os.environ.pop("MEMORY_SNAPSHOT_PATH", None)
+
+    report = asyncio.run(benchmark(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
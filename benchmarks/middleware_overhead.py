@@ -0,0 +1,118 @@
+"""Micro-benchmark of the per-request cost of the middleware stack.
+
+Compares the previous BaseHTTPMiddleware implementations with the pure ASGI
+ones by driving a trivial endpoint directly over ASGI (no sockets), with a
+fixed number of requests in flight to simulate sustained load.
+
+    python -m benchmarks.middleware_overhead --requests 20000 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+from fastapi import FastAPI, Request, Response
+from starlette.middleware.base import BaseHTTPMiddleware
+from pyinstrument_profiler import ProfilerMiddleware
+from security_headers import SecurityHeadersMiddleware
+
+
+# Reference copies of the BaseHTTPMiddleware versions being replaced
+class LegacySecurityHeadersMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        response: Response = await call_next(request)
+        if request.url.path.startswith("/docs") or request.url.path.startswith("/redoc"):
+            response.headers["Content-Security-Policy"] = (
+                "default-src 'self'; "
+                "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
+                "style-src 'self' 'unsafe-inline';"
+            )
+        else:
+            response.headers["Content-Security-Policy"] = "default-src 'self';"
+            response.headers["X-Content-Type-Options"] = "nosniff"
+            response.headers["X-Frame-Options"] = "DENY"
+            response.headers["Strict-Transport-Security"] = "max-age=63072000; includeSubDomains; preload"
+            response.headers["X-XSS-Protection"] = "0"
+            response.headers["Referrer-Policy"] = "no-referrer"
+        return response
+
+class LegacyPassthroughMiddleware(BaseHTTPMiddleware):
+    # The old profiler's BaseHTTPMiddleware overhead, without the profiling itself
+    async def dispatch(self, request: Request, call_next):
+        return await call_next(request)
+
+
+def build_app(stack):
+    app = FastAPI()
+
+    @app.get("/books/{book_id}")
+    async def read_book(book_id: int):
+        return {"ID": book_id}
+
+    if stack == "legacy":
+        app.add_middleware(LegacySecurityHeadersMiddleware)
+        app.add_middleware(LegacyPassthroughMiddleware)
+    elif stack == "asgi":
+        app.add_middleware(SecurityHeadersMiddleware, enabled=True)
+        app.add_middleware(ProfilerMiddleware, enabled=True, sample_every=10 ** 9)  # sampling path, never profiles
+    elif stack == "asgi-profiler-off":
+        app.add_middleware(SecurityHeadersMiddleware, enabled=True)
+    return app
+
+async def call(app, path):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": b"", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80)
+    }
+    sent = []
+    finished = asyncio.Event()
+    request_received = False
+
+    async def receive():
+        # Like a real server: the body once, then block until the response is done
+        nonlocal request_received
+        if not request_received:
+            request_received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "http.response.body" and not message.get("more_body", False):
+            finished.set()
+
+    await app(scope, receive, send)
+    return sent
+
+async def run(stack, requests, concurrency):
+    app = build_app(stack)
+    await call(app, "/books/1")  # warm up route compilation and middleware stack
+    remaining = iter(range(requests))
+
+    async def worker():
+        for i in remaining:
+            await call(app, f"/books/{i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return elapsed / requests * 1e6, requests / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for stack in ("none", "legacy", "asgi", "asgi-profiler-off"):
+        results[stack] = asyncio.run(run(stack, args.requests, args.concurrency))
+        per_request, throughput = results[stack]
+        print(f"{stack:>18}: {per_request:8.1f} us/request  {throughput:10.0f} req/s")
+
+    baseline = results["none"][0]
+    for stack in ("legacy", "asgi", "asgi-profiler-off"):
+        print(f"{stack:>18}: middleware overhead {results[stack][0] - baseline:8.1f} us/request")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+
+class LoadAbandoned(Exception):
+    """The shared load was cancelled with the request that started it."""
+
+
+class LRUCache:
+    """Bounded read-through cache with LRU eviction and a per-entry TTL.
+
+    Concurrent misses for the same key share one in-flight load, so a burst of
+    requests for a cold key costs a single fetch.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._pending = {}  # key -> future of the in-flight load
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key, loader):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+            self.expirations += 1
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except LoadAbandoned:
+                # Its caller went away mid-load; load again, or join whoever already does
+                return await self.get_or_load(key, loader)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+            # Cancellation belongs to this caller alone: waiters are told to load for themselves
+            future.set_exception(LoadAbandoned() if isinstance(e, asyncio.CancelledError) else e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        # An invalidation during the load drops the pending marker; the result
+        # may already be stale, so hand it to the waiters but don't keep it
+        if self._pending.get(key) is future:
+            del self._pending[key]
+            self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def _store(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key):
+        # The cached value if it is fresh; never loads, so a miss costs nothing
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def invalidate(self, *keys):
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+            self._pending.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._pending.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0
+        }
+
+
+# Formatted GET /books/{book_id} responses, keyed by book id
+book_cache = LRUCache(
+    max_entries=int(os.getenv("BOOK_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.getenv("BOOK_CACHE_TTL", "60"))
+)
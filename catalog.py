@@ -0,0 +1,429 @@
+"""Bulk import and export of the book catalog.
+
+Files are read and written incrementally, so memory use does not grow with
+the file size. JSON arrays (including Mongo extended-JSON exports such as
+pythonlib.books.json), NDJSON and CSV are supported; the format follows the
+file extension unless --format is given.
+
+    python catalog.py import pythonlib.books.json
+    python catalog.py import books.ndjson --mode upsert --workers 8 --rejects rejected.ndjson
+    python catalog.py import books.csv --resume
+    python catalog.py export books.ndjson
+
+Records are validated against models.Book in batches, with ids normalized to
+ints first. Valid batches are written by bounded concurrent workers, using
+unordered inserts that skip existing ids. With --mode upsert, existing books
+are updated instead of skipped.
+
+Progress is saved to a checkpoint next to the source. After a failure, run
+again with --resume to skip the records that were already written. Writes
+are idempotent, so records after the checkpoint that did get written are
+simply seen again. With the memory backend the checkpoint is only saved
+together with the MEMORY_SNAPSHOT_PATH snapshot.
+
+Writes go through the storage repositories of STORAGE_BACKEND. A running API
+server picks up imported books in search after its next restart.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from json.decoder import WHITESPACE
+import orjson
+from bson import json_util
+from pydantic import ValidationError
+from models import Book
+
+FORMATS = ('json', 'ndjson', 'csv')
+EXTENSIONS = {'.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv'}
+CHUNK_SIZE = 1 << 20  # characters read at a time from JSON arrays
+NUMBER_TAIL = frozenset('.eE+-0123456789')  # what may follow a number cut at a chunk boundary
+PROGRESS_INTERVAL = 2.0  # seconds between progress lines and checkpoint saves
+BOOK_FIELDS = tuple(Book.__fields__)
+BOOK_TYPES = tuple((name, field.outer_type_) for name, field in Book.__fields__.items())
+STAT_NAMES = ('read', 'inserted', 'updated', 'duplicates', 'invalid')
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    fmt = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise SystemExit(f"Cannot tell the format of {path}; pass --format ({', '.join(FORMATS)})")
+    return fmt
+
+
+# Readers: each yields raw records one at a time
+
+def read_json_array(f):
+    # Decodes one element at a time; only the current chunk and element are held in memory
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+
+    def skip_whitespace():
+        nonlocal buffer, pos, eof
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer) or eof:
+                return
+            buffer, pos = f.read(CHUNK_SIZE), 0
+            eof = not buffer
+
+    skip_whitespace()
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError("expected a JSON array")
+    pos += 1
+    skip_whitespace()
+    if buffer[pos:pos + 1] == ']':
+        return
+    while True:
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A value that ends with the buffer may continue in the next chunk, and so
+                # may a number cut in its fraction or exponent ("1." + "5", "2e" + "3")
+                if eof or end < len(buffer) and (buffer[end] not in '.eE' or not NUMBER_TAIL.issuperset(buffer[end:])):
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            chunk = f.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+        pos = end
+        yield value
+        skip_whitespace()
+        separator = buffer[pos:pos + 1]
+        pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"expected ',' or ']' in JSON array, got {separator!r}")
+        skip_whitespace()
+
+def read_ndjson(f):
+    for line in f:
+        if line.strip():
+            yield orjson.loads(line)
+
+def read_records(f, fmt):
+    if fmt == 'json':
+        return read_json_array(f)
+    if fmt == 'ndjson':
+        return read_ndjson(f)
+    return csv.DictReader(f)
+
+
+# Validation
+
+def normalize_id(value):
+    # Exports carry ids as strings ("102") or floats (102.0); models.Book wants ints
+    if isinstance(value, bool):
+        raise ValueError(f"invalid id {value!r}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return normalize_id(float(value)) if '.' in value else int(value)
+        except ValueError:
+            pass
+    raise ValueError(f"invalid id {value!r}")
+
+def normalize_record(record):
+    # Drop the exported ObjectId and unwrap extended-JSON values such as {"$numberInt": "1949"}
+    if not isinstance(record, dict):
+        raise ValueError(f"expected an object, got {type(record).__name__}")
+    record.pop('_id', None)
+    for key, value in record.items():
+        if isinstance(value, dict) and len(value) == 1 and next(iter(value)).startswith('$'):
+            record[key] = json_util.object_hook(value)
+    if 'id' not in record:
+        raise ValueError("missing id")
+    record['id'] = normalize_id(record['id'])
+    return record
+
+def describe_error(error):
+    if isinstance(error, ValidationError):
+        return '; '.join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+    return str(error)
+
+def validate_record(record):
+    record = normalize_record(record)
+    # Records whose fields already have the exact types would come out of pydantic
+    # unchanged; only the rest pay for its coercion (CSV strings, for example)
+    if all(type(record.get(name)) is field_type for name, field_type in BOOK_TYPES):
+        return {name: record[name] for name in BOOK_FIELDS}
+    return Book.parse_obj(record).dict()
+
+def validate_batch(records, first_number):
+    # Returns (book documents, [(record number, error, record)])
+    documents, invalid = [], []
+    for number, record in enumerate(records, first_number):
+        try:
+            documents.append(validate_record(record))
+        except (ValidationError, ValueError, TypeError) as e:
+            invalid.append((number, describe_error(e), record))
+    return documents, invalid
+
+
+# Resumability
+
+class Checkpoint:
+    """Number of leading source records that are fully written, plus the running totals."""
+
+    def __init__(self, path, source, fmt, mode):
+        self.path = path
+        stat = os.stat(source)
+        # A checkpoint only applies to the same, unchanged source
+        self.identity = {'source': os.path.abspath(source), 'size': stat.st_size, 'mtime': stat.st_mtime, 'format': fmt, 'mode': mode}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0, {}
+        with open(self.path) as f:
+            state = json.load(f)
+        if state['identity'] != self.identity:
+            raise SystemExit(f"{self.path} belongs to a different source, format or mode; remove it to start over")
+        return state['records'], state['stats']
+
+    def save(self, records, stats):
+        # Written to a temporary file first so a crash never leaves a torn checkpoint
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump({'identity': self.identity, 'records': records, 'stats': stats}, f)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ImportProgress:
+    """Totals of an import, and the watermark of batches that are fully written.
+
+    Batches finish out of order; the watermark only advances over a contiguous
+    run of finished batches, so every record before it is known to be stored.
+    The checkpoint gets the totals up to the watermark, so records written
+    again after a resume are not counted twice.
+    """
+
+    def __init__(self, records=0, stats=None):
+        self.stats = dict.fromkeys(STAT_NAMES, 0) | (stats or {})  # everything so far, for progress lines
+        self.committed_stats = dict(self.stats)  # up to the watermark, for the checkpoint
+        self.committed = records
+        self.batches = {}  # sequence -> (records consumed through the end of the batch, its counts)
+        self.finished = set()
+        self.next_sequence = 0
+        self.started = time.perf_counter()
+        self.start_count = self.stats['read']
+
+    def add_batch(self, sequence, end):
+        self.batches[sequence] = (end, dict.fromkeys(STAT_NAMES, 0))
+
+    def count(self, sequence, name, n):
+        self.stats[name] += n
+        self.batches[sequence][1][name] += n
+
+    def finish_batch(self, sequence):
+        self.finished.add(sequence)
+        while self.next_sequence in self.finished:
+            self.finished.remove(self.next_sequence)
+            self.committed, counts = self.batches.pop(self.next_sequence)
+            for name, n in counts.items():
+                self.committed_stats[name] += n
+            self.next_sequence += 1
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        rate = (self.stats['read'] - self.start_count) / elapsed if elapsed else 0.0
+        s = self.stats
+        print(f"{'done' if final else 'progress'}: read {s['read']}  inserted {s['inserted']}  updated {s['updated']}  "
+              f"duplicates {s['duplicates']}  invalid {s['invalid']}  {rate:,.0f} records/s  {elapsed:.1f}s", file=sys.stderr)
+
+
+# Import
+
+async def write_batches(repo, queue, mode, progress):
+    from service import new_book_document
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        sequence, documents = item
+        now = datetime.now(timezone.utc)
+        inserted, duplicates = await repo.books.insert_unique([new_book_document(doc, now) for doc in documents])
+        progress.count(sequence, 'inserted', len(inserted))
+        if duplicates and mode == 'upsert':
+            by_id = {doc['id']: doc for doc in documents}
+            updates = {book_id: {field: by_id[book_id][field] for field in BOOK_FIELDS if field != 'id'} for book_id in duplicates}
+            progress.count(sequence, 'updated', await repo.books.update_fields(updates))
+        else:
+            progress.count(sequence, 'duplicates', len(duplicates))
+        progress.finish_batch(sequence)
+
+async def report_progress(progress, checkpoint, durable):
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        progress.report()
+        if durable:
+            checkpoint.save(progress.committed, progress.committed_stats)
+
+async def import_books(repo, path, fmt, mode, batch_size, workers, progress, checkpoint, rejects_path, durable):
+    skip = progress.committed
+    # Bounded, so parsing never runs more than a couple of batches ahead of the writers
+    queue = asyncio.Queue(maxsize=workers * 2)
+    writers = [asyncio.create_task(write_batches(repo, queue, mode, progress)) for _ in range(workers)]
+    reporter = asyncio.create_task(report_progress(progress, checkpoint, durable))
+    rejects = open(rejects_path, 'ab') if rejects_path else None
+    try:
+        with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8') as f:
+            records = read_records(f, fmt)
+            number, sequence, batch = 0, 0, []
+            for record in records:
+                number += 1
+                if number <= skip:
+                    continue
+                batch.append(record)
+                if len(batch) < batch_size:
+                    continue
+                await submit_batch(queue, progress, sequence, batch, number, rejects, writers)
+                sequence, batch = sequence + 1, []
+            if batch:
+                await submit_batch(queue, progress, sequence, batch, number, rejects, writers)
+        for _ in writers:
+            await put_batch(queue, None, writers)
+        await asyncio.gather(*writers)
+    finally:
+        reporter.cancel()
+        for writer in writers:
+            writer.cancel()
+        if rejects is not None:
+            rejects.close()
+
+async def submit_batch(queue, progress, sequence, records, end, rejects, writers):
+    documents, invalid = validate_batch(records, end - len(records) + 1)
+    # Only the first few errors are printed; --rejects keeps all of them
+    printed = progress.stats['invalid']
+    progress.add_batch(sequence, end)
+    progress.count(sequence, 'read', len(records))
+    progress.count(sequence, 'invalid', len(invalid))
+    for number, error, record in invalid:
+        if printed < 10:
+            print(f"record {number}: {error}", file=sys.stderr)
+            printed += 1
+        if rejects is not None:
+            rejects.write(orjson.dumps({'record': number, 'error': error, 'data': record}, default=str) + b'\n')
+    if not documents:
+        progress.finish_batch(sequence)
+        return
+    await put_batch(queue, (sequence, documents), writers)
+
+async def put_batch(queue, item, writers):
+    # A failed writer would otherwise leave the queue full and the reader waiting forever
+    for writer in writers:
+        if writer.done():
+            writer.result()
+    put = asyncio.ensure_future(queue.put(item))
+    done, _ = await asyncio.wait([put, *writers], return_when=asyncio.FIRST_COMPLETED)
+    if put not in done:
+        put.cancel()
+        for writer in done:
+            writer.result()
+
+
+# Export
+
+async def export_books(repo, path, fmt, batch_size):
+    # Keyset scan in id order: one batch of documents in memory at a time
+    count = 0
+    start = time.perf_counter()
+    to_stdout = path == '-'
+    if fmt == 'csv':
+        out = sys.stdout if to_stdout else open(path, 'w', newline='', encoding='utf-8')
+        writer = csv.writer(out)
+        writer.writerow(BOOK_FIELDS)
+    else:
+        out = sys.stdout.buffer if to_stdout else open(path, 'wb', buffering=CHUNK_SIZE)
+        if fmt == 'json':
+            out.write(b'[')
+    try:
+        async for book in repo.books.scan(batch_size=batch_size, fields=BOOK_FIELDS):
+            if fmt == 'csv':
+                writer.writerow([book.get(field) for field in BOOK_FIELDS])
+            elif fmt == 'json':
+                out.write((b',\n' if count else b'\n') + orjson.dumps(book))
+            else:
+                out.write(orjson.dumps(book) + b'\n')
+            count += 1
+        if fmt == 'json':
+            out.write(b'\n]\n')
+    finally:
+        if not to_stdout:
+            out.close()
+    print(f"Exported {count} books in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return count
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of the book catalog")
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help="load books from a JSON, NDJSON or CSV file")
+    importer.add_argument('path')
+    importer.add_argument('--format', choices=FORMATS)
+    importer.add_argument('--mode', choices=('insert', 'upsert'), default='insert',
+                          help="insert skips books whose id exists; upsert updates them")
+    importer.add_argument('--batch-size', type=int, default=1000)
+    importer.add_argument('--workers', type=int, default=4, help="concurrent write batches")
+    importer.add_argument('--resume', action='store_true', help="skip the records recorded in the checkpoint")
+    importer.add_argument('--checkpoint', help="checkpoint file (default: <path>.checkpoint)")
+    importer.add_argument('--rejects', help="append invalid records to this NDJSON file")
+    exporter = commands.add_parser('export', help="write every book to a JSON, NDJSON or CSV file ('-' for stdout)")
+    exporter.add_argument('path')
+    exporter.add_argument('--format', choices=FORMATS)
+    exporter.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    fmt = detect_format(args.path, args.format) if args.path != '-' or args.format else 'ndjson'
+    from storage import STORAGE_BACKEND, repo
+    from memory_repository import MEMORY_SNAPSHOT_PATH
+    if STORAGE_BACKEND == 'memory' and not MEMORY_SNAPSHOT_PATH:
+        raise SystemExit("The memory backend keeps nothing without MEMORY_SNAPSHOT_PATH")
+    await repo.initialize()
+
+    if args.command == 'export':
+        try:
+            await export_books(repo, args.path, fmt, args.batch_size)
+        finally:
+            await repo.close()
+        return
+
+    checkpoint = Checkpoint(args.checkpoint or f"{args.path}.checkpoint", args.path, fmt, args.mode)
+    records, stats = checkpoint.load() if args.resume else (0, {})
+    if records:
+        print(f"Resuming after record {records}", file=sys.stderr)
+    progress = ImportProgress(records, stats)
+    # The memory backend only persists at close, so its checkpoint is saved with the snapshot
+    durable = STORAGE_BACKEND != 'memory'
+    completed = False
+    try:
+        await import_books(repo, args.path, fmt, args.mode, args.batch_size, max(args.workers, 1),
+                           progress, checkpoint, args.rejects, durable)
+        completed = True
+    finally:
+        await repo.close()
+        if completed:
+            checkpoint.remove()
+            progress.report(final=True)
+        else:
+            checkpoint.save(progress.committed, progress.committed_stats)
+            print(f"Import stopped; the first {progress.committed} records are stored. "
+                  f"Run again with --resume to continue.", file=sys.stderr)
+
+if __name__ == "__main__":
+    asyncio.run(main())
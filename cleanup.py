@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "1000"))
+CLEANUP_KIND_PREFIX = "cleanup:"
+
+
+def chunks(items, size=CLEANUP_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class CleanupTasks:
+    """Runs dependent-collection cleanup in the background and remembers its status.
+
+    The status is also recorded in the jobs collection (kind "cleanup:<kind>",
+    no heartbeat, so the job runner never claims it), which lets any worker
+    answer GET /cleanup/{id}. A cleanup is not resumed after a restart.
+    """
+
+    def __init__(self, history=1000):
+        self.history = history
+        self.tasks = OrderedDict()  # task id -> status, oldest first
+        self._running = set()
+
+    async def start(self, repo, kind, job):
+        # job is called with a dict it fills with per-collection deleted counts
+        task_id = uuid.uuid4().hex
+        status = {
+            'id': task_id,
+            'kind': kind,
+            'status': 'running',
+            'deleted': {},
+            'started_at': datetime.now(timezone.utc),
+            'finished_at': None,
+            'error': None
+        }
+        self.tasks[task_id] = status
+        while len(self.tasks) > self.history:
+            self.tasks.popitem(last=False)
+        try:
+            await repo.jobs.create({**status, 'kind': CLEANUP_KIND_PREFIX + kind, 'owner': None, 'heartbeat': None}, [])
+        except Exception:
+            logger.exception("Could not record cleanup task %s; only this worker can report it", task_id)
+        task = asyncio.create_task(self._run(repo, status, job))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return task_id
+
+    async def _run(self, repo, status, job):
+        try:
+            await job(status['deleted'])
+            status['status'] = 'done'
+        except Exception as e:
+            logger.exception("Cleanup task %s (%s) failed", status['id'], status['kind'])
+            status['status'] = 'failed'
+            status['error'] = str(e)
+        finally:
+            status['finished_at'] = datetime.now(timezone.utc)
+        try:
+            await repo.jobs.finish(status['id'], {field: status[field] for field in ('status', 'deleted', 'finished_at', 'error')})
+        except Exception:
+            logger.exception("Could not record the outcome of cleanup task %s", status['id'])
+
+    async def get(self, repo, task_id):
+        # Tasks started by other workers (or before a restart) come from the jobs collection
+        status = self.tasks.get(task_id)
+        if status is not None:
+            return status
+        record = await repo.jobs.get(task_id)
+        if record is None or not record['kind'].startswith(CLEANUP_KIND_PREFIX):
+            return None
+        status = {field: record[field] for field in ('id', 'kind', 'status', 'deleted', 'started_at', 'finished_at', 'error')}
+        status['kind'] = status['kind'].removeprefix(CLEANUP_KIND_PREFIX)
+        return status
+
+    async def drain(self):
+        # Let in-flight cleanups finish before shutdown
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+
+cleanup_tasks = CleanupTasks()
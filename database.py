@@ -1,23 +1,207 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.monitoring import ConnectionPoolListener
+from metrics import command_metrics
+from repository import JOB_RETENTION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017/")
+MONGODB_DB = os.getenv("MONGODB_DB", "pythonlib")
+# Connection pool settings; min connections are opened before traffic is accepted
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# Unset means wait for a free connection indefinitely, like the driver default
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS")
+
+# Indexes every collection needs; created at application startup
+INDEXES = {
+    'books': [IndexModel([('id', ASCENDING)], unique=True)],
+    'users': [IndexModel([('id', ASCENDING)], unique=True)],
+    # (book_id, _id) serves both book lookups and the newest-first review pages
+    'reviews': [IndexModel([('book_id', ASCENDING), ('_id', DESCENDING)]), IndexModel([('user_id', ASCENDING)])],
+    # One progress row per (user, book); the compound index also serves user_id lookups
+    'reading_progress': [IndexModel([('user_id', ASCENDING), ('book_id', ASCENDING)], unique=True), IndexModel([('book_id', ASCENDING)])],
+    # (status, heartbeat) finds abandoned jobs; the TTL indexes only expire finished documents
+    'jobs': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('status', ASCENDING), ('heartbeat', ASCENDING)]),
+        IndexModel([('finished_at', ASCENDING)], expireAfterSeconds=JOB_RETENTION_SECONDS)
+    ],
+    'job_chunks': [
+        IndexModel([('job_id', ASCENDING), ('index', ASCENDING)], unique=True),
+        IndexModel([('finished_at', ASCENDING)], expireAfterSeconds=JOB_RETENTION_SECONDS)
+    ]
+}
+
+
+def client_options(min_pool_size=MONGODB_MIN_POOL_SIZE):
+    # Shared by the API's Motor client and the synchronous tools
+    options = {
+        'maxPoolSize': MONGODB_MAX_POOL_SIZE,
+        'minPoolSize': min_pool_size,
+        'connectTimeoutMS': MONGODB_CONNECT_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': MONGODB_SERVER_SELECTION_TIMEOUT_MS
+    }
+    if MONGODB_WAIT_QUEUE_TIMEOUT_MS:
+        options['waitQueueTimeoutMS'] = int(MONGODB_WAIT_QUEUE_TIMEOUT_MS)
+    return options
+
+
+class PoolStats(ConnectionPoolListener):
+    """Connection pool counters and checkout wait times, fed by driver events.
+
+    Events arrive on the driver's executor threads, so updates take a lock.
+    A checkout's start and finish happen on the same thread, which is what
+    the thread-local start time relies on.
+    """
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.waits = deque(maxlen=window)  # recent checkout waits in ms
+        self.created = self.closed = 0
+        self.checked_out = self.checked_in = 0
+        self.failed = {}  # reason -> count
+        self.cleared = 0
+        self.max_wait_ms = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self.lock:
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.failed[event.reason] = self.failed.get(event.reason, 0) + 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self.local, 'started', None)
+        with self.lock:
+            self.checked_out += 1
+            if started is not None:
+                wait_ms = (time.perf_counter() - started) * 1000
+                self.waits.append(wait_ms)
+                self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_in += 1
+
+    def snapshot(self):
+        with self.lock:
+            waits = sorted(self.waits)
+            return {
+                'open_connections': self.created - self.closed,
+                'in_use': self.checked_out - self.checked_in,
+                'connections_created': self.created,
+                'checkouts': self.checked_out,
+                'checkout_failures': dict(self.failed),
+                'pool_cleared': self.cleared,
+                'checkout_wait_ms': {
+                    'recent': len(waits),
+                    'p50': round(waits[len(waits) // 2], 3) if waits else None,
+                    'p99': round(waits[min(int(len(waits) * 0.99), len(waits) - 1)], 3) if waits else None,
+                    'max': round(self.max_wait_ms, 3)
+                }
+            }
+
 
 class MongoDB:
-    def __init__(self, db_name='pythonlib', collection_names=None):
-        self.client = AsyncIOMotorClient('mongodb://localhost:27017/')
-        self.db = self.client[db_name]
-        
+    """The managed Motor client: created by connect() inside the app lifespan, closed at shutdown."""
+
+    def __init__(self, db_name=MONGODB_DB, collection_names=None):
+        self.db_name = db_name
+        self.client = None
+        self.pool_stats = PoolStats()
+        self.warm_up_ms = None
+
         # Set default collection names if not provided
         if collection_names is None:
             collection_names = {
                 'books': 'books',
                 'reviews': 'reviews',
                 'users': 'users',
-                'reading_progress': 'reading_progress'
+                'reading_progress': 'reading_progress',
+                'jobs': 'jobs',
+                'job_chunks': 'job_chunks'
             }
-        
-        self.books = self.db[collection_names['books']]
-        self.reviews = self.db[collection_names['reviews']]
-        self.users = self.db[collection_names['users']]
-        self.reading_progress = self.db[collection_names['reading_progress']]
+        self.collection_names = collection_names
+
+    def connect(self):
+        # Creating the client inside the running event loop binds it to that loop
+        if self.client is not None:
+            return
+        # command_metrics times every command per collection for /metrics
+        self.client = AsyncIOMotorClient(MONGODB_URL, event_listeners=[self.pool_stats, command_metrics], **client_options())
+        self.db = self.client[self.db_name]
+        for name, collection_name in self.collection_names.items():
+            setattr(self, name, self.db[collection_name])
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    async def ping(self):
+        # Round-trip time of a ping, in milliseconds
+        start = time.perf_counter()
+        await self.client.admin.command('ping')
+        return (time.perf_counter() - start) * 1000
+
+    async def warm_up(self, connections=MONGODB_MIN_POOL_SIZE):
+        # Concurrent pings each check out their own connection, so the pool holds at
+        # least this many sockets before the first request instead of opening them on demand
+        start = time.perf_counter()
+        await asyncio.gather(*(self.ping() for _ in range(max(connections, 1))))
+        self.warm_up_ms = round((time.perf_counter() - start) * 1000, 3)
+        logger.info("MongoDB pool warmed up with %d connections in %.1f ms", max(connections, 1), self.warm_up_ms)
+
+    async def create_indexes(self):
+        # create_indexes is a no-op for indexes that already exist
+        for name, indexes in INDEXES.items():
+            await getattr(self, name).create_indexes(indexes)
+
+    async def health(self):
+        report = {'backend': 'mongo', 'warm_up_ms': self.warm_up_ms, 'pool': self.pool_stats.snapshot()}
+        if self.client is None:
+            return {'status': 'unavailable', 'error': 'not connected', **report}
+        try:
+            report['ping_ms'] = round(await self.ping(), 3)
+        except Exception as e:
+            logger.warning("MongoDB health check failed: %s", e)
+            return {'status': 'unavailable', 'error': str(e), **report}
+        return {'status': 'ok', **report}
 
-# Create an instance of the MongoDB class
+# Create an instance of the MongoDB class; the client is opened by connect()
 db = MongoDB()
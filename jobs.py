@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Items per chunk, and chunks this worker processes at once across all of its jobs
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "500"))
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+# A job whose heartbeat is older than this is taken over by another (or a restarted) worker
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Runs of a job that end without finishing it (crash, unexpected error) before it is marked failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+RELEASED = datetime(1970, 1, 1, tzinfo=timezone.utc)  # heartbeat of a job any worker may claim
+INTERRUPTED = "interrupted by a restart while running; not retried because its writes may already be applied"
+
+
+def chunk_result(result):
+    # The lists of ids in a service response are the per-item outcomes; the message is dropped
+    return {key: value for key, value in result.items() if isinstance(value, list)}
+
+def describe_error(error):
+    return str(getattr(error, 'detail', None) or error) or type(error).__name__
+
+
+class JobRunner:
+    """Runs large write requests as persisted background jobs.
+
+    A job's items are stored in chunks and processed one chunk at a time by
+    the service function behind the endpoint; a semaphore bounds how many
+    chunks this worker runs at once. Job state lives in the repository, and
+    the worker running a job renews its heartbeat. Jobs whose heartbeat goes
+    stale (the worker died or shut down) are claimed by whichever worker
+    notices first, and continue with their unfinished chunks.
+    """
+
+    def __init__(self, concurrency=JOB_CONCURRENCY, chunk_size=JOB_CHUNK_SIZE, lease=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.chunk_size = max(chunk_size, 1)
+        self.lease = lease
+        self.max_attempts = max(max_attempts, 1)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.kinds = {}  # kind -> (model, handler, retry_safe)
+        self.active = {}  # job id -> task
+        self.stopping = False
+
+    def register(self, kind, model, handler, retry_safe):
+        # handler is the service function, called with a list of model instances.
+        # retry_safe: a chunk interrupted mid-way may run again without applying anything twice
+        self.kinds[kind] = (model, handler, retry_safe)
+
+    async def submit(self, repo, kind, items):
+        now = datetime.now(timezone.utc)
+        job_id = uuid.uuid4().hex
+        chunks = [
+            {'job_id': job_id, 'index': index, 'start': start, 'size': len(items[start:start + self.chunk_size]),
+             'items': items[start:start + self.chunk_size], 'state': 'pending', 'result': None, 'error': None}
+            for index, start in enumerate(range(0, len(items), self.chunk_size))
+        ]
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'status': 'queued',
+            'total': len(items),
+            'processed': 0,
+            'chunks': len(chunks),
+            'failed_chunks': 0,
+            'created_at': now,
+            'started_at': None,
+            'finished_at': None,
+            'error': None,
+            'attempts': 1,  # runs started; every claim adds one
+            'owner': self.owner,
+            'heartbeat': now
+        }
+        await repo.jobs.create(job, chunks)
+        self.start(repo, job_id)
+        return job
+
+    def start(self, repo, job_id):
+        task = asyncio.create_task(self._run(repo, job_id))
+        self.active[job_id] = task
+        task.add_done_callback(lambda _: self.active.pop(job_id, None))
+
+    async def _run(self, repo, job_id):
+        try:
+            job = await repo.jobs.get(job_id)
+            if job is None:
+                return
+            if job.get('attempts', 1) > self.max_attempts:
+                # Each earlier run ended without finishing it; another would too
+                await repo.jobs.finish(job_id, {
+                    'status': 'failed',
+                    'error': f"gave up after {self.max_attempts} attempts; last error: {job.get('error')}",
+                    'finished_at': datetime.now(timezone.utc)
+                })
+                logger.error("Job %s failed after %d attempts", job_id, self.max_attempts)
+                return
+            if job.get('kind') not in self.kinds:
+                await repo.jobs.finish(job_id, {'status': 'failed', 'error': f"unknown job kind {job.get('kind')!r}", 'finished_at': datetime.now(timezone.utc)})
+                return
+            model, handler, retry_safe = self.kinds[job['kind']]
+            for chunk in await repo.jobs.chunks(job_id, states=('pending', 'running'), fields=('index', 'state')):
+                if chunk['state'] == 'running' and not retry_safe:
+                    await repo.jobs.set_chunk(job_id, chunk['index'], 'failed', error=INTERRUPTED)
+                    continue
+                async with self.semaphore:
+                    if self.stopping:
+                        # Handed back with its remaining chunks; the next worker to start picks it up.
+                        # A clean hand-back does not use up an attempt.
+                        await repo.jobs.update(job_id, {'heartbeat': RELEASED, 'owner': None, 'attempts': job.get('attempts', 1) - 1})
+                        return
+                    if job['status'] == 'queued':
+                        job['status'] = 'running'
+                        await repo.jobs.update(job_id, {'status': 'running', 'started_at': datetime.now(timezone.utc)})
+                    await self._run_chunk(repo, job_id, chunk['index'], model, handler)
+
+            failed = sum(chunk['state'] == 'failed' for chunk in await repo.jobs.chunks(job_id, fields=('state',)))
+            await repo.jobs.finish(job_id, {
+                'status': 'failed' if failed else 'done',
+                'failed_chunks': failed,
+                'error': f"{failed} of {job['chunks']} chunks failed" if failed else None,
+                'finished_at': datetime.now(timezone.utc)
+            })
+            logger.info("Job %s (%s) finished: %d items, %d failed chunks", job_id, job['kind'], job['total'], failed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Left unfinished; once its heartbeat goes stale it is claimed and resumed,
+            # up to max_attempts runs
+            logger.exception("Job %s stopped unexpectedly", job_id)
+            try:
+                await repo.jobs.update(job_id, {'error': describe_error(e)})
+            except Exception:
+                logger.exception("Could not record the error of job %s", job_id)
+
+    async def _run_chunk(self, repo, job_id, index, model, handler):
+        chunk = await repo.jobs.chunk(job_id, index)
+        await repo.jobs.set_chunk(job_id, index, 'running')
+        try:
+            result = await handler([model(**item) for item in chunk['items']])
+        except Exception as e:
+            logger.exception("Chunk %d of job %s failed", index, job_id)
+            await repo.jobs.set_chunk(job_id, index, 'failed', error=describe_error(e), processed=chunk['size'])
+            return
+        await repo.jobs.set_chunk(job_id, index, 'done', result=chunk_result(result), processed=chunk['size'])
+
+    async def run(self, repo):
+        # Background task: renew the heartbeat of running jobs and take over abandoned ones
+        while True:
+            try:
+                now = datetime.now(timezone.utc)
+                await repo.jobs.heartbeat(list(self.active), self.owner, now)
+                stale_before = now - timedelta(seconds=self.lease)
+                while not self.stopping and (job_id := await repo.jobs.claim(self.owner, stale_before, now)):
+                    # One of our own jobs whose heartbeat lapsed is already running
+                    if job_id not in self.active:
+                        logger.info("Resuming job %s", job_id)
+                        self.start(repo, job_id)
+            except Exception:
+                logger.exception("Job heartbeat failed")
+            await asyncio.sleep(self.lease / 3)
+
+    async def stop(self):
+        # Running chunks finish; unfinished jobs are released for the next worker
+        self.stopping = True
+        if self.active:
+            await asyncio.gather(*self.active.values(), return_exceptions=True)
+
+
+job_runner = JobRunner()
@@ -1,8 +1,10 @@
 from pymongo import MongoClient
+from database import MONGODB_URL, MONGODB_DB, client_options
 
 class BookManager:
-    def __init__(self, db_name='pythonlib', collection_name='books'):
-        self.client = MongoClient('mongodb://localhost:27017/')
+    def __init__(self, db_name=MONGODB_DB, collection_name='books'):
+        # Same server and pool settings as the API; a CLI needs no pre-opened connections
+        self.client = MongoClient(MONGODB_URL, **client_options(min_pool_size=0))
         self.db = self.client[db_name]
         self.books = self.db[collection_name]
 
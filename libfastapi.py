@@ -1,28 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from pymongo import MongoClient
-from bson import ObjectId
+from typing import Optional
+import orjson
+import models
+from models import Book
+from storage import repo
+from cleanup import cleanup_tasks
+from service import add_books, update_books, delete_books
 
-app = FastAPI()
+# Storage goes through the same async repositories as the main API, so no
+# endpoint blocks the event loop on a database call. Writes go through the
+# same service functions too, so books get their version and review summary,
+# the book cache and search index follow, and deletes cascade.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await repo.initialize()
+    yield
+    await cleanup_tasks.drain()
+    await repo.close()
 
-# MongoDB setup
-class MongoDB:
-    def __init__(self, db_name='pythonlib', collection_name='books'):
-        self.client = MongoClient('mongodb://localhost:27017/')
-        self.db = self.client[db_name]
-        self.books = self.db[collection_name]
-
-db = MongoDB()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Models
-class Book(BaseModel):
-    id: str
-    title: str
-    author: str
-    year: int
-    isbn: str
-
 class UpdateBook(BaseModel):
     title: Optional[str] = None
     author: Optional[str] = None
@@ -30,6 +31,9 @@ class UpdateBook(BaseModel):
     isbn: Optional[str] = None
 
 # Utility functions
+BOOK_FIELDS = ('id', 'title', 'author', 'year', 'isbn')
+STREAM_BATCH_SIZE = 500  # books per chunk written by /books/all
+
 def format_book(book):
     return {
         'ID': book['id'],
@@ -39,58 +43,72 @@ def format_book(book):
         'ISBN': book['isbn']
     }
 
+async def stream_catalog(first, books):
+    # The same JSON array as before, written a batch of books at a time
+    batch = [b'[', orjson.dumps(format_book(first))]
+    async for book in books:
+        batch += (b',', orjson.dumps(format_book(book)))
+        if len(batch) >= 2 * STREAM_BATCH_SIZE:
+            yield b''.join(batch)
+            batch = []
+    batch.append(b']')
+    yield b''.join(batch)
+
 # Endpoints
 @app.post("/books/")
 async def add_book(book: Book):
-    if db.books.find_one({'id': book.id}):
+    # The unique index rejects an existing id, so there is no separate lookup
+    if (await add_books([book]))['duplicates']:
         raise HTTPException(status_code=400, detail=f"Book with ID {book.id} already exists!")
-    
-    book_data = book.dict()
-    db.books.insert_one(book_data)
     return {"message": f"Book '{book.title}' added successfully with ID: {book.id}"}
 
+# Declared before /books/{book_id}, which would otherwise capture "all"
+@app.get("/books/all")
+async def show_all_books():
+    books = repo.books.scan(batch_size=STREAM_BATCH_SIZE, fields=BOOK_FIELDS)
+    # The first book decides between a 404 and the streamed array
+    first = await anext(books, None)
+    if first is None:
+        raise HTTPException(status_code=404, detail="No books available in the database.")
+    return StreamingResponse(stream_catalog(first, books), media_type="application/json")
+
 @app.get("/books/{book_id}")
-async def get_book_by_id(book_id: str):
-    book = db.books.find_one({'id': book_id})
+async def get_book_by_id(book_id: int):
+    book = await repo.books.get(book_id, fields=BOOK_FIELDS)
     if book:
         return format_book(book)
     raise HTTPException(status_code=404, detail=f"No book found with ID {book_id}")
 
 @app.get("/books/")
 async def get_books_by_ids(book_ids: str = Query(...)):
-    book_ids = book_ids.split(',')
-    found_books = db.books.find({'id': {'$in': book_ids}})
-    books_list = [format_book(book) for book in found_books]
+    try:
+        book_ids = [int(book_id) for book_id in book_ids.split(',')]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="book_ids must be comma-separated integers.")
+    books_list = [format_book(book) for book in await repo.books.find_many(book_ids)]
     if not books_list:
         raise HTTPException(status_code=404, detail="No books found for the given IDs.")
     return books_list
 
 @app.put("/books/{book_id}")
-async def update_book_by_id(book_id: str, book: UpdateBook):
+async def update_book_by_id(book_id: int, book: UpdateBook):
     updates = book.dict(exclude_unset=True)
     
     if not updates:
         raise HTTPException(status_code=400, detail="No updates provided.")
     
-    result = db.books.update_one({'id': book_id}, {'$set': updates})
-    if result.matched_count > 0:
+    if (await update_books([models.UpdateBook(id=book_id, **updates)]))['updated']:
         return {"message": f"Book with ID {book_id} updated successfully."}
     raise HTTPException(status_code=404, detail=f"No book found with ID {book_id}")
 
 @app.delete("/books/{book_id}")
-async def delete_book_by_id(book_id: str):
-    result = db.books.delete_one({'id': book_id})
-    if result.deleted_count > 0:
-        return {"message": f"Book with ID {book_id} removed successfully."}
+async def delete_book_by_id(book_id: int):
+    result = await delete_books([book_id])
+    if result['deleted']:
+        # Its reviews and reading progress are removed in the background
+        return {"message": f"Book with ID {book_id} removed successfully.", "cleanup_task": result['cleanup_task']}
     raise HTTPException(status_code=404, detail=f"No book found with ID {book_id}")
 
-@app.get("/books/all")
-async def show_all_books():
-    books = list(db.books.find())  # Convert the cursor to a list
-    if not books:
-        raise HTTPException(status_code=404, detail="No books available in the database.")
-    return [format_book(book) for book in books]
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000, reload=True)
@@ -1,39 +1,134 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 
-class Logger:
-    def __init__(self, name="library_log", log_file="log_file.log"):
-        self.logger = logging.getLogger(name)
-        self.logger.setLevel(logging.INFO)
+# Logging configuration, overridable through the environment
+LOG_FILE = os.getenv("LOG_FILE", "log_file.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")  # per-logger overrides, e.g. "service=WARNING,uvicorn.access=ERROR"
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN")  # e.g. "midnight"; rotates by time instead of size
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "true") == "true"
+# One file per process: rotating handlers in several processes would rename the same
+# file under each other. serve.py sets it when it runs several workers.
+LOG_FILE_PER_PROCESS = os.getenv("LOG_FILE_PER_PROCESS", "false") == "true"
+# Loggers uvicorn's default log_config gives their own console handlers
+UVICORN_LOGGERS = ('uvicorn', 'uvicorn.error', 'uvicorn.access')
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class InProcessQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records as they are, leaving all formatting to the listener thread.
+
+    The stock prepare() formats the message and traceback on the calling
+    thread so records can be pickled; this queue never leaves the process.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
 
-        # Create a StreamHandler for console output
+def log_file():
+    # log_file.log -> log_file.<pid>.log
+    if not LOG_FILE_PER_PROCESS:
+        return LOG_FILE
+    base, extension = os.path.splitext(LOG_FILE)
+    return f"{base}.{os.getpid()}{extension}"
+
+def file_handler():
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(log_file(), when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT)
+    return logging.handlers.RotatingFileHandler(log_file(), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+
+def setup_logging():
+    """Route every log record through a queue to a background writer thread.
+
+    The calling thread only checks the level and enqueues the record; JSON
+    formatting and file/console I/O happen on the listener thread. uvicorn's
+    server and access loggers are routed the same way.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    handlers = []
+    json_handler = file_handler()
+    json_handler.setFormatter(JsonLinesFormatter())
+    handlers.append(json_handler)
+    if LOG_CONSOLE:
         stream_handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        stream_handler.setFormatter(formatter)
-        self.logger.addHandler(stream_handler)
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+        handlers.append(stream_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(InProcessQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+    # Their stream handlers would write on the event loop and skip the JSON-lines file.
+    # A logger uvicorn silenced (access_log=False) has no handlers and stays silent.
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        if uvicorn_logger.handlers:
+            uvicorn_logger.handlers.clear()
+            uvicorn_logger.propagate = True
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
 
-        # Check if the log file exists, create if not
-        if not os.path.exists(log_file):
-            with open(log_file, 'w'):
-                pass  
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
 
-        # Create a FileHandler for writing logs to a file
-        file_handler = logging.FileHandler(log_file)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
+def shutdown_logging():
+    # Flush whatever is still queued and stop the writer thread
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def parse_levels(spec):
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class Logger:
+    def __init__(self, name="library_log"):
+        self.logger = logging.getLogger(name)
 
-    def log_info(self, message):
-        self.logger.info(message)
+    def log_info(self, message, *args):
+        self.logger.info(message, *args)
 
-    def log_warning(self, message):
-        self.logger.warning(message)
+    def log_warning(self, message, *args):
+        self.logger.warning(message, *args)
 
-    def log_error(self, message):
-        self.logger.error(message)
+    def log_error(self, message, *args):
+        self.logger.error(message, *args)
 
-# Example usage
 logger = Logger()
-logger.log_info("This is an info message")
-logger.log_warning("This is a warning message")
-logger.log_error("This is an error message")
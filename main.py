@@ -1,17 +1,73 @@
+from startup import startup_report  # first, so the import phase covers the modules below
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 import uvicorn
+from storage import repo
+from logger import setup_logging
+from recommender import recommender
+from search import search_index, SEARCH_REBUILD_SECONDS
+from cleanup import cleanup_tasks
+from jobs import job_runner
+from service import backfill_review_summaries, warm_book_cache, WARM_UP_BOOKS
 from routing import router  # Ensure this module exists and has defined routes
 from security_headers import SecurityHeadersMiddleware  # Ensure this middleware is defined
-from pyinstrument_profiler import ProfilerMiddleware  # Ensure this middleware is installed
+from pyinstrument_profiler import ProfilerMiddleware, profiler_router, PROFILER_ENABLED  # Ensure this middleware is installed
+from admission import admit_routes
+from metrics import instrument_routes, run_publisher, publish, METRICS_DIR
 
-app = FastAPI()
+setup_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Indexes, migrations or snapshots are in place before serving any traffic;
+    # uvicorn only starts accepting connections on this worker once startup returns
+    with startup_report.phase('db_connect'):
+        await repo.initialize()
+    with startup_report.phase('warm_up'):
+        await backfill_review_summaries()
+        await search_index.rebuild(repo)
+        await warm_book_cache(WARM_UP_BOOKS)
+    # The recommender model is built or loaded in the background and kept fresh
+    background = [asyncio.create_task(recommender.run(repo))]
+    # Heartbeats this worker's jobs and resumes those abandoned by stopped workers
+    background.append(asyncio.create_task(job_runner.run(repo)))
+    if SEARCH_REBUILD_SECONDS > 0:
+        background.append(asyncio.create_task(search_index.run(repo, SEARCH_REBUILD_SECONDS)))
+    if METRICS_DIR:
+        # Lets whichever worker answers /metrics report the totals of all of them
+        background.append(asyncio.create_task(run_publisher()))
+    startup_report.ready()
+    yield
+    for task in background:
+        task.cancel()
+    # Chunks in progress finish; the rest of their jobs is released to the other workers
+    await job_runner.stop()
+    await cleanup_tasks.drain()
+    await repo.close()
+    if METRICS_DIR:
+        publish()
+
+# orjson serializes responses (datetimes included) several times faster than the stdlib encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 #Add middleware
 app.add_middleware(SecurityHeadersMiddleware)
-app.add_middleware(ProfilerMiddleware)
+if PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
 
 # Include the router
 app.include_router(router)
+if PROFILER_ENABLED:
+    app.include_router(profiler_router)
+# Concurrency limits by priority and optional per-client rates; over them requests get a fast 503/429
+admit_routes(app)
+# Latency, status and queries-per-request metrics for every route, served on /metrics
+instrument_routes(app)
+startup_report.imported()
 
+# Development server; production runs through serve.py
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True)
+    # log_config=None keeps uvicorn's loggers on the queue set up above
+    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True, log_config=None)
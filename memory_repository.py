@@ -0,0 +1,403 @@
+"""Embedded in-process storage backend (STORAGE_BACKEND=memory).
+
+Documents live in dicts keyed by their primary key, with secondary indexes
+for every lookup service.py makes, so no request pays a network hop. No
+method awaits while it touches the store, which makes each call atomic on
+the event loop the same way a single MongoDB write is.
+
+Set MEMORY_SNAPSHOT_PATH to keep the data across restarts: the snapshot is
+loaded at startup and written atomically at shutdown.
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import os
+import pickle
+from datetime import datetime, timedelta, timezone
+from repository import (
+    BookRepository, UserRepository, ReviewRepository, ProgressRepository, JobRepository, Repositories,
+    SUMMARY_REVIEW_FIELDS, JOB_RETENTION_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+MEMORY_SNAPSHOT_PATH = os.getenv("MEMORY_SNAPSHOT_PATH")
+
+
+def copy_document(doc, fields=None):
+    # Callers get their own copy so they can never mutate the stored document
+    if fields is not None:
+        doc = {field: doc[field] for field in fields if field in doc}
+    return {key: value.copy() if isinstance(value, (list, dict)) else value for key, value in doc.items()}
+
+
+def bump_version(doc):
+    # Same bookkeeping as the Mongo backend's $inc/$currentDate on every book write
+    doc['version'] = doc.get('version', 0) + 1
+    doc['updated_at'] = datetime.now(timezone.utc)
+
+
+class SecondaryIndex:
+    """field value -> primary keys, kept in insertion order."""
+
+    def __init__(self, field):
+        self.field = field
+        self.entries = {}
+
+    def add(self, key, doc):
+        self.entries.setdefault(doc.get(self.field), {})[key] = None
+
+    def remove(self, key, doc):
+        value = doc.get(self.field)
+        keys = self.entries.get(value)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self.entries[value]
+
+    def keys(self, value):
+        return self.entries.get(value, {})
+
+    def values(self):
+        return list(self.entries)
+
+
+class MemoryDocuments:
+    """Documents with a unique integer 'id', plus a sorted id list for ordered reads."""
+
+    def __init__(self):
+        self.documents = {}  # id -> document
+        self.ids = []  # sorted ids, for keyset pagination
+
+    async def get(self, doc_id, fields=None):
+        doc = self.documents.get(doc_id)
+        return copy_document(doc, fields) if doc is not None else None
+
+    async def existing_ids(self, ids):
+        return {doc_id for doc_id in ids if doc_id in self.documents}
+
+    async def insert_unique(self, documents):
+        inserted, duplicates = [], []
+        for doc in documents:
+            if doc['id'] in self.documents:
+                duplicates.append(doc['id'])
+                continue
+            self.documents[doc['id']] = copy_document(doc)
+            inserted.append(doc)
+        if len(inserted) == 1:
+            bisect.insort(self.ids, inserted[0]['id'])
+        elif inserted:
+            # Timsort merges the appended run in linear time
+            self.ids.extend(doc['id'] for doc in inserted)
+            self.ids.sort()
+        return inserted, duplicates
+
+    async def delete(self, ids):
+        deleted = 0
+        for doc_id in set(ids):
+            if self.documents.pop(doc_id, None) is not None:
+                del self.ids[bisect.bisect_left(self.ids, doc_id)]
+                deleted += 1
+        return deleted
+
+    def after(self, after):
+        return bisect.bisect_right(self.ids, after) if after is not None else 0
+
+    async def scan(self, after=None, batch_size=500, fields=None):
+        # Keyset batches, yielding to the event loop in between like a cursor would
+        while True:
+            start = self.after(after)
+            batch = [copy_document(self.documents[doc_id], fields) for doc_id in self.ids[start:start + batch_size]]
+            for doc in batch:
+                yield doc
+            if len(batch) < batch_size:
+                return
+            after = self.ids[start + batch_size - 1]
+            await asyncio.sleep(0)
+
+
+class MemoryBookRepository(MemoryDocuments, BookRepository):
+    async def find_many(self, book_ids, fields=None):
+        return [copy_document(self.documents[book_id], fields) for book_id in dict.fromkeys(book_ids) if book_id in self.documents]
+
+    async def update_fields(self, updates):
+        matched = 0
+        for book_id, fields in updates.items():
+            doc = self.documents.get(book_id)
+            if doc is not None:
+                doc.update(copy_document(fields))
+                bump_version(doc)
+                matched += 1
+        return matched
+
+    async def add_ratings(self, totals):
+        matched = 0
+        for book_id, (rating_sum, rating_count) in totals.items():
+            doc = self.documents.get(book_id)
+            if doc is None:
+                continue
+            previous_sum = doc.get('rating_sum')
+            if previous_sum is None:
+                previous_sum = (doc.get('average_rating') or 0) * (doc.get('rating_count') or 0)
+            doc['rating_sum'] = previous_sum + rating_sum
+            doc['rating_count'] = (doc.get('rating_count') or 0) + rating_count
+            doc['average_rating'] = doc['rating_sum'] / doc['rating_count']
+            bump_version(doc)
+            matched += 1
+        return matched
+
+    async def page(self, after=None, limit=50, fields=None):
+        start = self.after(after)
+        return [copy_document(self.documents[book_id], fields) for book_id in self.ids[start:start + limit]]
+
+    async def sample_excluding(self, book_ids, limit, fields=None):
+        excluded = set(book_ids)
+        sample = []
+        for book_id in self.ids:
+            if len(sample) >= limit:
+                break
+            if book_id not in excluded:
+                sample.append(copy_document(self.documents[book_id], fields))
+        return sample
+
+    async def add_review_summaries(self, additions, latest):
+        for book_id, (count, histogram, reviews) in additions.items():
+            doc = self.documents.get(book_id)
+            if doc is None:
+                continue
+            merged = dict(doc.get('review_histogram') or {})
+            for rating, n in histogram.items():
+                merged[str(rating)] = merged.get(str(rating), 0) + n
+            doc['review_count'] = doc.get('review_count', 0) + count
+            doc['review_histogram'] = merged
+            doc['latest_reviews'] = (list(reviews) + doc.get('latest_reviews', []))[:latest]
+            bump_version(doc)
+
+    async def set_review_summaries(self, summaries):
+        for book_id, summary in summaries.items():
+            doc = self.documents.get(book_id)
+            if doc is not None:
+                doc.update(copy_document(summary))
+                bump_version(doc)
+
+
+class MemoryUserRepository(MemoryDocuments, UserRepository):
+    pass
+
+
+class MemoryReviewRepository(ReviewRepository):
+    def __init__(self):
+        self.documents = {}  # sequence number -> review
+        self.next_key = 0
+        self.indexes = {'book_id': SecondaryIndex('book_id'), 'user_id': SecondaryIndex('user_id')}
+
+    def newest(self, book_id, before=None):
+        # Keys of a book's reviews, newest first; sequence numbers only grow
+        keys = reversed(self.indexes['book_id'].keys(book_id))
+        return keys if before is None else itertools.dropwhile(lambda key: key >= before, keys)
+
+    async def page(self, book_id, before=None, limit=20):
+        # The cursor is the sequence number of the last review returned
+        keys = list(itertools.islice(self.newest(book_id, int(before) if before is not None else None), limit))
+        reviews = [copy_document(self.documents[key], SUMMARY_REVIEW_FIELDS) for key in keys]
+        return reviews, str(keys[-1]) if len(keys) == limit else None
+
+    async def summaries(self, book_ids, latest):
+        summaries = {}
+        for book_id in book_ids:
+            histogram = {}
+            keys = self.indexes['book_id'].keys(book_id)
+            for key in keys:
+                rating = self.documents[key].get('rating')
+                if rating is not None:
+                    histogram[str(rating)] = histogram.get(str(rating), 0) + 1
+            summaries[book_id] = {
+                'review_count': len(keys),
+                'review_histogram': histogram,
+                'latest_reviews': [copy_document(self.documents[key], SUMMARY_REVIEW_FIELDS) for key in itertools.islice(self.newest(book_id), latest)]
+            }
+        return summaries
+
+    async def insert_many(self, documents):
+        for doc in documents:
+            key = self.next_key
+            self.next_key += 1
+            stored = self.documents[key] = copy_document(doc)
+            for index in self.indexes.values():
+                index.add(key, stored)
+
+    async def reviewed_books(self, user_ids):
+        index = self.indexes['user_id']
+        return list({self.documents[key]['book_id']: None for user_id in user_ids for key in index.keys(user_id)})
+
+    async def delete_where(self, field, values):
+        index = self.indexes[field]
+        keys = [key for value in set(values) for key in index.keys(value)]
+        for key in keys:
+            doc = self.documents.pop(key)
+            for each in self.indexes.values():
+                each.remove(key, doc)
+        return len(keys)
+
+    async def distinct(self, field):
+        for value in self.indexes[field].values():
+            yield value
+
+    async def scan(self, fields=None):
+        for doc in list(self.documents.values()):
+            yield copy_document(doc, fields)
+
+
+class MemoryProgressRepository(ProgressRepository):
+    def __init__(self):
+        self.documents = {}  # (user_id, book_id) -> progress row
+        self.by_user = {}  # user_id -> sorted book ids, for keyset pagination
+        self.by_book = SecondaryIndex('book_id')
+
+    async def upsert(self, user_id, percentages, updated_at):
+        added = updated = 0
+        for book_id, percentage_read in percentages.items():
+            key = (user_id, book_id)
+            doc = self.documents.get(key)
+            if doc is not None:
+                doc.update(percentage_read=percentage_read, updated_at=updated_at)
+                updated += 1
+                continue
+            doc = self.documents[key] = {'user_id': user_id, 'book_id': book_id, 'percentage_read': percentage_read, 'updated_at': updated_at}
+            bisect.insort(self.by_user.setdefault(user_id, []), book_id)
+            self.by_book.add(key, doc)
+            added += 1
+        return added, updated
+
+    async def page(self, user_id, after=None, limit=50):
+        book_ids = self.by_user.get(user_id, [])
+        start = bisect.bisect_right(book_ids, after) if after is not None else 0
+        return [
+            copy_document(self.documents[(user_id, book_id)], ('book_id', 'percentage_read', 'updated_at'))
+            for book_id in book_ids[start:start + limit]
+        ]
+
+    async def delete_where(self, field, values):
+        if field == 'user_id':
+            keys = [(user_id, book_id) for user_id in set(values) for book_id in self.by_user.get(user_id, [])]
+        else:
+            keys = [key for value in set(values) for key in self.by_book.keys(value)]
+        for key in keys:
+            doc = self.documents.pop(key)
+            user_id, book_id = key
+            book_ids = self.by_user[user_id]
+            del book_ids[bisect.bisect_left(book_ids, book_id)]
+            if not book_ids:
+                del self.by_user[user_id]
+            self.by_book.remove(key, doc)
+        return len(keys)
+
+    async def distinct(self, field):
+        for value in (list(self.by_user) if field == 'user_id' else self.by_book.values()):
+            yield value
+
+
+class MemoryJobRepository(JobRepository):
+    def __init__(self):
+        self.jobs = {}  # job id -> job
+        self.job_chunks = {}  # job id -> chunks in index order
+
+    def expire(self):
+        # Stands in for the Mongo backend's TTL indexes
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=JOB_RETENTION_SECONDS)
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.get('finished_at') and job['finished_at'] < cutoff]:
+            del self.jobs[job_id]
+            self.job_chunks.pop(job_id, None)
+
+    async def create(self, job, chunks):
+        self.expire()
+        self.job_chunks[job['id']] = [copy_document(chunk) for chunk in chunks]
+        self.jobs[job['id']] = copy_document(job)
+
+    async def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return copy_document(job) if job is not None else None
+
+    async def chunks(self, job_id, states=None, fields=None):
+        return [
+            copy_document(chunk, fields) for chunk in self.job_chunks.get(job_id, [])
+            if states is None or chunk['state'] in states
+        ]
+
+    async def chunk(self, job_id, index):
+        chunks = self.job_chunks.get(job_id, [])
+        return copy_document(chunks[index]) if index < len(chunks) else None
+
+    async def set_chunk(self, job_id, index, state, result=None, error=None, processed=0):
+        chunk = self.job_chunks[job_id][index]
+        chunk.update(state=state, result=copy_document(result) if result is not None else None, error=error)
+        if state in ('done', 'failed'):
+            chunk.pop('items', None)
+        self.jobs[job_id]['processed'] += processed
+
+    async def update(self, job_id, fields):
+        self.jobs[job_id].update(fields)
+
+    async def finish(self, job_id, fields):
+        self.jobs[job_id].update(fields)
+
+    async def claim(self, owner, stale_before, now):
+        for job in self.jobs.values():
+            if job['status'] in ('queued', 'running') and job['heartbeat'] is not None and job['heartbeat'] < stale_before:
+                job.update(owner=owner, heartbeat=now, attempts=job.get('attempts', 0) + 1)
+                return job['id']
+        return None
+
+    async def heartbeat(self, job_ids, owner, now):
+        for job_id in job_ids:
+            job = self.jobs.get(job_id)
+            if job is not None and job['owner'] == owner:
+                job['heartbeat'] = now
+
+
+class MemoryRepositories(Repositories):
+    def __init__(self, snapshot_path=MEMORY_SNAPSHOT_PATH):
+        self.snapshot_path = snapshot_path
+        self.create()
+
+    def create(self):
+        super().__init__(
+            MemoryBookRepository(), MemoryUserRepository(), MemoryReviewRepository(), MemoryProgressRepository(), MemoryJobRepository()
+        )
+
+    async def initialize(self):
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                stores = pickle.load(f)
+            # Snapshots written before background jobs existed hold four stores
+            self.books, self.users, self.reviews, self.reading_progress = stores[:4]
+            if len(stores) > 4:
+                self.jobs = stores[4]
+            logger.info("Loaded %d books and %d users from %s", len(self.books.documents), len(self.users.documents), self.snapshot_path)
+
+    async def close(self):
+        if not self.snapshot_path:
+            return
+        # Write to a temporary file first so a crash never leaves a torn snapshot
+        temporary = f"{self.snapshot_path}.tmp"
+        with open(temporary, 'wb') as f:
+            pickle.dump((self.books, self.users, self.reviews, self.reading_progress, self.jobs), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.snapshot_path)
+        logger.info("Wrote storage snapshot to %s", self.snapshot_path)
+
+    async def health(self):
+        return {
+            'status': 'ok',
+            'backend': 'memory',
+            'documents': {
+                'books': len(self.books.documents),
+                'users': len(self.users.documents),
+                'reviews': len(self.reviews.documents),
+                'reading_progress': len(self.reading_progress.documents),
+                'jobs': len(self.jobs.jobs)
+            }
+        }
+
+    async def reset(self):
+        self.create()
@@ -0,0 +1,368 @@
+"""In-process request and MongoDB command metrics, exposed as Prometheus text on /metrics.
+
+Routes are instrumented by wrapping each route's ASGI app once at startup
+(instrument_routes), so the route template is known before the endpoint runs
+and no per-request matching or label formatting is needed. Request metrics are
+only touched from the event loop and need no locks.
+
+MongoDB command events arrive on the driver's executor threads. Each thread
+records into its own shard, so the hot path never takes a lock; /metrics sums
+the shards. Motor copies the request's context into the executor, which is how
+a command is attributed to the request that issued it (queries per request).
+
+With several worker processes (serve.py), each scrape lands on one of them.
+When METRICS_DIR is set, every worker publishes its metrics there every
+METRICS_PUBLISH_SECONDS and /metrics merges them, so counters stay monotonic
+across workers; in-flight gauges of processes that have exited are dropped.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import pickle
+import threading
+import time
+from contextvars import ContextVar
+from admission import admission_control
+from fastapi.exceptions import RequestValidationError
+from pymongo.monitoring import CommandListener
+from starlette.exceptions import HTTPException
+from starlette.routing import Route
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true") == "true"
+# Directory shared by the worker processes of one server (serve.py sets it when it runs several)
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", "5"))
+
+# Upper bounds in seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+# Database commands issued by a single request; a high count is an N+1 pattern
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket, not cumulative
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+
+
+class RouteMetrics:
+    __slots__ = ('latency', 'queries', 'responses', 'errors', 'in_flight')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.responses = {}  # status code -> count
+        self.errors = 0  # 5xx responses and unhandled exceptions
+        self.in_flight = 0
+
+    def merge(self, other, gauges=True):
+        self.latency.merge(other.latency)
+        self.queries.merge(other.queries)
+        for status, count in other.responses.items():
+            self.responses[status] = self.responses.get(status, 0) + count
+        self.errors += other.errors
+        if gauges:
+            self.in_flight += other.in_flight
+
+
+class RequestStats:
+    """Per-request state, reachable from the command listener through current_request."""
+
+    __slots__ = ('status', 'queries')
+
+    def __init__(self):
+        self.status = 500  # until a response starts
+        self.queries = 0
+
+
+current_request = ContextVar('current_request', default=None)
+
+# "METHOD /route/template" -> RouteMetrics
+route_metrics = {}
+
+
+class InstrumentedRoute:
+    """Wraps one route's ASGI app; the metrics of each of its methods are resolved up front."""
+
+    def __init__(self, app, path, methods):
+        self.app = app
+        self.metrics = {method: route_metrics.setdefault(f"{method} {path}", RouteMetrics()) for method in methods}
+
+    async def __call__(self, scope, receive, send):
+        metrics = self.metrics.get(scope['method'])
+        if metrics is None:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                stats.status = message['status']
+            await send(message)
+
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except HTTPException as e:
+            # Both are turned into responses by the exception handlers further out
+            stats.status = e.status_code
+            raise
+        except RequestValidationError:
+            stats.status = 422
+            raise
+        except BaseException:
+            stats.status = 500
+            raise
+        finally:
+            metrics.latency.observe(time.perf_counter() - start)
+            metrics.in_flight -= 1
+            metrics.queries.observe(stats.queries)
+            metrics.responses[stats.status] = metrics.responses.get(stats.status, 0) + 1
+            if stats.status >= 500:
+                metrics.errors += 1
+            current_request.reset(token)
+
+
+def instrument_routes(app, enabled=METRICS_ENABLED):
+    # Called once after every router is included
+    if not enabled:
+        return
+    for route in app.routes:
+        if isinstance(route, Route) and route.methods and not isinstance(route.app, InstrumentedRoute):
+            route.app = InstrumentedRoute(route.app, route.path, route.methods)
+
+
+class CommandMetrics(CommandListener):
+    """MongoDB command durations per (command, collection), sharded by driver thread."""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()  # only taken when a new thread records its first command
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            # series: command name -> collection -> [duration histogram, failures]
+            # pending: request id -> series of a started command; started and
+            # finished events of one command are published on the same thread
+            shard = self.local.shard = {'series': {}, 'pending': {}}
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def started(self, event):
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+        command = event.command
+        name = event.command_name
+        collection = command.get('collection') if name == 'getMore' else command.get(name)
+        if not isinstance(collection, str):
+            collection = ''  # admin commands such as ping
+        shard = self.shard()
+        by_collection = shard['series'].get(name)
+        if by_collection is None:
+            by_collection = shard['series'][name] = {}
+        series = by_collection.get(collection)
+        if series is None:
+            series = by_collection[collection] = [Histogram(COMMAND_BUCKETS), 0]
+        shard['pending'][event.request_id] = series
+
+    def succeeded(self, event):
+        series = self.shard()['pending'].pop(event.request_id, None)
+        if series is not None:
+            series[0].observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        series = self.shard()['pending'].pop(event.request_id, None)
+        if series is not None:
+            series[0].observe(event.duration_micros / 1e6)
+            series[1] += 1
+
+    def snapshot(self):
+        # (command, collection) -> (merged histogram, failures)
+        merged = {}
+        with self.shards_lock:
+            shards = list(self.shards)
+        for shard in shards:
+            for name, by_collection in list(shard['series'].items()):
+                for collection, (histogram, failures) in list(by_collection.items()):
+                    total = merged.get((name, collection))
+                    if total is None:
+                        total = merged[(name, collection)] = [Histogram(COMMAND_BUCKETS), 0]
+                    total[0].merge(histogram)
+                    total[1] += failures
+        return merged
+
+
+command_metrics = CommandMetrics()
+
+
+# Prometheus text exposition format, version 0.0.4 (the response adds the charset)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels)
+
+def write_histogram(lines, name, labels, histogram):
+    label_text = format_labels(labels)
+    cumulative = 0
+    for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{label_text}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{label_text}}} {cumulative}')
+
+def collect():
+    # This process's metrics, as published to METRICS_DIR
+    return {
+        'pid': os.getpid(),
+        'routes': route_metrics,
+        'commands': command_metrics.snapshot(),
+        'admission': admission_control.snapshot()
+    }
+
+def publish():
+    # Written under a temporary name and renamed, so readers never see a partial file
+    data = pickle.dumps(collect())
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.pickle")
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+async def run_publisher(interval=METRICS_PUBLISH_SECONDS):
+    # Background task of each worker when METRICS_DIR is set
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            publish()
+        except Exception:
+            logger.exception("Publishing metrics to %s failed", METRICS_DIR)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, but belongs to someone else
+    return True
+
+def gather():
+    # (metrics, live) of this process and, with METRICS_DIR, of every other worker that published.
+    # Exited workers stay in the sum so counters never go backwards.
+    own = collect()
+    gathered = [(own, True)]
+    if not METRICS_DIR:
+        return gathered
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith('.pickle') or name == f"{own['pid']}.pickle":
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            continue
+        gathered.append((data, process_alive(data['pid'])))
+    return gathered
+
+def merge(gathered):
+    routes, commands = {}, {}
+    admission = {'in_flight': 0, 'thresholds': admission_control.snapshot()['thresholds'], 'routes': {}}
+    for data, live in gathered:
+        for route, metrics in data['routes'].items():
+            total = routes.get(route)
+            if total is None:
+                total = routes[route] = RouteMetrics()
+            total.merge(metrics, gauges=live)
+        for key, (histogram, failures) in data['commands'].items():
+            total = commands.get(key)
+            if total is None:
+                total = commands[key] = [Histogram(COMMAND_BUCKETS), 0]
+            total[0].merge(histogram)
+            total[1] += failures
+        if live:
+            admission['in_flight'] += data['admission']['in_flight']
+        for route, state in data['admission']['routes'].items():
+            total = admission['routes'].get(route)
+            if total is None:
+                total = admission['routes'][route] = {'priority': state['priority'], 'limit': state['limit'], 'shed': {}}
+            for reason, count in state['shed'].items():
+                total['shed'][reason] = total['shed'].get(reason, 0) + count
+    return routes, commands, admission
+
+def render():
+    lines = []
+    route_totals, command_totals, admission = merge(gather())
+    routes = sorted(route_totals.items())
+
+    lines += ['# HELP http_requests_total Requests by route and status code.', '# TYPE http_requests_total counter']
+    for route, metrics in routes:
+        for status, count in sorted(metrics.responses.items()):
+            lines.append(f'http_requests_total{{{format_labels((("route", route), ("status", status)))}}} {count}')
+
+    lines += ['# HELP http_request_errors_total Requests that ended in a 5xx or an unhandled exception.', '# TYPE http_request_errors_total counter']
+    for route, metrics in routes:
+        lines.append(f'http_request_errors_total{{{format_labels((("route", route),))}}} {metrics.errors}')
+
+    lines += ['# HELP http_requests_in_flight Requests currently being handled.', '# TYPE http_requests_in_flight gauge']
+    for route, metrics in routes:
+        lines.append(f'http_requests_in_flight{{{format_labels((("route", route),))}}} {metrics.in_flight}')
+
+    lines += ['# HELP http_request_duration_seconds Request latency, including sending the response.', '# TYPE http_request_duration_seconds histogram']
+    for route, metrics in routes:
+        write_histogram(lines, 'http_request_duration_seconds', (("route", route),), metrics.latency)
+
+    lines += ['# HELP http_request_db_queries MongoDB commands issued per request.', '# TYPE http_request_db_queries histogram']
+    for route, metrics in routes:
+        write_histogram(lines, 'http_request_db_queries', (("route", route),), metrics.queries)
+
+    commands = sorted(command_totals.items())
+    lines += ['# HELP mongodb_command_duration_seconds MongoDB command round-trip time.', '# TYPE mongodb_command_duration_seconds histogram']
+    for (name, collection), (histogram, _) in commands:
+        write_histogram(lines, 'mongodb_command_duration_seconds', (("command", name), ("collection", collection)), histogram)
+
+    lines += ['# HELP mongodb_command_failures_total MongoDB commands that failed.', '# TYPE mongodb_command_failures_total counter']
+    for (name, collection), (_, failures) in commands:
+        lines.append(f'mongodb_command_failures_total{{{format_labels((("command", name), ("collection", collection)))}}} {failures}')
+
+    lines += ['# HELP http_admission_in_flight Requests currently admitted.', '# TYPE http_admission_in_flight gauge',
+              f'http_admission_in_flight {admission["in_flight"]}']
+    lines += ['# HELP http_admission_limit In-flight requests per worker at which each priority is shed (absent: unlimited).', '# TYPE http_admission_limit gauge']
+    for priority, limit in admission['thresholds'].items():
+        if limit is not None:
+            lines.append(f'http_admission_limit{{{format_labels((("priority", priority),))}}} {limit}')
+    admitted_routes = sorted(admission['routes'].items())
+    lines += ['# HELP http_route_concurrency_limit Per-route in-flight limit of each worker.', '# TYPE http_route_concurrency_limit gauge']
+    for route, state in admitted_routes:
+        if state['limit']:
+            lines.append(f'http_route_concurrency_limit{{{format_labels((("route", route), ("priority", state["priority"])))}}} {state["limit"]}')
+    lines += ['# HELP http_requests_shed_total Requests rejected by admission control, by reason.', '# TYPE http_requests_shed_total counter']
+    for route, state in admitted_routes:
+        for reason, count in sorted(state['shed'].items()):
+            lines.append(f'http_requests_shed_total{{{format_labels((("route", route), ("priority", state["priority"]), ("reason", reason)))}}} {count}')
+
+    return '\n'.join(lines) + '\n'
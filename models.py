@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 
@@ -29,6 +29,7 @@ class Review(BaseModel):
     user_id: int  # Changed to integer
     book_id: int  # Changed to integer
     content: str
+    rating: int = Field(None, ge=1, le=5)  # Optional star rating, counted in the book's histogram
 
 class ReadingProgress(BaseModel):
     book_id: int  # Changed to integer
@@ -0,0 +1,338 @@
+import logging
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from database import db
+from repository import (
+    BookRepository, UserRepository, ReviewRepository, ProgressRepository, JobRepository, Repositories, SUMMARY_REVIEW_FIELDS
+)
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+# Applied alongside every book update so clients can revalidate cheaply
+BUMP_VERSION = {'$inc': {'version': 1}, '$currentDate': {'updated_at': True}}
+
+
+def projection(fields):
+    # The ObjectId is never needed by the API, so it is excluded even from full documents
+    return {'_id': 0, **{field: 1 for field in fields}} if fields is not None else {'_id': 0}
+
+async def existing_ids(collection, ids):
+    # One $in round-trip to find which of the given ids are already stored
+    cursor = collection.find({'id': {'$in': list(ids)}}, {'_id': 0, 'id': 1})
+    return {doc['id'] async for doc in cursor}
+
+async def insert_unique(collection, documents):
+    # The unique index on 'id' rejects duplicates, so no pre-check query is needed.
+    # Returns the documents that were inserted and the ids that already existed.
+    if not documents:
+        return [], []
+    try:
+        await collection.insert_many(documents, ordered=False)
+        return documents, []
+    except BulkWriteError as e:
+        errors = e.details['writeErrors']
+        if any(error['code'] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        rejected = {error['index'] for error in errors}
+        inserted = [doc for index, doc in enumerate(documents) if index not in rejected]
+        return inserted, [documents[index]['id'] for index in sorted(rejected)]
+
+
+class MongoCollection:
+    # The collection is looked up on use, since the client only exists once connected
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+
+    @property
+    def collection(self):
+        return getattr(self.database, self.name)
+
+
+class MongoChildMixin:
+    async def delete_where(self, field, values):
+        result = await self.collection.delete_many({field: {'$in': list(values)}})
+        return result.deleted_count
+
+    async def distinct(self, field):
+        # Streamed through $group rather than distinct(), which is capped at 16MB
+        async for group in self.collection.aggregate([{'$group': {'_id': f'${field}'}}]):
+            yield group['_id']
+
+
+class MongoBookRepository(MongoCollection, BookRepository):
+
+    async def get(self, book_id, fields=None):
+        return await self.collection.find_one({'id': book_id}, projection(fields))
+
+    async def find_many(self, book_ids, fields=None):
+        return await self.collection.find({'id': {'$in': list(book_ids)}}, projection(fields)).to_list(length=None)
+
+    async def existing_ids(self, book_ids):
+        return await existing_ids(self.collection, book_ids)
+
+    async def insert_unique(self, documents):
+        return await insert_unique(self.collection, documents)
+
+    async def update_fields(self, updates):
+        if not updates:
+            return 0
+        operations = [UpdateOne({'id': book_id}, {'$set': fields, **BUMP_VERSION}) for book_id, fields in updates.items()]
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return result.matched_count
+
+    async def delete(self, book_ids):
+        result = await self.collection.delete_many({'id': {'$in': list(book_ids)}})
+        return result.deleted_count
+
+    async def add_ratings(self, totals):
+        # Running sums are incremented server-side and the average is derived in the same
+        # update pipeline, so concurrent ratings never overwrite each other
+        operations = [
+            UpdateOne({'id': book_id}, [
+                {'$set': {
+                    'rating_sum': {'$add': [
+                        {'$ifNull': ['$rating_sum', {'$multiply': [
+                            {'$ifNull': ['$average_rating', 0]}, {'$ifNull': ['$rating_count', 0]}
+                        ]}]},
+                        rating_sum
+                    ]},
+                    'rating_count': {'$add': [{'$ifNull': ['$rating_count', 0]}, rating_count]}
+                }},
+                {'$set': {
+                    'average_rating': {'$divide': ['$rating_sum', '$rating_count']},
+                    'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]},
+                    'updated_at': '$$NOW'
+                }}
+            ])
+            for book_id, (rating_sum, rating_count) in totals.items()
+        ]
+        if not operations:
+            return 0
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return result.matched_count
+
+    async def page(self, after=None, limit=50, fields=None):
+        # Keyset pagination: resume after the last id seen instead of skipping rows
+        query = {'id': {'$gt': after}} if after is not None else {}
+        return await self.collection.find(query, projection(fields)).sort('id', 1).limit(limit).to_list(length=limit)
+
+    async def scan(self, after=None, batch_size=500, fields=None):
+        query = {'id': {'$gt': after}} if after is not None else {}
+        async for book in self.collection.find(query, projection(fields)).sort('id', 1).batch_size(batch_size):
+            yield book
+
+    async def sample_excluding(self, book_ids, limit, fields=None):
+        return await self.collection.find({'id': {'$nin': list(book_ids)}}, projection(fields)).to_list(length=limit)
+
+    async def add_review_summaries(self, additions, latest):
+        # $inc and a capped $push keep the summary exact under concurrent writers
+        operations = [
+            UpdateOne({'id': book_id}, {
+                '$inc': {'review_count': count, 'version': 1, **{f'review_histogram.{rating}': n for rating, n in histogram.items()}},
+                '$push': {'latest_reviews': {'$each': reviews, '$position': 0, '$slice': latest}},
+                '$currentDate': {'updated_at': True}
+            })
+            for book_id, (count, histogram, reviews) in additions.items()
+        ]
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+
+    async def set_review_summaries(self, summaries):
+        operations = [UpdateOne({'id': book_id}, {'$set': summary, **BUMP_VERSION}) for book_id, summary in summaries.items()]
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+
+
+class MongoUserRepository(MongoCollection, UserRepository):
+
+    async def get(self, user_id, fields=None):
+        return await self.collection.find_one({'id': user_id}, projection(fields))
+
+    async def existing_ids(self, user_ids):
+        return await existing_ids(self.collection, user_ids)
+
+    async def insert_unique(self, documents):
+        return await insert_unique(self.collection, documents)
+
+    async def delete(self, user_ids):
+        result = await self.collection.delete_many({'id': {'$in': list(user_ids)}})
+        return result.deleted_count
+
+    async def scan(self, fields=None):
+        async for user in self.collection.find({}, projection(fields)):
+            yield user
+
+
+class MongoReviewRepository(MongoCollection, MongoChildMixin, ReviewRepository):
+
+    async def page(self, book_id, before=None, limit=20):
+        # The cursor is the ObjectId of the last review returned; (book_id, _id) is indexed
+        query = {'book_id': book_id}
+        if before is not None:
+            if not ObjectId.is_valid(before):
+                raise ValueError(f"invalid review cursor {before!r}")
+            query['_id'] = {'$lt': ObjectId(before)}
+        fields = {'_id': 1, **{field: 1 for field in SUMMARY_REVIEW_FIELDS}}
+        reviews = await self.collection.find(query, fields).sort('_id', -1).limit(limit).to_list(length=limit)
+        next_before = str(reviews[-1]['_id']) if len(reviews) == limit else None
+        return reviews, next_before
+
+    async def summaries(self, book_ids, latest):
+        # One aggregation for the whole batch: newest first, so the head of each
+        # book's pushed reviews are its latest
+        summaries = {book_id: {'review_count': 0, 'review_histogram': {}, 'latest_reviews': []} for book_id in book_ids}
+        pipeline = [
+            {'$match': {'book_id': {'$in': list(summaries)}}},
+            {'$sort': {'_id': -1}},
+            {'$project': {'_id': 0, 'book_id': 1, **{field: 1 for field in SUMMARY_REVIEW_FIELDS}}},
+            {'$group': {'_id': '$book_id', 'count': {'$sum': 1}, 'ratings': {'$push': '$rating'}, 'latest': {'$push': '$$ROOT'}}},
+            {'$project': {'count': 1, 'ratings': 1, 'latest': {'$slice': ['$latest', latest]}}}
+        ]
+        async for group in self.collection.aggregate(pipeline, allowDiskUse=True):
+            summary = summaries[group['_id']]
+            summary['review_count'] = group['count']
+            for rating in group['ratings']:
+                if rating is not None:
+                    summary['review_histogram'][str(rating)] = summary['review_histogram'].get(str(rating), 0) + 1
+            summary['latest_reviews'] = [{field: review[field] for field in SUMMARY_REVIEW_FIELDS if field in review} for review in group['latest']]
+        return summaries
+
+    async def insert_many(self, documents):
+        if documents:
+            await self.collection.insert_many(documents, ordered=False)
+
+    async def reviewed_books(self, user_ids):
+        return await self.collection.distinct('book_id', {'user_id': {'$in': list(user_ids)}})
+
+    async def scan(self, fields=None):
+        async for review in self.collection.find({}, projection(fields)):
+            yield review
+
+
+class MongoProgressRepository(MongoCollection, MongoChildMixin, ProgressRepository):
+
+    async def upsert(self, user_id, percentages, updated_at):
+        operations = [
+            UpdateOne(
+                {'user_id': user_id, 'book_id': book_id},
+                {'$set': {'percentage_read': percentage_read, 'updated_at': updated_at}},
+                upsert=True
+            ) for book_id, percentage_read in percentages.items()
+        ]
+        if not operations:
+            return 0, 0
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return result.upserted_count, result.matched_count
+
+    async def page(self, user_id, after=None, limit=50):
+        query = {'user_id': user_id}
+        if after is not None:
+            query['book_id'] = {'$gt': after}
+        cursor = self.collection.find(query, {'_id': 0, 'book_id': 1, 'percentage_read': 1, 'updated_at': 1})
+        return await cursor.sort('book_id', 1).limit(limit).to_list(length=limit)
+
+
+class MongoJobRepository(MongoCollection, JobRepository):
+
+    @property
+    def chunk_collection(self):
+        return self.database.job_chunks
+
+    async def create(self, job, chunks):
+        # The job is inserted last, so it is never visible without all of its chunks
+        if chunks:
+            await self.chunk_collection.insert_many([dict(chunk) for chunk in chunks])
+        await self.collection.insert_one(dict(job))
+
+    async def get(self, job_id):
+        return await self.collection.find_one({'id': job_id}, projection(None))
+
+    async def chunks(self, job_id, states=None, fields=None):
+        query = {'job_id': job_id}
+        if states is not None:
+            query['state'] = {'$in': list(states)}
+        return await self.chunk_collection.find(query, projection(fields)).sort('index', 1).to_list(length=None)
+
+    async def chunk(self, job_id, index):
+        return await self.chunk_collection.find_one({'job_id': job_id, 'index': index}, projection(None))
+
+    async def set_chunk(self, job_id, index, state, result=None, error=None, processed=0):
+        update = {'$set': {'state': state, 'result': result, 'error': error}}
+        if state in ('done', 'failed'):
+            update['$unset'] = {'items': ''}
+        await self.chunk_collection.update_one({'job_id': job_id, 'index': index}, update)
+        if processed:
+            await self.collection.update_one({'id': job_id}, {'$inc': {'processed': processed}})
+
+    async def update(self, job_id, fields):
+        await self.collection.update_one({'id': job_id}, {'$set': fields})
+
+    async def finish(self, job_id, fields):
+        await self.collection.update_one({'id': job_id}, {'$set': fields})
+        await self.chunk_collection.update_many({'job_id': job_id}, {'$set': {'finished_at': fields['finished_at']}})
+
+    async def claim(self, owner, stale_before, now):
+        job = await self.collection.find_one_and_update(
+            {'status': {'$in': ['queued', 'running']}, 'heartbeat': {'$lt': stale_before}},
+            {'$set': {'owner': owner, 'heartbeat': now}, '$inc': {'attempts': 1}},
+            projection={'_id': 0, 'id': 1}
+        )
+        return job['id'] if job else None
+
+    async def heartbeat(self, job_ids, owner, now):
+        if job_ids:
+            await self.collection.update_many({'id': {'$in': list(job_ids)}, 'owner': owner}, {'$set': {'heartbeat': now}})
+
+
+class MongoRepositories(Repositories):
+    def __init__(self, database=db):
+        self.db = database
+        super().__init__(
+            MongoBookRepository(database, 'books'),
+            MongoUserRepository(database, 'users'),
+            MongoReviewRepository(database, 'reviews'),
+            MongoProgressRepository(database, 'reading_progress'),
+            MongoJobRepository(database, 'jobs')
+        )
+
+    async def initialize(self):
+        self.db.connect()
+        await self.db.warm_up()
+        # Make sure lookups are index-backed before serving any traffic
+        await self.db.create_indexes()
+        await self.migrate_embedded_progress()
+
+    async def close(self):
+        self.db.close()
+
+    async def health(self):
+        return await self.db.health()
+
+    async def reset(self):
+        self.db.connect()
+        await self.db.client.drop_database(self.db.db.name)
+        await self.db.create_indexes()
+
+    async def migrate_embedded_progress(self):
+        # Move progress arrays embedded in user documents (the old storage) into reading_progress.
+        # The old rows carry no time, so they are stamped with the migration's, like every upsert.
+        migrated, now = 0, datetime.now(timezone.utc)
+        async for user in self.db.users.find({'reading_progress.0': {'$exists': True}}, {'_id': 0, 'id': 1, 'reading_progress': 1}):
+            operations = [
+                UpdateOne(
+                    {'user_id': user['id'], 'book_id': prog['book_id']},
+                    {'$setOnInsert': {'percentage_read': prog['percentage_read'], 'updated_at': now}},
+                    upsert=True
+                ) for prog in user['reading_progress']
+            ]
+            await self.db.reading_progress.bulk_write(operations, ordered=False)
+            await self.db.users.update_one({'id': user['id']}, {'$unset': {'reading_progress': ''}})
+            migrated += 1
+        if migrated:
+            logger.info("Migrated embedded reading progress of %d users", migrated)
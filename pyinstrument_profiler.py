@@ -1,21 +1,182 @@
-from fastapi import FastAPI, Request
-from pyinstrument import Profiler
+import asyncio
+import heapq
+import itertools
 import logging
-from starlette.middleware.base import BaseHTTPMiddleware
+import os
+import time
+from collections import deque
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import HTMLResponse
+from pyinstrument import Profiler
+from pyinstrument.renderers import HTMLRenderer
+
+logger = logging.getLogger(__name__)
+
+is_production = os.getenv("ENVIRONMENT") == "production"
+
+# Profiling configuration; sampling keeps the overhead negligible where it is enabled.
+# Off by default in production: /debug/profiles is mounted with it and has no auth
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false" if is_production else "true") == "true"
+PROFILER_SAMPLE_EVERY = int(os.getenv("PROFILER_SAMPLE_EVERY", "100" if is_production else "1"))
+PROFILER_SLOW_MS = float(os.getenv("PROFILER_SLOW_MS", "0"))
+PROFILER_BUFFER_SIZE = int(os.getenv("PROFILER_BUFFER_SIZE", "20"))
+PROFILER_OUTPUT_DIR = os.getenv("PROFILER_OUTPUT_DIR")  # unset keeps profiles in memory only
+
+
+class ProfileStore:
+    """Keeps the latest profiles of each route in a ring buffer, plus the slowest overall.
+
+    Records hold the profiler's finished session (the recorded samples), not
+    the Profiler, so what is kept is only the data the reports are rendered from.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.routes = {}
+        self.slowest = []  # min-heap of (duration_ms, id, record)
+        self._ids = itertools.count(1)
+
+    def add(self, route, duration_ms, session):
+        record = {
+            'id': next(self._ids),
+            'route': route,
+            'duration_ms': round(duration_ms, 3),
+            'timestamp': time.time(),
+            'session': session
+        }
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'profiles': deque(maxlen=self.size)}
+        stats['count'] += 1
+        stats['total_ms'] += duration_ms
+        stats['max_ms'] = max(stats['max_ms'], duration_ms)
+        stats['profiles'].append(record)
+
+        if len(self.slowest) < self.size:
+            heapq.heappush(self.slowest, (duration_ms, record['id'], record))
+        elif duration_ms > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration_ms, record['id'], record))
+        return record
+
+    def recent(self, limit):
+        records = [record for stats in self.routes.values() for record in stats['profiles']]
+        return sorted(records, key=lambda record: record['id'], reverse=True)[:limit]
+
+    def slowest_profiles(self, limit):
+        return [record for _, _, record in heapq.nlargest(limit, self.slowest)]
+
+    def get(self, profile_id):
+        for stats in self.routes.values():
+            for record in stats['profiles']:
+                if record['id'] == profile_id:
+                    return record
+        for _, record_id, record in self.slowest:
+            if record_id == profile_id:
+                return record
+        return None
+
+    def route_summary(self):
+        return {
+            route: {
+                'count': stats['count'],
+                'avg_ms': round(stats['total_ms'] / stats['count'], 3),
+                'max_ms': round(stats['max_ms'], 3)
+            } for route, stats in self.routes.items()
+        }
 
-logging.basicConfig(level=logging.INFO)
 
-class ProfilerMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+profile_store = ProfileStore(PROFILER_BUFFER_SIZE)
+
+_route_paths = {}
+# pyinstrument allows one profiler per thread, and every request runs on the event loop thread
+_profiling = False
+
+def route_path(scope):
+    # Aggregate by route template so /books/1 and /books/2 share one bucket
+    endpoint = scope.get('endpoint')
+    if endpoint is None:
+        return f"{scope['method']} <unmatched>"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        path = next((route.path for route in scope['app'].routes if getattr(route, 'endpoint', None) is endpoint), scope['path'])
+        _route_paths[endpoint] = path
+    return f"{scope['method']} {path}"
+
+def render(record):
+    return HTMLRenderer().render(record['session'])
+
+def write_report(record):
+    # Runs in a worker thread so rendering and disk I/O stay off the event loop
+    endpoint = record['route'].split(' ', 1)[-1].replace('/', '_')
+    path = os.path.join(PROFILER_OUTPUT_DIR, f"profile_{record['id']}{endpoint}.html")
+    with open(path, "w") as f:
+        f.write(render(record))
+
+def report_written(record, future):
+    # Nothing awaits the write, so its failure is only ever seen here
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Could not write profile %d of %s", record['id'], record['route'], exc_info=future.exception())
+
+
+class ProfilerMiddleware:
+    """Pure ASGI middleware profiling a sample of HTTP requests with pyinstrument."""
+
+    def __init__(self, app, enabled=PROFILER_ENABLED, sample_every=PROFILER_SAMPLE_EVERY, slow_ms=PROFILER_SLOW_MS):
+        self.app = app
+        self.enabled = enabled
+        self.sample_every = max(sample_every, 1)
+        self.slow_ms = slow_ms
+        self._requests = itertools.count()
+
+    async def __call__(self, scope, receive, send):
+        global _profiling
+        if not self.enabled or scope["type"] != "http" or next(self._requests) % self.sample_every or _profiling:
+            # Sampled requests arriving while another one is profiled pass through unprofiled
+            await self.app(scope, receive, send)
+            return
+
         profiler = Profiler()
-        profiler.start()
+        start = time.perf_counter()
+        _profiling, started = True, False
+        try:
+            profiler.start()
+            started = True
+            await self.app(scope, receive, send)
+        finally:
+            if started:
+                session = profiler.stop()
+            _profiling = False
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        if duration_ms >= self.slow_ms:
+            record = profile_store.add(route_path(scope), duration_ms, session)
+            if PROFILER_OUTPUT_DIR:
+                written = asyncio.get_running_loop().run_in_executor(None, write_report, record)
+                written.add_done_callback(lambda future: report_written(record, future))
+
+
+# Debug endpoints for browsing the captured profiles
+profiler_router = APIRouter(prefix="/debug/profiles")
+
+def summarize(record):
+    return {key: value for key, value in record.items() if key != 'session'}
 
-        response = await call_next(request)
+@profiler_router.get("/")
+async def list_profiles(order: str = "recent", limit: int = 20):
+    if order == "slowest":
+        records = profile_store.slowest_profiles(limit)
+    else:
+        records = profile_store.recent(limit)
+    return [summarize(record) for record in records]
 
-        profiler.stop()
-        logging.info(profiler.output_text(unicode=True, color=True))
-        endpoint = request.url.path.replace('/', '_')
-        with open(f"memory_profile_{endpoint}.html", "w") as f:
-            f.write(profiler.output_html())
+@profiler_router.get("/routes")
+async def profiled_routes():
+    return profile_store.route_summary()
 
-        return response
+@profiler_router.get("/{profile_id}", response_class=HTMLResponse)
+def download_profile(profile_id: int):
+    # Declared sync so FastAPI renders the report in its threadpool
+    record = profile_store.get(profile_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return HTMLResponse(render(record))
@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# Interaction weights: a favorite is the strongest signal, a review a weaker one
+FAVORITE_WEIGHT = 1.0
+REVIEW_WEIGHT = 0.5
+# Ratings carry no user id, so they only feed the popularity fallback
+RATING_WEIGHT = 0.1
+
+RECOMMENDER_NEIGHBORS = int(os.getenv("RECOMMENDER_NEIGHBORS", "20"))
+RECOMMENDER_REFRESH_SECONDS = float(os.getenv("RECOMMENDER_REFRESH_SECONDS", "30"))
+RECOMMENDER_REBUILD_SECONDS = float(os.getenv("RECOMMENDER_REBUILD_SECONDS", "86400"))
+RECOMMENDER_MODEL_PATH = os.getenv("RECOMMENDER_MODEL_PATH", "recommender_model.npz")
+POPULAR_POOL = 1000
+
+
+def top_k(scores, k):
+    # Indices of the k largest scores, best first
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+def cosine_row(i, columns, values, diag):
+    # Cosine similarity of item i to the given co-occurring items, excluding itself
+    keep = columns != i
+    columns, values = columns[keep], values[keep]
+    norms = np.sqrt(diag[i] * diag[columns])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sims = np.where(norms > 0, values / norms, 0.0)
+    return columns, sims
+
+def top_neighbors(cooc, diag, k):
+    n = cooc.shape[0]
+    neighbor_idx = np.full((n, k), -1, dtype=np.int32)
+    neighbor_sim = np.zeros((n, k), dtype=np.float32)
+    for i in range(n):
+        start, end = cooc.indptr[i], cooc.indptr[i + 1]
+        columns, sims = cosine_row(i, cooc.indices[start:end], cooc.data[start:end], diag)
+        best = top_k(sims, k)
+        neighbor_idx[i, :len(best)] = columns[best]
+        neighbor_sim[i, :len(best)] = sims[best]
+    return neighbor_idx, neighbor_sim
+
+def build_model(interactions, ratings, k=RECOMMENDER_NEIGHBORS):
+    """Build the item-item model from (user_id, book_id, weight) triples and {book_id: rating_count}.
+
+    Pure function over plain Python data so it can run in a worker process.
+    """
+    weights = {}
+    for user_id, book_id, weight in interactions:
+        if weight > weights.get((user_id, book_id), 0):
+            weights[(user_id, book_id)] = weight
+
+    book_ids = np.array(sorted({book_id for _, book_id in weights} | set(ratings)), dtype=np.int64)
+    user_ids = np.array(sorted({user_id for user_id, _ in weights}), dtype=np.int64)
+    book_index = {book_id: i for i, book_id in enumerate(book_ids.tolist())}
+    user_index = {user_id: i for i, user_id in enumerate(user_ids.tolist())}
+
+    rows = np.fromiter((user_index[user_id] for user_id, _ in weights), dtype=np.int64, count=len(weights))
+    columns = np.fromiter((book_index[book_id] for _, book_id in weights), dtype=np.int64, count=len(weights))
+    data = np.fromiter(weights.values(), dtype=np.float32, count=len(weights))
+    user_items = sparse.csr_matrix((data, (rows, columns)), shape=(len(user_ids), len(book_ids)))
+
+    cooc = (user_items.T @ user_items).tocsr()
+    diag = cooc.diagonal().astype(np.float64)
+    popularity = np.asarray(user_items.sum(axis=0), dtype=np.float64).ravel()
+    for book_id, count in ratings.items():
+        popularity[book_index[book_id]] += RATING_WEIGHT * count
+
+    neighbor_idx, neighbor_sim = top_neighbors(cooc, diag, k)
+    return {
+        'book_ids': book_ids,
+        'user_ids': user_ids,
+        'user_items': user_items,
+        'cooc': cooc,
+        'diag': diag,
+        'popularity': popularity,
+        'neighbor_idx': neighbor_idx,
+        'neighbor_sim': neighbor_sim
+    }
+
+def save_model(state, path=RECOMMENDER_MODEL_PATH):
+    arrays = {}
+    for key, value in state.items():
+        if sparse.issparse(value):
+            for part in ('data', 'indices', 'indptr'):
+                arrays[f'{key}_{part}'] = getattr(value, part)
+            arrays[f'{key}_shape'] = np.array(value.shape)
+        else:
+            arrays[key] = value
+    np.savez(path, **arrays)
+
+def load_model(path=RECOMMENDER_MODEL_PATH):
+    with np.load(path) as arrays:
+        state = {key: arrays[key] for key in ('book_ids', 'user_ids', 'diag', 'popularity', 'neighbor_idx', 'neighbor_sim')}
+        for key in ('user_items', 'cooc'):
+            parts = (arrays[f'{key}_data'], arrays[f'{key}_indices'], arrays[f'{key}_indptr'])
+            state[key] = sparse.csr_matrix(parts, shape=tuple(arrays[f'{key}_shape']))
+    return state
+
+async def load_interactions(repo):
+    # Stream the source collections with projections; nothing is formatted
+    interactions = []
+    async for user in repo.users.scan(fields=('id', 'favorite_books')):
+        interactions.extend((user['id'], book_id, FAVORITE_WEIGHT) for book_id in user.get('favorite_books') or ())
+    async for review in repo.reviews.scan(fields=('user_id', 'book_id')):
+        interactions.append((review['user_id'], review['book_id'], REVIEW_WEIGHT))
+    ratings = {}
+    async for book in repo.books.scan(fields=('id', 'rating_count')):
+        if book.get('rating_count'):
+            ratings[book['id']] = book['rating_count']
+    return interactions, ratings
+
+
+class Recommender:
+    """Item-item recommender over favorites and reviews.
+
+    A full model is built offline (or in a worker process) from the database.
+    Between rebuilds, new interactions are folded in incrementally: co-occurrence
+    deltas accumulate in memory and refresh() recomputes the neighbor lists of
+    the items they touched.
+    """
+
+    def __init__(self, k=RECOMMENDER_NEIGHBORS):
+        self.k = k
+        self.ready = False
+        self._journal = None
+        self.load_state(build_model([], {}, k))
+
+    def load_state(self, state):
+        self.book_ids = state['book_ids'].tolist()
+        self.book_index = {book_id: i for i, book_id in enumerate(self.book_ids)}
+        self.user_index = {user_id: i for i, user_id in enumerate(state['user_ids'].tolist())}
+        self.user_items_base = state['user_items']
+        self.cooc = state['cooc']
+        self.diag = state['diag'].astype(np.float64)
+        self.popularity = state['popularity'].astype(np.float64)
+        self.neighbor_idx = state['neighbor_idx']
+        self.neighbor_sim = state['neighbor_sim']
+        self.user_overlay = {}  # user_id -> {item index: weight} for users touched since the build
+        self.delta = {}  # item index -> {item index: co-occurrence delta}
+        self.dirty = set()
+        self._refresh_popular()
+
+    def _refresh_popular(self):
+        count = len(self.book_ids)
+        self.popular = top_k(self.popularity[:count], min(POPULAR_POOL, count)).tolist() if count else []
+
+    def _grow(self, size):
+        capacity = len(self.diag)
+        if size <= capacity:
+            return
+        old_capacity, capacity = capacity, max(size, capacity * 2, 64)
+        self.diag = np.resize(self.diag, capacity)
+        self.popularity = np.resize(self.popularity, capacity)
+        self.diag[old_capacity:] = 0
+        self.popularity[old_capacity:] = 0
+        neighbor_idx = np.full((capacity, self.k), -1, dtype=np.int32)
+        neighbor_sim = np.zeros((capacity, self.k), dtype=np.float32)
+        neighbor_idx[:len(self.neighbor_idx)] = self.neighbor_idx
+        neighbor_sim[:len(self.neighbor_sim)] = self.neighbor_sim
+        self.neighbor_idx, self.neighbor_sim = neighbor_idx, neighbor_sim
+
+    def _item(self, book_id):
+        i = self.book_index.get(book_id)
+        if i is None:
+            i = self.book_index[book_id] = len(self.book_ids)
+            self.book_ids.append(book_id)
+            self._grow(len(self.book_ids))
+        return i
+
+    def user_items(self, user_id):
+        items = self.user_overlay.get(user_id)
+        if items is not None:
+            return items
+        row = self.user_index.get(user_id)
+        if row is None:
+            return {}
+        start, end = self.user_items_base.indptr[row], self.user_items_base.indptr[row + 1]
+        return dict(zip(self.user_items_base.indices[start:end].tolist(), self.user_items_base.data[start:end].tolist()))
+
+    def add_interaction(self, user_id, book_id, weight):
+        if self._journal is not None:
+            self._journal.append(('interaction', user_id, book_id, weight))
+        i = self._item(book_id)
+        items = self.user_overlay.setdefault(user_id, dict(self.user_items(user_id)))
+        old = items.get(i, 0.0)
+        if weight <= old:
+            return
+        change = weight - old
+        for j, other in items.items():
+            if j != i:
+                self._add_delta(i, j, change * other)
+                self._add_delta(j, i, change * other)
+                self.dirty.add(j)
+        self._add_delta(i, i, weight * weight - old * old)
+        self.diag[i] += weight * weight - old * old
+        self.popularity[i] += change
+        items[i] = weight
+        self.dirty.add(i)
+
+    def _add_delta(self, i, j, value):
+        row = self.delta.setdefault(i, {})
+        row[j] = row.get(j, 0.0) + value
+
+    def record_ratings(self, counts):
+        if self._journal is not None:
+            self._journal.append(('ratings', counts))
+        for book_id, count in counts.items():
+            # _item() may grow (replace) the array, so resolve the index first
+            i = self._item(book_id)
+            self.popularity[i] += RATING_WEIGHT * count
+
+    def refresh(self):
+        # Recompute the neighbor lists of items whose co-occurrences changed
+        dirty, self.dirty = self.dirty, set()
+        base_rows = self.cooc.shape[0]
+        for i in dirty:
+            if i < base_rows:
+                start, end = self.cooc.indptr[i], self.cooc.indptr[i + 1]
+                columns = self.cooc.indices[start:end].astype(np.int64)
+                values = self.cooc.data[start:end].astype(np.float64)
+            else:
+                columns, values = np.empty(0, dtype=np.int64), np.empty(0)
+            delta = self.delta.get(i)
+            if delta:
+                columns = np.concatenate([columns, np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))])
+                values = np.concatenate([values, np.fromiter(delta.values(), dtype=np.float64, count=len(delta))])
+                columns, inverse = np.unique(columns, return_inverse=True)
+                values = np.bincount(inverse, weights=values)
+            columns, sims = cosine_row(i, columns, values, self.diag)
+            best = top_k(sims, self.k)
+            self.neighbor_idx[i] = -1
+            self.neighbor_sim[i] = 0
+            self.neighbor_idx[i, :len(best)] = columns[best]
+            self.neighbor_sim[i, :len(best)] = sims[best]
+        self._refresh_popular()
+        return len(dirty)
+
+    def recommend(self, user_id, exclude=(), k=5):
+        items = self.user_items(user_id)
+        seen = set(items)
+        seen.update(self.book_index[book_id] for book_id in exclude if book_id in self.book_index)
+
+        ranked = []
+        if items:
+            rows = np.fromiter(items.keys(), dtype=np.int64, count=len(items))
+            weights = np.fromiter(items.values(), dtype=np.float64, count=len(items))
+            candidates = self.neighbor_idx[rows]
+            scores = self.neighbor_sim[rows] * weights[:, None]
+            valid = candidates >= 0
+            candidates, inverse = np.unique(candidates[valid], return_inverse=True)
+            scores = np.bincount(inverse, weights=scores[valid])
+            keep = ~np.isin(candidates, np.fromiter(seen, dtype=np.int64, count=len(seen)))
+            candidates, scores = candidates[keep], scores[keep]
+            ranked = candidates[top_k(scores, k)].tolist()
+
+        # Top up with popular books for new users or sparse neighborhoods
+        for i in self.popular:
+            if len(ranked) >= k:
+                break
+            if i not in seen and i not in ranked:
+                ranked.append(i)
+        return [self.book_ids[i] for i in ranked]
+
+    async def rebuild(self, repo):
+        # Events arriving while the snapshot is built are replayed on top of it
+        self._journal = []
+        try:
+            interactions, ratings = await load_interactions(repo)
+            executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+            try:
+                state = await asyncio.get_running_loop().run_in_executor(executor, build_model, interactions, ratings, self.k)
+            finally:
+                executor.shutdown(wait=False)
+            journal = self._journal
+        finally:
+            self._journal = None
+        self.load_state(state)
+        for event in journal:
+            if event[0] == 'interaction':
+                self.add_interaction(*event[1:])
+            else:
+                self.record_ratings(event[1])
+        self.refresh()
+        self.ready = True
+
+    async def run(self, repo):
+        # Background task: load or build the model, then keep it fresh. A failed
+        # first build (database or process pool unavailable) is retried like a refresh
+        load_saved = os.path.exists(RECOMMENDER_MODEL_PATH)
+        last_rebuild = None
+        while True:
+            try:
+                if not self.ready and load_saved:
+                    # Only tried once; a saved model that cannot be loaded is rebuilt instead
+                    load_saved = False
+                    self.load_state(await asyncio.to_thread(load_model, RECOMMENDER_MODEL_PATH))
+                    self.ready = True
+                    last_rebuild = time.monotonic()
+                    logger.info("Loaded recommender model from %s", RECOMMENDER_MODEL_PATH)
+                elif not self.ready or time.monotonic() - last_rebuild >= RECOMMENDER_REBUILD_SECONDS:
+                    await self.rebuild(repo)
+                    last_rebuild = time.monotonic()
+                else:
+                    self.refresh()
+            except Exception:
+                logger.exception("Recommender %s failed", "refresh" if self.ready else "build")
+            await asyncio.sleep(RECOMMENDER_REFRESH_SECONDS)
+
+
+recommender = Recommender()
+
+
+async def main():
+    # Offline rebuild: python recommender.py
+    from storage import repo
+    start = time.perf_counter()
+    await repo.initialize()
+    try:
+        interactions, ratings = await load_interactions(repo)
+    finally:
+        await repo.close()
+    state = build_model(interactions, ratings)
+    save_model(state)
+    print(f"Built recommender model for {len(state['book_ids'])} books from {len(interactions)} interactions "
+          f"in {time.perf_counter() - start:.1f}s -> {RECOMMENDER_MODEL_PATH}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,225 @@
+"""Storage interface used by service.py.
+
+Each collection has a repository with the handful of domain operations the
+service needs. Wherever a method takes fields, only those document fields
+are read and returned. Two backends implement them:
+
+    mongo   - Motor collections on the configured MongoDB (mongo_repository.py)
+    memory  - embedded in-process store with secondary indexes (memory_repository.py)
+
+storage.py picks one with STORAGE_BACKEND and exposes it as `repo`.
+"""
+
+import os
+
+# Fields of the reviews embedded in a book's latest_reviews, newest first
+SUMMARY_REVIEW_FIELDS = ('user_id', 'content', 'rating', 'created_at')
+# Finished background jobs and their chunks are removed after this long
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+
+class BookRepository:
+    """Books; every write that changes a stored book also increments its
+    version and sets updated_at, atomically with the change itself."""
+
+    async def get(self, book_id, fields=None):
+        """The book with this id (only the given fields, if any) or None."""
+        raise NotImplementedError
+
+    async def find_many(self, book_ids, fields=None):
+        """Books with any of the given ids, in no particular order."""
+        raise NotImplementedError
+
+    async def existing_ids(self, book_ids):
+        """The subset of book_ids that are stored."""
+        raise NotImplementedError
+
+    async def insert_unique(self, documents):
+        """Insert new books; returns (inserted documents, ids that already existed)."""
+        raise NotImplementedError
+
+    async def update_fields(self, updates):
+        """Set fields on existing books; updates maps book id -> {field: value}.
+
+        Returns the number of books that matched.
+        """
+        raise NotImplementedError
+
+    async def delete(self, book_ids):
+        """Delete books; returns the number deleted."""
+        raise NotImplementedError
+
+    async def add_ratings(self, totals):
+        """Fold book id -> (rating sum, rating count) into the running averages atomically.
+
+        Returns the number of books that matched.
+        """
+        raise NotImplementedError
+
+    async def page(self, after=None, limit=50, fields=None):
+        """Up to limit books with id greater than after, ordered by id."""
+        raise NotImplementedError
+
+    def scan(self, after=None, batch_size=500, fields=None):
+        """Async iterator over the books with id greater than after, ordered by id."""
+        raise NotImplementedError
+
+    async def sample_excluding(self, book_ids, limit, fields=None):
+        """Up to limit books whose id is not in book_ids."""
+        raise NotImplementedError
+
+    async def add_review_summaries(self, additions, latest):
+        """Fold new reviews into the embedded review summaries atomically.
+
+        additions maps book id -> (review count, {rating: count}, summary reviews
+        newest first); at most latest reviews are kept in latest_reviews.
+        """
+        raise NotImplementedError
+
+    async def set_review_summaries(self, summaries):
+        """Replace review_count, review_histogram and latest_reviews; summaries maps book id -> those fields."""
+        raise NotImplementedError
+
+
+class UserRepository:
+    async def get(self, user_id, fields=None):
+        """The user with this id (only the given fields, if any) or None."""
+        raise NotImplementedError
+
+    async def existing_ids(self, user_ids):
+        """The subset of user_ids that are stored."""
+        raise NotImplementedError
+
+    async def insert_unique(self, documents):
+        """Insert new users; returns (inserted documents, ids that already existed)."""
+        raise NotImplementedError
+
+    async def delete(self, user_ids):
+        """Delete users; returns the number deleted."""
+        raise NotImplementedError
+
+    def scan(self, fields=None):
+        """Async iterator over every user."""
+        raise NotImplementedError
+
+
+class ChildRepository:
+    """Operations shared by collections that reference books and users."""
+
+    async def delete_where(self, field, values):
+        """Delete the rows whose field is one of values; returns the number deleted."""
+        raise NotImplementedError
+
+    def distinct(self, field):
+        """Async iterator over the distinct values of field."""
+        raise NotImplementedError
+
+
+class ReviewRepository(ChildRepository):
+    async def page(self, book_id, before=None, limit=20):
+        """Up to limit reviews of a book, newest first, older than the opaque cursor before.
+
+        Returns (reviews, cursor of the next page or None); a malformed cursor raises ValueError.
+        """
+        raise NotImplementedError
+
+    async def summaries(self, book_ids, latest):
+        """Review summaries recomputed from the reviews themselves, for every given book."""
+        raise NotImplementedError
+
+    async def insert_many(self, documents):
+        raise NotImplementedError
+
+    async def reviewed_books(self, user_ids):
+        """Distinct ids of the books reviewed by any of the given users."""
+        raise NotImplementedError
+
+    def scan(self, fields=None):
+        """Async iterator over every review."""
+        raise NotImplementedError
+
+
+class ProgressRepository(ChildRepository):
+    async def upsert(self, user_id, percentages, updated_at):
+        """Set book id -> percentage read for a user; returns (rows added, rows updated)."""
+        raise NotImplementedError
+
+    async def page(self, user_id, after=None, limit=50):
+        """Up to limit progress rows of a user with book id greater than after, ordered by book id."""
+        raise NotImplementedError
+
+
+class JobRepository:
+    """Background write jobs: a job document plus its items in numbered chunks.
+
+    Chunk documents hold job_id, index, items, state ('pending', 'running',
+    'done' or 'failed'), result and error; items are dropped once a chunk is
+    finished.
+    """
+
+    async def create(self, job, chunks):
+        """Store a new job document and its chunk documents."""
+        raise NotImplementedError
+
+    async def get(self, job_id):
+        """The job document or None."""
+        raise NotImplementedError
+
+    async def chunks(self, job_id, states=None, fields=None):
+        """The job's chunks ordered by index, only those in states if given."""
+        raise NotImplementedError
+
+    async def chunk(self, job_id, index):
+        """One chunk document, items included, or None."""
+        raise NotImplementedError
+
+    async def set_chunk(self, job_id, index, state, result=None, error=None, processed=0):
+        """Record a chunk's state and outcome, adding processed to the job's processed count."""
+        raise NotImplementedError
+
+    async def update(self, job_id, fields):
+        """Set fields on the job document."""
+        raise NotImplementedError
+
+    async def finish(self, job_id, fields):
+        """Set the job's final fields (finished_at included) and start its retention period."""
+        raise NotImplementedError
+
+    async def claim(self, owner, stale_before, now):
+        """Atomically take over one queued or running job whose heartbeat is older than stale_before.
+
+        Records without a heartbeat (cleanup task status) are never claimed.
+        The claimed job's attempts count goes up by one.
+
+        Returns the job id, or None when there is nothing to take over.
+        """
+        raise NotImplementedError
+
+    async def heartbeat(self, job_ids, owner, now):
+        """Renew the heartbeat of the given jobs still owned by owner."""
+        raise NotImplementedError
+
+
+class Repositories:
+    """The repositories of one backend, plus its lifecycle hooks."""
+
+    def __init__(self, books, users, reviews, reading_progress, jobs):
+        self.books = books
+        self.users = users
+        self.reviews = reviews
+        self.reading_progress = reading_progress
+        self.jobs = jobs
+
+    async def initialize(self):
+        """Prepare the backend before serving traffic (indexes, migrations, snapshots)."""
+
+    async def close(self):
+        """Release the backend's resources at shutdown."""
+
+    async def health(self):
+        """Backend status for /health; 'status' is 'ok' when it can serve requests."""
+        raise NotImplementedError
+
+    async def reset(self):
+        """Remove every stored document (benchmarks and tests)."""
+        raise NotImplementedError
@@ -1,16 +1,45 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from service import *
+from cache import book_cache
+from cleanup import cleanup_tasks
+from storage import repo
+import metrics
+from startup import startup_report
 from models import Book, UpdateBook, Rating, User, Review, ReadingProgress
 
 router = APIRouter()
 
+# Comma-separated subset of BOOK_FIELDS; limits both the query projection and the response keys
+FIELDS_QUERY = Query(None, description=f"comma-separated subset of: {', '.join(BOOK_FIELDS)}")
+# Large write batches: accept with 202 and a job to poll instead of processing within the request
+ASYNC_QUERY = Query(False, alias="async", description="process in the background; poll the returned /jobs/{id} url")
+
+# List-heavy endpoints return ORJSONResponse themselves: the service output is already
+# JSON-ready, so FastAPI's jsonable_encoder pass over every nested dict is skipped
+
+def accepted(job):
+    return ORJSONResponse(job, status_code=202, headers={'Location': job['url']})
+
 # Book Endpoints
+@router.get("/books/")
+async def list_books_endpoint(after: int = None, limit: int = Query(50, ge=1, le=1000), stream: bool = False, fields: str = FIELDS_QUERY):
+    selected = parse_fields(fields)
+    if stream:
+        # NDJSON: documents are written as the cursor yields them, limit is the batch size
+        return StreamingResponse(stream_books(after, limit, selected), media_type="application/x-ndjson")
+    return ORJSONResponse(await list_books(after, limit, selected))
+
 @router.post("/books/")
-async def add_books_endpoint(books: list[Book]):
+async def add_books_endpoint(books: list[Book], run_async: bool = ASYNC_QUERY):
+    if run_async:
+        return accepted(await submit_job('add_books', books))
     return await add_books(books)
 
 @router.put("/books/")
-async def update_books_endpoint(book_updates: list[UpdateBook]):
+async def update_books_endpoint(book_updates: list[UpdateBook], run_async: bool = ASYNC_QUERY):
+    if run_async:
+        return accepted(await submit_job('update_books', book_updates))
     return await update_books(book_updates)
 
 @router.delete("/books/")
@@ -18,11 +47,13 @@ async def delete_books_endpoint(book_ids: list[int]):
     return await delete_books(book_ids)
 
 @router.get("/books/search/")
-async def search_books_endpoint(titles: list[str]):
-    return await search_books(titles)
+async def search_books_endpoint(q: str, limit: int = Query(10, ge=1, le=100), offset: int = Query(0, ge=0), fields: str = FIELDS_QUERY):
+    return ORJSONResponse(await search_books(q, limit, offset, parse_fields(fields)))
 
 @router.post("/books/rate/")
-async def rate_books_endpoint(ratings: list[Rating]):
+async def rate_books_endpoint(ratings: list[Rating], run_async: bool = ASYNC_QUERY):
+    if run_async:
+        return accepted(await submit_job('rate_books', ratings))
     return await rate_books(ratings)
 
 # User Endpoints
@@ -34,9 +65,13 @@ async def add_users_endpoint(users: list[User]):
 async def track_progress_endpoint(user_id: int, progress: list[ReadingProgress]):
     return await track_reading_progress(user_id, progress)
 
+@router.get("/users/progress/")
+async def reading_progress_endpoint(user_id: int, after: int = None, limit: int = Query(50, ge=1, le=500)):
+    return ORJSONResponse(await get_reading_progress(user_id, after, limit))
+
 @router.get("/users/recommend/")
-async def recommend_books_endpoint(user_id: int):
-    return await recommend_books(user_id)
+async def recommend_books_endpoint(user_id: int, limit: int = Query(5, ge=1, le=100), fields: str = FIELDS_QUERY):
+    return ORJSONResponse(await recommend_books(user_id, limit, parse_fields(fields)))
 
 @router.delete("/users/")
 async def delete_users_endpoint(user_ids: list[int]):
@@ -44,12 +79,60 @@ async def delete_users_endpoint(user_ids: list[int]):
 
 # Review Endpoints
 @router.post("/reviews/")
-async def add_reviews_endpoint(reviews: list[Review]):
+async def add_reviews_endpoint(reviews: list[Review], run_async: bool = ASYNC_QUERY):
+    if run_async:
+        return accepted(await submit_job('add_reviews', reviews))
     return await add_reviews(reviews)
 
+# Cleanup Endpoints
+@router.post("/cleanup/orphans")
+async def sweep_orphans_endpoint():
+    return {"cleanup_task": await cleanup_tasks.start(repo, 'orphans', sweep_orphans)}
+
+@router.get("/cleanup/{task_id}")
+async def cleanup_status_endpoint(task_id: str):
+    status = await cleanup_tasks.get(repo, task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Cleanup task not found")
+    return status
+
+# Job Endpoints
+@router.get("/jobs/{job_id}")
+async def job_status_endpoint(job_id: str):
+    return ORJSONResponse(await get_job(job_id))
+
+@router.get("/cache/stats")
+async def cache_stats_endpoint():
+    return book_cache.stats()
+
+@router.get("/health")
+async def health_endpoint():
+    # Ping latency and connection pool counters; 503 lets load balancers take the worker out
+    report = {**await repo.health(), 'startup': startup_report.snapshot()}
+    return ORJSONResponse(report, status_code=200 if report['status'] == 'ok' else 503)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    # Prometheus text format: per-route latency, status counts, in-flight and Mongo command timings
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@router.get("/books/{book_id}/reviews")
+async def book_reviews_endpoint(book_id: int, before: str = None, limit: int = Query(20, ge=1, le=100)):
+    # Cursor-paginated full review history; the book itself only embeds the latest few
+    return ORJSONResponse(await get_book_reviews(book_id, before, limit))
+
 @router.get("/books/{book_id}")
-async def read_book(book_id: int):
-    return await get_book_by_id(book_id)
+async def read_book(request: Request, book_id: int, fields: str = FIELDS_QUERY):
+    selected = parse_fields(fields)
+    if_none_match = request.headers.get('if-none-match')
+    version = None
+    if if_none_match:
+        # Revalidation only needs the version: no formatting, and no full read on a cache miss
+        version = await get_book_version(book_id)
+        if version is not None and etag_matches(if_none_match, book_etag(book_id, *version, selected)):
+            return Response(status_code=304, headers=validator_headers(book_id, *version, selected))
+    entry = await get_book_entry(book_id, version)
+    return ORJSONResponse(select_fields(entry['book'], selected), headers=validator_headers(book_id, entry['version'], entry['updated_at'], selected))
 
 
 
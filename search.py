@@ -0,0 +1,191 @@
+import asyncio
+import bisect
+import logging
+import os
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Title matches count for more than author matches
+FIELD_WEIGHTS = {'title': 2.0, 'author': 1.0}
+# Relative score of each kind of token match
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.7
+FUZZY_SCORE = 0.5
+FUZZY_THRESHOLD = 0.45  # minimum trigram Dice similarity for a fuzzy match
+MAX_EXPANSIONS = 50  # prefix/fuzzy candidates considered per query token
+# Each worker process has its own index; periodic rebuilds pick up books written through
+# other workers (0 disables them; serve.py enables them when it runs several workers)
+SEARCH_REBUILD_SECONDS = float(os.getenv("SEARCH_REBUILD_SECONDS", "0"))
+
+_token_pattern = re.compile(r"\w+")
+
+
+def normalize(text):
+    # Case-fold and strip accents so "Brontë" matches "bronte"
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+def tokenize(text):
+    return _token_pattern.findall(normalize(text or ''))
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """In-memory inverted index over book titles and authors.
+
+    Supports exact, prefix and trigram-fuzzy token matching with a simple
+    field-weighted relevance score.
+    """
+
+    def __init__(self):
+        self.documents = {}  # book_id -> {'title': ..., 'author': ..., 'tokens': {token: weight}}
+        self.postings = {}  # token -> {book_id: field weight}
+        self.vocabulary = []  # tokens, sorted lazily for prefix lookups
+        self.vocabulary_sorted = True
+        self.trigram_index = {}  # trigram -> set of tokens
+        self._journal = None  # changes made while a rebuild is scanning, replayed before its swap
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, book_id, title, author):
+        if self._journal is not None:
+            self._journal.append(('add', book_id, title, author))
+        self.index_document(book_id, title, author)
+
+    def index_document(self, book_id, title, author):
+        self.unindex_document(book_id)
+        tokens = {}
+        for field, text in (('title', title), ('author', author)):
+            for token in tokenize(text):
+                tokens[token] = max(tokens.get(token, 0.0), FIELD_WEIGHTS[field])
+        self.documents[book_id] = {'title': title, 'author': author, 'tokens': tokens, 'normalized_title': ' '.join(tokenize(title))}
+        for token, weight in tokens.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                # Sorting is deferred so bulk loads don't pay an insort per new token
+                self.vocabulary.append(token)
+                self.vocabulary_sorted = False
+                for gram in trigrams(token):
+                    self.trigram_index.setdefault(gram, set()).add(token)
+            posting[book_id] = weight
+
+    def update(self, book_id, title=None, author=None):
+        # Partial updates keep the indexed value of the fields they don't touch
+        if self._journal is not None:
+            self._journal.append(('update', book_id, title, author))
+        document = self.documents.get(book_id)
+        if document is None:
+            return
+        self.index_document(book_id, title if title is not None else document['title'], author if author is not None else document['author'])
+
+    def remove(self, book_id):
+        if self._journal is not None:
+            self._journal.append(('remove', book_id))
+        self.unindex_document(book_id)
+
+    def unindex_document(self, book_id):
+        document = self.documents.pop(book_id, None)
+        if document is None:
+            return
+        for token in document['tokens']:
+            posting = self.postings[token]
+            del posting[book_id]
+            if not posting:
+                del self.postings[token]
+                vocabulary = self.sorted_vocabulary()
+                del vocabulary[bisect.bisect_left(vocabulary, token)]
+                for gram in trigrams(token):
+                    grams = self.trigram_index[gram]
+                    grams.discard(token)
+                    if not grams:
+                        del self.trigram_index[gram]
+
+    def sorted_vocabulary(self):
+        if not self.vocabulary_sorted:
+            self.vocabulary.sort()
+            self.vocabulary_sorted = True
+        return self.vocabulary
+
+    def expand(self, token):
+        # Index tokens matching a query token, with their match score
+        matches = {}
+        if token in self.postings:
+            matches[token] = EXACT_SCORE
+        vocabulary = self.sorted_vocabulary()
+        start = bisect.bisect_left(vocabulary, token)
+        for candidate in vocabulary[start:start + MAX_EXPANSIONS]:
+            if not candidate.startswith(token):
+                break
+            matches.setdefault(candidate, PREFIX_SCORE)
+        if len(token) >= 3:
+            grams = trigrams(token)
+            shared = {}
+            for gram in grams:
+                for candidate in self.trigram_index.get(gram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            for candidate, count in sorted(shared.items(), key=lambda item: -item[1])[:MAX_EXPANSIONS]:
+                similarity = 2 * count / (len(grams) + len(trigrams(candidate)))
+                if similarity >= FUZZY_THRESHOLD:
+                    matches.setdefault(candidate, FUZZY_SCORE * similarity)
+        return matches
+
+    def search(self, query, limit=10, offset=0):
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return [], 0
+        scores = {}
+        for token in dict.fromkeys(query_tokens):
+            best = {}
+            for candidate, match_score in self.expand(token).items():
+                for book_id, weight in self.postings[candidate].items():
+                    score = match_score * weight
+                    if score > best.get(book_id, 0.0):
+                        best[book_id] = score
+            for book_id, score in best.items():
+                scores[book_id] = scores.get(book_id, 0.0) + score
+
+        # Whole-title matches outrank books that merely share the words
+        normalized = ' '.join(query_tokens)
+        for book_id in scores:
+            if self.documents[book_id]['normalized_title'] == normalized:
+                scores[book_id] += EXACT_SCORE * FIELD_WEIGHTS['title'] * len(query_tokens)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [book_id for book_id, _ in ranked[offset:offset + limit]], len(ranked)
+
+    async def rebuild(self, repo):
+        # Stream the catalog with a projection into a fresh index, then swap it in.
+        # Writes through this worker during the scan may be missing from it, so they
+        # are journaled and replayed; replay and swap run without yielding the loop.
+        fresh = SearchIndex()
+        self._journal = []
+        try:
+            async for book in repo.books.scan(fields=('id', 'title', 'author')):
+                fresh.add(book['id'], book.get('title', ''), book.get('author', ''))
+            for change in self._journal:
+                getattr(fresh, change[0])(*change[1:])
+        finally:
+            self._journal = None
+        self.documents, self.postings = fresh.documents, fresh.postings
+        self.vocabulary, self.trigram_index = fresh.sorted_vocabulary(), fresh.trigram_index
+        self.vocabulary_sorted = True
+        logger.info("Search index built for %d books", len(self.documents))
+
+    async def run(self, repo, interval=SEARCH_REBUILD_SECONDS):
+        # Background task: rebuild the index from the database every interval seconds
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.rebuild(repo)
+            except Exception:
+                logger.exception("Search index rebuild failed")
+
+
+search_index = SearchIndex()
@@ -1,27 +1,49 @@
 import os
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
- 
+
 is_production = os.getenv("ENVIRONMENT") == "production"
- 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response: Response = await call_next(request)
-       
+
+# Header sets are encoded once at import and appended at http.response.start
+DOCS_PREFIXES = ("/docs", "/redoc")
+DOCS_HEADERS = [
+    (b"content-security-policy",
+     b"default-src 'self'; "
+     b"script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
+     b"style-src 'self' 'unsafe-inline';")
+]
+API_HEADERS = [
+    (b"content-security-policy", b"default-src 'self';"),
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"strict-transport-security", b"max-age=63072000; includeSubDomains; preload"),
+    (b"x-xss-protection", b"0"),
+    (b"referrer-policy", b"no-referrer")
+]
+DOCS_HEADER_NAMES = frozenset(name for name, _ in DOCS_HEADERS)
+API_HEADER_NAMES = frozenset(name for name, _ in API_HEADERS)
+
+class SecurityHeadersMiddleware:
+    """Pure ASGI middleware adding security headers to every HTTP response."""
+
+    def __init__(self, app, enabled=is_production):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
         # Apply security headers only in production
-        if is_production:
-            if request.url.path.startswith("/docs") or request.url.path.startswith("/redoc"):
-                response.headers["Content-Security-Policy"] = (
-                    "default-src 'self'; "
-                    "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
-                    "style-src 'self' 'unsafe-inline';"
-                )
-            else:
-                response.headers["Content-Security-Policy"] = "default-src 'self';"
-                response.headers["X-Content-Type-Options"] = "nosniff"
-                response.headers["X-Frame-Options"] = "DENY"
-                response.headers["Strict-Transport-Security"] = "max-age=63072000; includeSubDomains; preload"
-                response.headers["X-XSS-Protection"] = "0"
-                response.headers["Referrer-Policy"] = "no-referrer"
- 
-        return response
\ No newline at end of file
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"].startswith(DOCS_PREFIXES):
+            extra_headers, names = DOCS_HEADERS, DOCS_HEADER_NAMES
+        else:
+            extra_headers, names = API_HEADERS, API_HEADER_NAMES
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                # Existing headers with the same names are replaced, as before
+                headers = [header for header in message.get("headers", []) if header[0].lower() not in names]
+                message["headers"] = headers + extra_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
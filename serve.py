@@ -0,0 +1,143 @@
+"""Production entry point: python serve.py
+
+Runs WEB_WORKERS uvicorn worker processes (default: one per available CPU)
+sharing one listening socket. It uses uvloop and httptools when they are
+installed and falls back to asyncio and h11 with a warning otherwise.
+
+    WEB_HOST / WEB_PORT         bind address (0.0.0.0:8000)
+    WEB_WORKERS                 worker processes (CPUs available to this process)
+    WEB_KEEP_ALIVE              idle keep-alive seconds; keep it above the load
+                                balancer's idle timeout so the proxy closes first
+    WEB_BACKLOG                 listen backlog of the shared socket
+    WEB_GRACEFUL_TIMEOUT        seconds in-flight requests get to finish after SIGTERM
+    WEB_LIMIT_MAX_REQUESTS      recycle a worker after this many requests (unset: never)
+    WEB_ACCESS_LOG              per-request access log lines (false)
+
+Each worker runs the app lifespan before it accepts connections, which
+covers the MongoDB pool warm-up, the search index and WARM_UP_BOOKS. It then
+logs a startup report; /health shows the same report for the worker that
+answered. On SIGTERM, workers stop accepting, finish in-flight requests up
+to WEB_GRACEFUL_TIMEOUT, then run the lifespan shutdown, which drains
+cleanup tasks and closes the client.
+
+Per-process state multiplies with the workers. With more than one, this
+launcher sets up what has to be shared:
+- /metrics: every worker publishes its metrics to METRICS_DIR (a fresh
+  temporary directory unless set) and the one answering a scrape reports the
+  sum of all of them, so counters stay monotonic. Published every
+  METRICS_PUBLISH_SECONDS, so the other workers' share can be that stale.
+- Logs: LOG_FILE_PER_PROCESS is set, so each worker rotates its own
+  log_file.<pid>.log; log to stdout (LOG_CONSOLE) to get a single stream.
+  uvicorn's server and access lines go through the same queue and files.
+  Recycled workers (WEB_LIMIT_MAX_REQUESTS) start new files.
+- Recommender: the model is built once here and saved to
+  RECOMMENDER_MODEL_PATH, so workers load it instead of each building its
+  own in a spawned process. Each worker still rebuilds it on its own every
+  RECOMMENDER_REBUILD_SECONDS.
+- Cleanup status is recorded in the jobs collection, so any worker answers
+  GET /cleanup/{id}, as it does for the background jobs of ?async=true writes.
+What stays per worker:
+- Every worker opens its own MongoDB pool of up to MONGODB_MAX_POOL_SIZE.
+- Every worker has its own book cache, invalidated only by its own writes,
+  so other workers can serve a changed book for up to BOOK_CACHE_TTL.
+  Conditional GETs (If-None-Match) always check the stored version, so a
+  304 is never given for a book that has changed.
+- Every worker has its own search index; SEARCH_REBUILD_SECONDS defaults to
+  300 here so books added through other workers become searchable.
+- Captured profiles (/debug/profiles) are those of the worker that answers;
+  the profiler is meant for single-worker debugging and is off in production.
+- Admission control limits (ADMISSION_MAX_CONCURRENCY, ADMISSION_CLIENT_RATE)
+  apply per worker, so the totals scale with WEB_WORKERS.
+- The memory backend lives inside a single process, so it always runs with
+  one worker.
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import tempfile
+import uvicorn
+
+logger = logging.getLogger("serve")
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+WEB_WORKERS = os.getenv("WEB_WORKERS")
+WEB_KEEP_ALIVE = int(os.getenv("WEB_KEEP_ALIVE", "65"))
+WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", "2048"))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+WEB_LIMIT_MAX_REQUESTS = os.getenv("WEB_LIMIT_MAX_REQUESTS")
+WEB_ACCESS_LOG = os.getenv("WEB_ACCESS_LOG", "false") == "true"
+
+
+def available_cpus():
+    # Honours CPU affinity (taskset, container cpusets) where the platform exposes it
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def worker_count():
+    workers = int(WEB_WORKERS) if WEB_WORKERS else available_cpus()
+    if os.getenv("STORAGE_BACKEND", "mongo") == "memory" and workers > 1:
+        logger.warning("The memory backend is per-process; running 1 worker instead of %d", workers)
+        return 1
+    return max(workers, 1)
+
+def installed(module):
+    return importlib.util.find_spec(module) is not None
+
+def share_metrics():
+    # A fresh directory per launch; files of a previous run would be summed in
+    metrics_dir = os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="metrics-"))
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        if name.endswith(('.pickle', '.pickle.tmp')):
+            os.remove(os.path.join(metrics_dir, name))
+    return metrics_dir
+
+def build_recommender_model():
+    # Without a saved model every worker would build its own at startup
+    import recommender
+    if os.path.exists(recommender.RECOMMENDER_MODEL_PATH):
+        return
+    logger.info("Building the recommender model once for all workers")
+    try:
+        asyncio.run(recommender.main())
+    except Exception:
+        logger.exception("Building the recommender model failed; each worker builds its own")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    workers = worker_count()
+    loop = 'uvloop' if installed('uvloop') else 'asyncio'
+    http = 'httptools' if installed('httptools') else 'h11'
+    if loop != 'uvloop' or http != 'httptools':
+        logger.warning("uvloop/httptools not installed; running on %s with %s", loop, http)
+    if workers > 1:
+        # Workers are spawned, so they inherit the environment set here
+        os.environ.setdefault("SEARCH_REBUILD_SECONDS", "300")
+        os.environ.setdefault("LOG_FILE_PER_PROCESS", "true")
+        logger.info("Workers publish metrics to %s", share_metrics())
+        build_recommender_model()
+    logger.info("Starting %d worker(s) on %s:%d (%s, %s, keep-alive %ds, backlog %d)",
+                workers, WEB_HOST, WEB_PORT, loop, http, WEB_KEEP_ALIVE, WEB_BACKLOG)
+    uvicorn.run(
+        "main:app",
+        host=WEB_HOST,
+        port=WEB_PORT,
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=WEB_KEEP_ALIVE,
+        backlog=WEB_BACKLOG,
+        timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT,
+        limit_max_requests=int(WEB_LIMIT_MAX_REQUESTS) if WEB_LIMIT_MAX_REQUESTS else None,
+        access_log=WEB_ACCESS_LOG,
+        # No handlers of uvicorn's own: its error and access records propagate to
+        # the root logger, which each worker routes through logger.setup_logging()
+        log_config=None,
+        proxy_headers=True
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1,177 +1,492 @@
 from models import Book, UpdateBook, Rating, User, Review, ReadingProgress
-from database import db
-from logger import logger
+from storage import repo
+from repository import SUMMARY_REVIEW_FIELDS
+from cache import book_cache
+from cleanup import cleanup_tasks, chunks, CLEANUP_BATCH_SIZE
+from recommender import recommender, FAVORITE_WEIGHT, REVIEW_WEIGHT
+from search import search_index
+from jobs import job_runner
 from fastapi import HTTPException
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import asyncio
 import logging
+import os
+import orjson
 
-# Set up logging configuration
-logging.basicConfig(level=logging.INFO)
+# Handlers are configured once by logger.setup_logging(); arguments are only
+# interpolated for records that pass the level check
 logger = logging.getLogger(__name__)
 
-async def format_book(book):
-    # Fetch reviews associated with the book
-    reviews = await db.reviews.find({'book_id': book['id']}).to_list(length=None)
+# Selectable book fields and their response keys, in response order.
+# 'reviews' are the latest reviews embedded in the book document.
+BOOK_FIELDS = {
+    'id': 'ID',
+    'title': 'Title',
+    'author': 'Author',
+    'year': 'Year',
+    'isbn': 'ISBN',
+    'average_rating': 'Average Rating',
+    'review_count': 'Review Count',
+    'review_histogram': 'Review Rating Histogram',  # ratings given with reviews; /books/rate/ only feeds the average
+    'reviews': 'Reviews'
+}
+ALL_BOOK_FIELDS = tuple(BOOK_FIELDS)
+# Number of newest reviews kept inline on each book; older ones are paged from /books/{id}/reviews
+REVIEW_SUMMARY_SIZE = int(os.getenv("REVIEW_SUMMARY_SIZE", "5"))
+# Books (lowest ids first) loaded into the book cache at startup; 0 leaves it cold
+WARM_UP_BOOKS = int(os.getenv("WARM_UP_BOOKS", "0"))
 
-    # Logging for debugging
-    logger.info(f"Fetching reviews for Book ID: {book['id']}, Found Reviews: {len(reviews)}")
+def parse_fields(fields: str = None):
+    # "title,author" -> ('id', 'title', 'author'); the id is always returned since pages are keyed on it
+    if fields is None:
+        return ALL_BOOK_FIELDS
+    names = tuple(dict.fromkeys(['id'] + [name.strip() for name in fields.split(',') if name.strip()]))
+    unknown = [name for name in names if name not in BOOK_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields {unknown}; choose from {list(BOOK_FIELDS)}")
+    return names
 
+def document_fields(fields):
+    # The book document projection for a field selection
+    return tuple('latest_reviews' if field == 'reviews' else field for field in fields)
+
+def format_review(review):
     return {
-        'ID': book['id'],
-        'Title': book['title'],
-        'Author': book['author'],
-        'Year': book['year'],
-        'ISBN': book['isbn'],
-        'Average Rating': book.get('average_rating', 0),
-        'Reviews': [
-            {
-                'User ID': review['user_id'],
-                'Content': review['content'],
-                'Rating': review['rating']
-            } for review in reviews
-        ] if reviews else []
+        'User ID': review['user_id'],
+        'Content': review['content'],
+        'Rating': review.get('rating'),
+        'Created At': review.get('created_at')
     }
 
-async def get_book_by_id(book_id: int):
-    book = await db.books.find_one({'id': book_id})  # Fetch book by ID
+def build_book_response(book, fields=ALL_BOOK_FIELDS):
+    response = {}
+    for field in fields:
+        if field == 'reviews':
+            response['Reviews'] = [format_review(review) for review in book.get('latest_reviews', [])]
+        elif field == 'average_rating':
+            response['Average Rating'] = book.get('average_rating', 0)
+        elif field == 'review_count':
+            response['Review Count'] = book.get('review_count', 0)
+        elif field == 'review_histogram':
+            response['Review Rating Histogram'] = book.get('review_histogram', {})
+        else:
+            response[BOOK_FIELDS[field]] = book[field]
+    return response
+
+def format_books(books, fields=ALL_BOOK_FIELDS):
+    # The review summary is embedded in each book, so formatting needs no further queries
+    return [build_book_response(book, fields) for book in books]
+
+def format_book(book):
+    return build_book_response(book)
+
+def select_fields(formatted, fields=ALL_BOOK_FIELDS):
+    # Trim a fully formatted book to the requested response keys
+    if fields is ALL_BOOK_FIELDS:
+        return formatted
+    return {BOOK_FIELDS[field]: formatted[BOOK_FIELDS[field]] for field in fields}
+
+async def get_book_by_id(book_id: int, fields=ALL_BOOK_FIELDS):
+    return select_fields((await get_book_entry(book_id))['book'], fields)
+
+async def get_book_entry(book_id: int, current=None):
+    # Served from the read-through cache; every write path below invalidates it.
+    # The cache holds the full response, so a field selection only trims the keys.
+    # current: (version, updated_at) just read from the repository; a cached entry that
+    # differs was left behind by a write another worker handled, and is reloaded.
+    if current is not None:
+        entry = book_cache.peek(book_id)
+        if entry is not None and (entry['version'], entry['updated_at']) != current:
+            book_cache.invalidate(book_id)
+    return await book_cache.get_or_load(book_id, lambda: load_book(book_id))
+
+async def load_book(book_id: int):
+    # A single-document read: the latest reviews and their counts are embedded
+    book = await repo.books.get(book_id, fields=document_fields(ALL_BOOK_FIELDS) + ('version', 'updated_at'))  # Fetch book by ID
     if not book:
-        logger.warning(f"Book with ID {book_id} not found")  # Log if no book is found
+        logger.warning("Book with ID %s not found", book_id)  # Log if no book is found
         raise HTTPException(status_code=404, detail="Book not found")
     
-    formatted_book = await format_book(book)  # Format the book asynchronously
-    logger.info(f"Book found: {formatted_book}")  # Log the found book details
-    return formatted_book
+    formatted_book = format_book(book)
+    logger.debug("Book found: %s", formatted_book)  # Log the found book details
+    return {'book': formatted_book, 'version': book.get('version', 0), 'updated_at': book.get('updated_at')}
+
+async def warm_book_cache(limit: int):
+    if limit <= 0:
+        return
+    books = await repo.books.page(limit=limit, fields=('id',))
+    await asyncio.gather(*(get_book_entry(book['id']) for book in books))
+    logger.info("Book cache warmed with %d books", len(books))
+
+async def get_book_version(book_id: int):
+    # (version, updated_at) of a book without loading or formatting it, or None if it doesn't exist.
+    # Always read from the repository: the book cache is per worker, and a write handled by
+    # another worker leaves this one's entry stale until its TTL runs out.
+    book = await repo.books.get(book_id, fields=('id', 'version', 'updated_at'))
+    return (book.get('version', 0), book.get('updated_at')) if book else None
+
+def as_utc(updated_at):
+    # Mongo hands back naive UTC datetimes
+    return updated_at.replace(tzinfo=timezone.utc) if updated_at.tzinfo is None else updated_at.astimezone(timezone.utc)
+
+def book_etag(book_id, version, updated_at, fields=ALL_BOOK_FIELDS):
+    # The version restarts at 1 when a deleted id is created again; the time of the
+    # last write (milliseconds, as Mongo stores it) tells the two books apart.
+    # A field selection is a different representation, so it gets its own tag.
+    written = int(as_utc(updated_at).timestamp() * 1000) if updated_at is not None else 0
+    selection = 'all' if fields is ALL_BOOK_FIELDS else '+'.join(fields)
+    return f'"{book_id}-{version}-{written:x}-{selection}"'
+
+def etag_matches(if_none_match, etag):
+    # Weak comparison, as If-None-Match requires
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+def validator_headers(book_id, version, updated_at, fields=ALL_BOOK_FIELDS):
+    headers = {'ETag': book_etag(book_id, version, updated_at, fields), 'Cache-Control': 'no-cache'}
+    if updated_at is not None:
+        headers['Last-Modified'] = format_datetime(as_utc(updated_at), usegmt=True)
+    return headers
+
+# Function to page through all reviews of a book, newest first
+async def get_book_reviews(book_id: int, before: str = None, limit: int = 20):
+    try:
+        reviews, next_before = await repo.reviews.page(book_id, before, limit)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid review cursor")
+    # Only an empty first page needs to tell a missing book from one without reviews
+    if not reviews and before is None and not await repo.books.existing_ids([book_id]):
+        logger.warning("Book with ID %s not found", book_id)
+        raise HTTPException(status_code=404, detail="Book not found")
+    return {"reviews": [format_review(review) for review in reviews], "next_before": next_before}
+
+async def refresh_review_summaries(book_ids):
+    # Recompute embedded summaries after reviews were deleted
+    book_ids = list(book_ids)
+    if book_ids:
+        await repo.books.set_review_summaries(await repo.reviews.summaries(book_ids, REVIEW_SUMMARY_SIZE))
+        book_cache.invalidate(*book_ids)
+
+async def backfill_review_summaries():
+    # Books stored before summaries existed, or written by other tools, get one computed at startup
+    missing = [book['id'] async for book in repo.books.scan(fields=('id', 'review_count')) if 'review_count' not in book]
+    for batch in chunks(missing):
+        await refresh_review_summaries(batch)
+    if missing:
+        logger.info("Backfilled review summaries of %d books", len(missing))
+
+def new_book_document(book: dict, now):
+    # New books start with an empty review summary at version 1
+    return {**book, 'review_count': 0, 'review_histogram': {}, 'latest_reviews': [], 'version': 1, 'updated_at': now}
 
 async def add_books(books: list[Book]):
-    added_books = []
-    for book in books:
-        existing_book = await db.books.find_one({'id': book.id})
-        if existing_book:
-            logger.warning(f"Book with ID {book.id} already exists")
-            continue
-        await db.books.insert_one(book.dict())
-        logger.info(f"Book '{book.title}' added successfully")
-        added_books.append(book.title)
-    return {"message": f"Books added: {', '.join(added_books)}"} if added_books else {"message": "No new books added"}
+    now = datetime.now(timezone.utc)
+    new_books, duplicates = await repo.books.insert_unique([new_book_document(book.dict(), now) for book in books])
+    if duplicates:
+        logger.warning("Books already exist: %s", duplicates)
+    if new_books:
+        for book in new_books:
+            search_index.add(book['id'], book['title'], book['author'])
+        logger.info("Added %d books", len(new_books))
+    added_books = [book['title'] for book in new_books]
+    message = f"Books added: {', '.join(added_books)}" if added_books else "No new books added"
+    return {"message": message, "added": [book['id'] for book in new_books], "duplicates": duplicates}
+
+
+# Function to list books a page at a time, ordered by id
+async def list_books(after: int = None, limit: int = 50, fields=ALL_BOOK_FIELDS):
+    # Keyset pagination: resume after the last id seen instead of skipping rows
+    books = await repo.books.page(after, limit, fields=document_fields(fields))
+    next_after = books[-1]['id'] if len(books) == limit else None
+    return {"books": format_books(books, fields), "next_after": next_after}
 
+# Function to stream books as NDJSON
+async def stream_books(after: int = None, batch_size: int = 500, fields=ALL_BOOK_FIELDS):
+    batch = []
+    async for book in repo.books.scan(after, batch_size, fields=document_fields(fields)):
+        batch.append(book)
+        if len(batch) == batch_size:
+            for formatted in format_books(batch, fields):
+                yield orjson.dumps(formatted) + b"\n"
+            batch = []
+    if batch:
+        for formatted in format_books(batch, fields):
+            yield orjson.dumps(formatted) + b"\n"
 
 # Function to update books
 async def update_books(book_updates: list[UpdateBook]):
-    updated_books = []
+    existing = await repo.books.existing_ids({update.id for update in book_updates})
+    updates, updated_books, not_found = {}, [], []
     for update in book_updates:
-        existing_book = await db.books.find_one({'id': update.id})
-        if not existing_book:
-            logger.warning(f"Book with ID {update.id} not found")
+        if update.id not in existing:
+            not_found.append(update.id)
             continue
-        await db.books.update_one({'id': update.id}, {'$set': update.dict(exclude_unset=True)})
-        logger.info(f"Book with ID {update.id} updated")
+        # Repeated ids merge, the later fields winning, as consecutive updates would
+        updates.setdefault(update.id, {}).update(update.dict(exclude_unset=True))
         updated_books.append(update.id)
-    return {"message": f"Books updated: {', '.join(map(str, updated_books))}"} if updated_books else {"message": "No books updated"}
+    if not_found:
+        logger.warning("Books not found: %s", not_found)
+    if updates:
+        await repo.books.update_fields(updates)
+        book_cache.invalidate(*updated_books)
+        for update in book_updates:
+            if update.id in existing:
+                search_index.update(update.id, update.title, update.author)
+        logger.info("Updated %d books", len(updates))
+    message = f"Books updated: {', '.join(map(str, updated_books))}" if updated_books else "No books updated"
+    return {"message": message, "updated": updated_books, "not_found": not_found}
 
 # Function to delete books
 async def delete_books(book_ids: list[int]):
-    deleted_books = []
-    for book_id in book_ids:
-        result = await db.books.delete_one({'id': book_id})
-        if result.deleted_count == 0:
-            logger.warning(f"Book with ID {book_id} not found")
-            continue
-        logger.info(f"Book with ID {book_id} deleted")
-        deleted_books.append(book_id)
-    return {"message": f"Books deleted: {', '.join(map(str, deleted_books))}"} if deleted_books else {"message": "No books deleted"}
+    existing = await repo.books.existing_ids(set(book_ids))
+    deleted_books = [book_id for book_id in dict.fromkeys(book_ids) if book_id in existing]
+    not_found = [book_id for book_id in book_ids if book_id not in existing]
+    if not_found:
+        logger.warning("Books not found: %s", not_found)
+    if deleted_books:
+        await repo.books.delete(deleted_books)
+        book_cache.invalidate(*deleted_books)
+        for book_id in deleted_books:
+            search_index.remove(book_id)
+        logger.info("Deleted %d books", len(deleted_books))
+    response = {"message": f"Books deleted: {', '.join(map(str, deleted_books))}" if deleted_books else "No books deleted"}
+    response.update(deleted=deleted_books, not_found=not_found)
+    if deleted_books:
+        # Reviews and progress rows of the deleted books are removed in the background
+        response["cleanup_task"] = await cleanup_tasks.start(repo, 'books', lambda deleted: cleanup_book_data(deleted_books, deleted))
+    return response
+
+async def cleanup_book_data(book_ids, deleted):
+    for batch in chunks(book_ids):
+        deleted['reviews'] = deleted.get('reviews', 0) + await repo.reviews.delete_where('book_id', batch)
+        deleted['reading_progress'] = deleted.get('reading_progress', 0) + await repo.reading_progress.delete_where('book_id', batch)
+    logger.info("Cleaned up data of %d deleted books: %s", len(book_ids), deleted)
 
 # Function to search books by titles
-async def search_books(titles: list[str]):
-    books = await db.books.find({'title': {'$in': titles}}).to_list(length=len(titles))
-    logger.info(f"Books searched with titles: {', '.join(titles)}")
-    return [format_book(book) for book in books] if books else {"message": "No books found"}
+async def search_books(query: str, limit: int = 10, offset: int = 0, fields=ALL_BOOK_FIELDS):
+    # Ranking happens in the in-memory index; only the requested page is fetched
+    book_ids, total = search_index.search(query, limit=limit, offset=offset)
+    logger.info("Books searched with query %r: %d matches", query, total)
+    if not book_ids:
+        return {"message": "No books found"}
+    rank = {book_id: position for position, book_id in enumerate(book_ids)}
+    books = await repo.books.find_many(book_ids, fields=document_fields(fields))
+    books.sort(key=lambda book: rank[book['id']])
+    return format_books(books, fields)
 
 # Function to rate books
 async def rate_books(book_ratings: list[Rating]):
-    rated_books = []
+    # Pre-aggregate the ratings of each book so it gets a single update
+    totals = {}
     for rating in book_ratings:
-        book = await db.books.find_one({'id': rating.book_id})
-        if not book:
-            logger.warning(f"Book with ID {rating.book_id} not found")
-            continue
-        current_avg = book.get('average_rating', 0)
-        current_count = book.get('rating_count', 0)
-        new_avg = ((current_avg * current_count) + rating.value) / (current_count + 1)
-        await db.books.update_one({'id': rating.book_id}, {'$set': {'average_rating': new_avg, 'rating_count': current_count + 1}})
-        logger.info(f"Rated book ID {rating.book_id}")
-        rated_books.append(rating.book_id)
-    return {"message": f"Books rated: {', '.join(map(str, rated_books))}"} if rated_books else {"message": "No books rated"}
+        rating_sum, rating_count = totals.get(rating.book_id, (0, 0))
+        totals[rating.book_id] = (rating_sum + rating.value, rating_count + 1)
+
+    if not totals:
+        return {"message": "No books rated", "rated": [], "not_found": []}
+    # The repository increments running sums and derives the average atomically,
+    # so concurrent ratings never overwrite each other
+    matched = await repo.books.add_ratings(totals)
+    book_cache.invalidate(*totals)
+
+    # Only pay for an existence lookup when some of the books were missing
+    rated_books, not_found = list(totals), []
+    if matched < len(totals):
+        existing = await repo.books.existing_ids(rated_books)
+        not_found = [book_id for book_id in rated_books if book_id not in existing]
+        rated_books = [book_id for book_id in rated_books if book_id in existing]
+        logger.warning("Books not found: %s", not_found)
+    recommender.record_ratings({book_id: totals[book_id][1] for book_id in rated_books})
+    logger.info("Rated %d books", len(rated_books))
+    message = f"Books rated: {', '.join(map(str, rated_books))}" if rated_books else "No books rated"
+    return {"message": message, "rated": rated_books, "not_found": not_found}
 
 # Function to add users
 async def add_users(users: list[User]):
-    added_users = []
-    for user in users:
-        existing_user = await db.users.find_one({'id': user.id})
-        if existing_user:
-            logger.warning(f"User with ID {user.id} already exists")
-            continue
-        await db.users.insert_one(user.dict())
-        logger.info(f"User '{user.name}' added")
-        added_users.append(user.name)
-    return {"message": f"Users added: {', '.join(added_users)}"} if added_users else {"message": "No new users added"}
+    new_users, duplicates = await repo.users.insert_unique([user.dict() for user in users])
+    if duplicates:
+        logger.warning("Users already exist: %s", duplicates)
+    if new_users:
+        logger.info("Added %d users", len(new_users))
+    for user in new_users:
+        for book_id in user['favorite_books']:
+            recommender.add_interaction(user['id'], book_id, FAVORITE_WEIGHT)
+    added_users = [user['name'] for user in new_users]
+    message = f"Users added: {', '.join(added_users)}" if added_users else "No new users added"
+    return {"message": message, "added": [user['id'] for user in new_users], "duplicates": duplicates}
 
 # Function to delete users and associated reviews
 async def delete_users(user_ids: list[int]):
-    deleted_users = []
-    for user_id in user_ids:
-        result = await db.users.delete_one({'id': user_id})
-        if result.deleted_count == 0:
-            logger.warning(f"User with ID {user_id} not found")
-            continue
-        logger.info(f"User with ID {user_id} deleted")
-        deleted_users.append(user_id)
+    existing = await repo.users.existing_ids(set(user_ids))
+    deleted_users = [user_id for user_id in dict.fromkeys(user_ids) if user_id in existing]
+    not_found = [user_id for user_id in user_ids if user_id not in existing]
+    if not_found:
+        logger.warning("Users not found: %s", not_found)
+    if not deleted_users:
+        return {"message": "No users deleted", "deleted": [], "not_found": not_found}
+    await repo.users.delete(deleted_users)
+    logger.info("Deleted %d users", len(deleted_users))
+    # Reviews and reading progress of the deleted users are removed in the background
+    task_id = await cleanup_tasks.start(repo, 'users', lambda deleted: cleanup_user_data(deleted_users, deleted))
+    return {
+        "message": f"Users deleted: {', '.join(map(str, deleted_users))}",
+        "deleted": deleted_users,
+        "not_found": not_found,
+        "cleanup_task": task_id
+    }
 
-        # Delete all reviews by the user
-        await db.reviews.delete_many({'user_id': user_id})
-        logger.info(f"Deleted reviews by user {user_id}")
-        await db.reading_progress.delete_many({'user_id': user_id})
-        logger.info(f"Deleted user with ID {user_id} and their reading progress")
+async def cleanup_user_data(user_ids, deleted):
+    for batch in chunks(user_ids):
+        # The books the deleted reviews appeared on get their summaries recomputed
+        reviewed_books = await repo.reviews.reviewed_books(batch)
+        deleted['reviews'] = deleted.get('reviews', 0) + await repo.reviews.delete_where('user_id', batch)
+        await refresh_review_summaries(reviewed_books)
+        deleted['reading_progress'] = deleted.get('reading_progress', 0) + await repo.reading_progress.delete_where('user_id', batch)
+    logger.info("Cleaned up data of %d deleted users: %s", len(user_ids), deleted)
 
-    return {"message": f"Users deleted: {', '.join(map(str, deleted_users))}"} if deleted_users else {"message": "No users deleted"}
+async def dangling_ids(children, field, parents):
+    # Distinct values of children.field with no matching id in parents
+    missing = []
+    batch = []
+    async for value in children.distinct(field):
+        batch.append(value)
+        if len(batch) == CLEANUP_BATCH_SIZE:
+            existing = await parents.existing_ids(batch)
+            missing.extend(value for value in batch if value not in existing)
+            batch = []
+    if batch:
+        existing = await parents.existing_ids(batch)
+        missing.extend(value for value in batch if value not in existing)
+    return missing
+
+async def sweep_orphans(deleted):
+    # Remove reviews and progress rows whose book or user no longer exists
+    for children, name in ((repo.reviews, 'reviews'), (repo.reading_progress, 'reading_progress')):
+        for field, parents in (('book_id', repo.books), ('user_id', repo.users)):
+            for batch in chunks(await dangling_ids(children, field, parents)):
+                # Reviews of deleted users can still be summarized on books that exist
+                affected = await repo.reviews.reviewed_books(batch) if children is repo.reviews and field == 'user_id' else []
+                deleted[name] = deleted.get(name, 0) + await children.delete_where(field, batch)
+                await refresh_review_summaries(affected)
+    logger.info("Orphan sweep removed %s", deleted)
 
 # Function to track reading progress
 async def track_reading_progress(user_id: int, progress: list[ReadingProgress]):
-    user = await db.users.find_one({'id': user_id})
-    if not user:
-        logger.warning(f"User with ID {user_id} not found")
+    if not await repo.users.get(user_id, fields=('id',)):
+        logger.warning("User with ID %s not found", user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    for prog in progress:
-        for existing_prog in user.get('reading_progress', []):
-            if existing_prog['book_id'] == prog.book_id:
-                existing_prog['percentage_read'] = prog.percentage_read
-                logger.info(f"Updated reading progress for book {prog.book_id}")
-                break
-        else:
-            user.setdefault('reading_progress', []).append(prog.dict())
-            logger.info(f"Added new progress for book {prog.book_id}")
-    await db.users.update_one({'id': user_id}, {'$set': {'reading_progress': user['reading_progress']}})
-    return {"message": f"Reading progress updated for user {user_id}"}
+    # The last entry wins when a request repeats a book
+    latest = {prog.book_id: prog.percentage_read for prog in progress}
+    if not latest:
+        return {"message": f"No reading progress given for user {user_id}", "added": 0, "updated": 0}
+    added, updated = await repo.reading_progress.upsert(user_id, latest, datetime.now(timezone.utc))
+    logger.debug("Reading progress for user %s: %d added, %d updated", user_id, added, updated)
+    return {
+        "message": f"Reading progress updated for user {user_id}",
+        "added": added,
+        "updated": updated
+    }
+
+# Function to page through a user's reading progress, ordered by book id
+async def get_reading_progress(user_id: int, after: int = None, limit: int = 50):
+    rows = await repo.reading_progress.page(user_id, after, limit)
+    return {
+        "progress": [
+            {
+                'Book ID': row['book_id'],
+                'Percentage Read': row['percentage_read'],
+                'Updated At': row.get('updated_at')
+            } for row in rows
+        ],
+        "next_after": rows[-1]['book_id'] if len(rows) == limit else None
+    }
 
 # Function to recommend books for a user
-async def recommend_books(user_id: int):
-    user = await db.users.find_one({'id': user_id})
+async def recommend_books(user_id: int, limit: int = 5, fields=ALL_BOOK_FIELDS):
+    user = await repo.users.get(user_id, fields=('id', 'favorite_books'))
     if not user:
-        logger.warning(f"User with ID {user_id} not found")
+        logger.warning("User with ID %s not found", user_id)
         raise HTTPException(status_code=404, detail="User not found")
     favorite_books = user.get('favorite_books', [])
-    recommendations = await db.books.find({'id': {'$nin': favorite_books}}).to_list(length=5)
-    logger.info(f"Recommended books for user {user_id}")
-    return [format_book(book) for book in recommendations] if recommendations else {"message": "No recommendations found"}
+    if recommender.ready:
+        # Ranked ids come from the in-memory model; only the winners are fetched
+        book_ids = recommender.recommend(user_id, exclude=favorite_books, k=limit)
+        rank = {book_id: position for position, book_id in enumerate(book_ids)}
+        recommendations = await repo.books.find_many(book_ids, fields=document_fields(fields))
+        recommendations.sort(key=lambda book: rank[book['id']])
+    else:
+        book_ids, recommendations = [], []
+    if len(recommendations) < limit:
+        # Cold start or a sparse neighborhood: top up with any unseen books
+        excluded = favorite_books + book_ids
+        recommendations += await repo.books.sample_excluding(excluded, limit - len(recommendations), fields=document_fields(fields))
+    logger.info("Recommended books for user %s", user_id)
+    return format_books(recommendations, fields) if recommendations else {"message": "No recommendations found"}
+
+def summarize_reviews(reviews):
+    # book id -> (count, {rating: count}, summary reviews newest first) for add_review_summaries
+    additions = {}
+    for review in reversed(reviews):
+        count, histogram, latest = additions.get(review['book_id'], (0, {}, []))
+        if review.get('rating') is not None:
+            histogram[str(review['rating'])] = histogram.get(str(review['rating']), 0) + 1
+        if len(latest) < REVIEW_SUMMARY_SIZE:
+            latest.append({field: review.get(field) for field in SUMMARY_REVIEW_FIELDS})
+        additions[review['book_id']] = (count + 1, histogram, latest)
+    return additions
 
 # Function to add reviews and link to books
 async def add_reviews(reviews: list[Review]):
-    added_reviews = []
+    # Ensure that the books exist before adding their reviews
+    existing = await repo.books.existing_ids({review.book_id for review in reviews})
+    new_reviews, not_found = [], []
+    created_at = datetime.now(timezone.utc)
     for review in reviews:
-        # Ensure that the book exists before adding the review
-        book = await db.books.find_one({'id': review.book_id})
-        if not book:
-            logger.warning(f"Cannot add review for non-existing book ID {review.book_id}")
+        if review.book_id not in existing:
+            not_found.append(review.book_id)
             continue
-        await db.reviews.insert_one(review.dict())
-        logger.info(f"Review for book ID {review.book_id} added")
-        added_reviews.append(review.book_id)
-    return {"message": f"Reviews added for books: {', '.join(map(str, added_reviews))}"} if added_reviews else {"message": "No reviews added"}
+        new_reviews.append({**review.dict(), 'created_at': created_at})
+    if not_found:
+        logger.warning("Cannot add reviews for non-existing book IDs %s", not_found)
+    if new_reviews:
+        await repo.reviews.insert_many(new_reviews)
+        await repo.books.add_review_summaries(summarize_reviews(new_reviews), REVIEW_SUMMARY_SIZE)
+        book_cache.invalidate(*{review['book_id'] for review in new_reviews})
+        for review in new_reviews:
+            recommender.add_interaction(review['user_id'], review['book_id'], REVIEW_WEIGHT)
+        logger.info("Added %d reviews", len(new_reviews))
+    added_reviews = [review['book_id'] for review in new_reviews]
+    message = f"Reviews added for books: {', '.join(map(str, added_reviews))}" if added_reviews else "No reviews added"
+    return {"message": message, "added": added_reviews, "not_found": not_found}
+
+# Function to accept a batch as a background job; the items are stored and processed in chunks
+async def submit_job(kind: str, items: list):
+    # Only the fields the client sent, so partial updates stay partial when replayed
+    job = await job_runner.submit(repo, kind, [item.dict(exclude_unset=True) for item in items])
+    logger.info("Queued %s job %s with %d items in %d chunks", kind, job['id'], job['total'], job['chunks'])
+    return {"job": job['id'], "status": job['status'], "items": job['total'], "url": f"/jobs/{job['id']}"}
+
+# Function to report a job's progress and the merged per-item results of its finished chunks
+async def get_job(job_id: str):
+    job = await repo.jobs.get(job_id)
+    # Cleanup task status shares the collection; it is reported by /cleanup/{task_id}
+    if job is None or job.get('kind') not in job_runner.kinds:
+        raise HTTPException(status_code=404, detail="Job not found")
+    results, failed = {}, []
+    for chunk in await repo.jobs.chunks(job_id, states=('done', 'failed'), fields=('start', 'size', 'state', 'result', 'error')):
+        if chunk['state'] == 'failed':
+            failed.append({"items": [chunk['start'], chunk['start'] + chunk['size']], "error": chunk['error']})
+            continue
+        for key, values in (chunk['result'] or {}).items():
+            results.setdefault(key, []).extend(values)
+    report = {field: value for field, value in job.items() if field not in ('owner', 'heartbeat')}
+    return {**report, "results": results, "failed": failed}
+
+# Endpoints that accept ?async=true, with whether an interrupted chunk may safely run again:
+# inserts skip existing ids and updates set the same fields, while reviews and ratings would count twice
+job_runner.register('add_books', Book, add_books, retry_safe=True)
+job_runner.register('update_books', UpdateBook, update_books, retry_safe=True)
+job_runner.register('add_reviews', Review, add_reviews, retry_safe=False)
+job_runner.register('rate_books', Rating, rate_books, retry_safe=False)
@@ -0,0 +1,42 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """How long each startup phase of this worker process took.
+
+    Imported first by main.py, so 'import' covers loading the application
+    modules; the lifespan times the phases after it. Logged once the worker
+    is ready and included in /health.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # phase -> milliseconds, in the order they ran
+        self.total_ms = None
+
+    def imported(self):
+        self.phases['import'] = round((time.perf_counter() - self.started) * 1000, 1)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def ready(self):
+        self.total_ms = round(sum(self.phases.values()), 1)
+        logger.info("Worker %d ready after %.0f ms of startup (%s)", os.getpid(), self.total_ms,
+                    ', '.join(f"{name} {ms:.0f} ms" for name, ms in self.phases.items()))
+
+    def snapshot(self):
+        return {'pid': os.getpid(), 'phases_ms': dict(self.phases), 'total_ms': self.total_ms}
+
+
+startup_report = StartupReport()
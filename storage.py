@@ -0,0 +1,17 @@
+import os
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+
+
+def create_repositories(backend=STORAGE_BACKEND):
+    # Backends are imported lazily so the memory backend never needs a MongoDB client
+    if backend == "mongo":
+        from mongo_repository import MongoRepositories
+        return MongoRepositories()
+    if backend == "memory":
+        from memory_repository import MemoryRepositories
+        return MemoryRepositories()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected 'mongo' or 'memory'")
+
+
+repo = create_repositories()
@@ -0,0 +1,5 @@
+import os
+
+# The tests run on the embedded backend; set before any app module picks its storage
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.pop("MEMORY_SNAPSHOT_PATH", None)
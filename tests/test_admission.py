@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import admission
+from admission import AdmissionControl, AdmittedRoute
+
+
+class Gate:
+    """An ASGI app whose requests stay in flight until the gate opens."""
+
+    def __init__(self):
+        self.open = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        await self.open.wait()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+async def call(route, method='GET', client='10.0.0.1'):
+    # (status, retry-after header) of one request through route
+    response = {}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['retry_after'] = dict(message['headers']).get(b'retry-after')
+
+    await route({'type': 'http', 'method': method, 'client': (client, 1234)}, None, send)
+    return response['status'], response['retry_after']
+
+
+class AdmissionAtCapacityTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.gate = Gate()
+        self.control = AdmissionControl(max_concurrency=4, shares='high=1.0,normal=0.75,low=0.5', priorities='',
+                                        route_limits='GET /slow=1', client_rate=0, retry_after=2)
+        self.routes = {path: AdmittedRoute(self.gate, path, {'GET', 'POST'}, self.control)
+                       for path in ('/books/{book_id}', '/books/', '/slow', '/health')}
+
+    def start(self, path, method='GET'):
+        return asyncio.create_task(call(self.routes[path], method))
+
+    async def settle(self, tasks):
+        await asyncio.sleep(0)
+        self.gate.open.set()
+        return [await task for task in tasks]
+
+    async def test_low_priority_is_shed_first_and_reads_keep_the_headroom(self):
+        writes = [self.start('/books/', 'POST') for _ in range(3)]
+        await asyncio.sleep(0)
+        self.assertEqual(self.control.in_flight, 2)  # the low share of 4
+        reads = [self.start('/books/{book_id}') for _ in range(3)]
+        results = await self.settle(writes + reads)
+
+        self.assertEqual(results[:3], [(200, None), (200, None), (503, b'2')])
+        # Reads may fill the whole limit: two more fit, the third is over it
+        self.assertEqual(results[3:], [(200, None), (200, None), (503, b'2')])
+        self.assertEqual(self.control.in_flight, 0)
+        self.assertEqual(self.control.routes['POST /books/'].shed, {'overloaded': 1})
+        self.assertEqual(self.control.routes['GET /books/{book_id}'].shed, {'overloaded': 1})
+
+    async def test_route_limit(self):
+        results = await self.settle([self.start('/slow') for _ in range(2)])
+        self.assertEqual(results, [(200, None), (503, b'2')])
+        self.assertEqual(self.control.routes['GET /slow'].shed, {'route_limit': 1})
+
+    async def test_exempt_paths_are_never_counted_or_shed(self):
+        held = [self.start('/books/{book_id}') for _ in range(4)]
+        health = [self.start('/health') for _ in range(3)]
+        results = await self.settle(held + health)
+        self.assertEqual(results[4:], [(200, None)] * 3)
+        self.assertNotIn('GET /health', self.control.routes)
+
+    async def test_in_flight_is_released_when_the_app_fails(self):
+        async def failing(scope, receive, send):
+            raise RuntimeError('boom')
+        route = AdmittedRoute(failing, '/books/', {'POST'}, self.control)
+        with self.assertRaises(RuntimeError):
+            await call(route, 'POST')
+        self.assertEqual((self.control.in_flight, self.control.routes['POST /books/'].in_flight), (0, 0))
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_rate_limited_with_retry_after_then_refilled(self):
+        control = AdmissionControl(max_concurrency=0, client_rate=2, client_burst=3)
+        route = AdmittedRoute(Gate(), '/books/', {'GET'}, control)
+        route.app.open.set()
+        with mock.patch.object(admission.time, 'monotonic', return_value=100.0) as clock:
+            results = [await call(route) for _ in range(4)]
+            self.assertEqual(results, [(200, None)] * 3 + [(429, b'1')])
+            # Other clients have their own bucket
+            self.assertEqual(await call(route, client='10.0.0.2'), (200, None))
+            clock.return_value = 100.5  # one token back at 2 per second
+            self.assertEqual(await call(route), (200, None))
+            self.assertEqual(await call(route), (429, b'1'))
+        self.assertEqual(control.routes['GET /books/'].shed, {'rate_limited': 2})
+
+    def test_bucket_count_stays_bounded(self):
+        control = AdmissionControl(client_rate=1, client_burst=1)
+        with mock.patch.object(admission, 'ADMISSION_MAX_CLIENTS', 3):
+            for client in 'abca':
+                control.take_token(client)
+            control.take_token('d')  # evicts b, the least recently seen
+            self.assertEqual(list(control.buckets), ['c', 'a', 'd'])
+            for client in range(100):
+                control.take_token(client)
+            self.assertEqual(len(control.buckets), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
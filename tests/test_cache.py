@@ -0,0 +1,135 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from cache import LRUCache
+
+
+class Loader:
+    """A loader whose calls stay in flight until released, returning the given values in turn."""
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        value = self.values.pop(0)
+        await self.release.wait()
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+async def settle():
+    # Let the tasks started so far run up to their first blocking await
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+class InFlightLoadTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_misses_share_one_load(self):
+        cache, loader = LRUCache(), Loader('v1')
+        waiters = [asyncio.create_task(cache.get_or_load('k', loader)) for _ in range(3)]
+        await settle()
+        loader.release.set()
+
+        self.assertEqual(await asyncio.gather(*waiters), ['v1'] * 3)
+        self.assertEqual(loader.calls, 1)
+        self.assertEqual((cache.stats()['misses'], cache.stats()['coalesced']), (1, 2))
+        self.assertEqual(cache.peek('k'), 'v1')
+
+    async def test_invalidate_during_load_does_not_cache_the_stale_value(self):
+        cache, loader = LRUCache(), Loader('stale', 'fresh')
+        first = asyncio.create_task(cache.get_or_load('k', loader))
+        waiter = asyncio.create_task(cache.get_or_load('k', loader))
+        await settle()
+        # A write lands while the read is in flight
+        cache.invalidate('k')
+        loader.release.set()
+
+        # Callers already waiting get the value they asked for, but it is not kept
+        self.assertEqual(await asyncio.gather(first, waiter), ['stale', 'stale'])
+        self.assertIsNone(cache.peek('k'))
+        self.assertEqual(await cache.get_or_load('k', loader), 'fresh')
+        self.assertEqual(loader.calls, 2)
+        self.assertEqual(cache.peek('k'), 'fresh')
+
+    async def test_load_started_after_invalidate_is_not_coalesced_onto_the_stale_one(self):
+        cache = LRUCache()
+        stale, fresh = Loader('stale'), Loader('fresh')
+        first = asyncio.create_task(cache.get_or_load('k', stale))
+        await settle()
+        cache.invalidate('k')
+        second = asyncio.create_task(cache.get_or_load('k', fresh))
+        await settle()
+        self.assertEqual(fresh.calls, 1)
+
+        # The stale load finishing first must not store over, or unregister, the fresh one
+        stale.release.set()
+        self.assertEqual(await first, 'stale')
+        self.assertIsNone(cache.peek('k'))
+        late = asyncio.create_task(cache.get_or_load('k', Loader('unused')))
+        fresh.release.set()
+        self.assertEqual(await asyncio.gather(second, late), ['fresh', 'fresh'])
+        self.assertEqual(cache.peek('k'), 'fresh')
+
+    async def test_failed_load_reaches_every_waiter_and_is_not_cached(self):
+        cache, loader = LRUCache(), Loader(LookupError("gone"), 'v1')
+        waiters = [asyncio.create_task(cache.get_or_load('k', loader)) for _ in range(2)]
+        await settle()
+        loader.release.set()
+
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, LookupError) for result in results))
+        self.assertEqual(await cache.get_or_load('k', loader), 'v1')
+        self.assertEqual(loader.calls, 2)
+
+    async def test_cancelled_load_leaves_waiters_to_load_again(self):
+        cache, loader = LRUCache(), Loader('abandoned', 'v1')
+        leader = asyncio.create_task(cache.get_or_load('k', loader))
+        waiters = [asyncio.create_task(cache.get_or_load('k', loader)) for _ in range(2)]
+        await settle()
+        # The client that started the load disconnects
+        leader.cancel()
+        await settle()
+        loader.release.set()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        # The waiters were not cancelled; one of them loaded again and the other joined it
+        self.assertEqual(await asyncio.gather(*waiters), ['v1', 'v1'])
+        self.assertEqual(loader.calls, 2)
+        self.assertEqual(cache.peek('k'), 'v1')
+
+
+class EvictionTest(unittest.IsolatedAsyncioTestCase):
+    async def load(self, cache, key):
+        loader = Loader(key)
+        loader.release.set()
+        return await cache.get_or_load(key, loader)
+
+    async def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(max_entries=2)
+        await self.load(cache, 'a')
+        await self.load(cache, 'b')
+        cache.peek('a')
+        await self.load(cache, 'c')
+
+        self.assertIsNone(cache.peek('b'))
+        self.assertEqual((cache.peek('a'), cache.peek('c')), ('a', 'c'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    async def test_expired_entry_is_reloaded(self):
+        cache = LRUCache(ttl=10)
+        with mock.patch('cache.time.monotonic', return_value=100.0):
+            await self.load(cache, 'a')
+        with mock.patch('cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.peek('a'))
+            await self.load(cache, 'a')
+        self.assertEqual((cache.stats()['expirations'], cache.stats()['misses']), (1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+import catalog
+from catalog import read_json_array, validate_batch
+
+SAMPLE = """ [
+  {"_id": {"$oid": "64b7f1"}, "id": "1", "title": "Caf\\u00e9 \\"Noir\\"", "author": "A. Author", "year": {"$numberInt": "1949"}, "isbn": "978-0"},
+  {"id": 2.0, "title": "Brontë, [sisters]", "author": "B", "year": 1847, "isbn": "x", "ratings": [4.5, -1e3, 2E+2, 0.125]},
+  {"id": 3, "title": "", "author": null, "year": 12345678901234567890, "isbn": "y", "tags": {"a": [true, false, {}]}},
+  [], "plain", -0.5e-2, 7
+]
+"""
+
+
+def read(text, chunk_size):
+    with mock.patch.object(catalog, 'CHUNK_SIZE', chunk_size):
+        return list(read_json_array(io.StringIO(text)))
+
+
+class ReadJsonArrayTest(unittest.TestCase):
+    def test_every_chunk_boundary(self):
+        expected = json.loads(SAMPLE)
+        # Every split point lands in a string, an escape, a number, a literal or between tokens
+        for chunk_size in range(1, len(SAMPLE) + 2):
+            self.assertEqual(read(SAMPLE, chunk_size), expected, f"chunk size {chunk_size}")
+
+    def test_number_cut_in_its_fraction_or_exponent(self):
+        for text in ('[1.5]', '[2e3]', '[2E+3, 1]', '[-0.25e-1]'):
+            for chunk_size in range(1, len(text) + 1):
+                self.assertEqual(read(text, chunk_size), json.loads(text), f"{text} by {chunk_size}")
+
+    def test_empty_array_and_whitespace(self):
+        for text in ('[]', '  [ \n ]  ', '\n[\n1\n,\n2\n]\n'):
+            for chunk_size in (1, 2, 64):
+                self.assertEqual(read(text, chunk_size), json.loads(text))
+
+    def test_malformed_input(self):
+        for text in ('', '{"id": 1}', '[1 2]', '[1, 2', '[{"id": 1}', '[1.]', '[tru]'):
+            for chunk_size in (1, 3, 64):
+                with self.assertRaises(ValueError, msg=f"{text!r} by {chunk_size}"):
+                    read(text, chunk_size)
+
+    def test_records_stream_one_at_a_time(self):
+        source = io.StringIO('[' + ','.join(['{"id": 1}'] * 1000) + ']')
+        with mock.patch.object(catalog, 'CHUNK_SIZE', 64):
+            records = read_json_array(source)
+            next(records)
+            self.assertLess(source.tell(), 200)
+
+
+class ValidateBatchTest(unittest.TestCase):
+    def test_extended_json_export_is_normalized(self):
+        documents, invalid = validate_batch(json.loads(SAMPLE)[:3] + ["plain"], 1)
+        self.assertEqual(documents, [{'id': 1, 'title': 'Café "Noir"', 'author': "A. Author", 'year': 1949, 'isbn': "978-0"},
+                                     {'id': 2, 'title': "Brontë, [sisters]", 'author': "B", 'year': 1847, 'isbn': "x"}])
+        self.assertEqual([(number, record) for number, _, record in invalid], [(3, json.loads(SAMPLE)[2]), (4, "plain")])
+
+
+if __name__ == '__main__':
+    unittest.main()
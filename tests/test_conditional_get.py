@@ -0,0 +1,54 @@
+import unittest
+
+import httpx
+from fastapi import FastAPI
+
+from cache import book_cache
+from models import Book
+from routing import router
+from service import add_books
+from storage import repo
+
+app = FastAPI()
+app.include_router(router)
+
+
+class ConditionalGetTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await repo.reset()
+        book_cache.clear()
+        await add_books([Book(id=1, title="Dune", author="Frank Herbert", year=1965, isbn="1")])
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_current_etag_is_not_modified(self):
+        etag = (await self.client.get('/books/1')).headers['etag']
+        response = await self.client.get('/books/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['etag'], etag)
+
+    async def test_write_from_another_worker_is_not_hidden_by_the_cache(self):
+        etag = (await self.client.get('/books/1')).headers['etag']
+        # Another worker's write invalidates only that worker's cache
+        await repo.books.update_fields({1: {'title': "Dune Messiah"}})
+        self.assertEqual(book_cache.peek(1)['book']['Title'], "Dune")
+
+        response = await self.client.get('/books/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['Title'], "Dune Messiah")
+        self.assertNotEqual(response.headers['etag'], etag)
+        # The stale entry was replaced, so the new tag revalidates
+        response = await self.client.get('/books/1', headers={'If-None-Match': response.headers['etag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_field_selection_has_its_own_etag(self):
+        full = (await self.client.get('/books/1')).headers['etag']
+        response = await self.client.get('/books/1', params={'fields': 'title'}, headers={'If-None-Match': full})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'ID': 1, 'Title': "Dune"})
+
+
+if __name__ == '__main__':
+    unittest.main()
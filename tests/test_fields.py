@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+import httpx
+import orjson
+from fastapi import FastAPI, HTTPException
+
+from cache import book_cache
+from models import Book
+from routing import router
+from search import search_index
+from service import add_books, parse_fields, ALL_BOOK_FIELDS
+from storage import repo
+
+app = FastAPI()
+app.include_router(router)
+
+
+class ParseFieldsTest(unittest.TestCase):
+    def test_selection_always_starts_with_the_id(self):
+        self.assertIs(parse_fields(None), ALL_BOOK_FIELDS)
+        self.assertEqual(parse_fields(" title , author,title,"), ('id', 'title', 'author'))
+        self.assertEqual(parse_fields("id"), ('id',))
+
+    def test_unknown_field_is_a_422(self):
+        with self.assertRaises(HTTPException) as raised:
+            parse_fields("title,password")
+        self.assertEqual(raised.exception.status_code, 422)
+        self.assertIn("password", raised.exception.detail)
+
+
+class FieldSelectionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await repo.reset()
+        book_cache.clear()
+        await add_books([
+            Book(id=1, title="Dune", author="Frank Herbert", year=1965, isbn="1"),
+            Book(id=2, title="Dune Messiah", author="Frank Herbert", year=1969, isbn="2")
+        ])
+        # The index is process-wide; start from this test's books only
+        await search_index.rebuild(repo)
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_endpoints_return_only_the_selected_keys(self):
+        expected = {'ID': 1, 'Title': "Dune", 'Review Count': 0}
+        params = {'fields': 'title,review_count'}
+        self.assertEqual((await self.client.get('/books/1', params=params)).json(), expected)
+        self.assertEqual((await self.client.get('/books/', params=params)).json()['books'][0], expected)
+        self.assertEqual((await self.client.get('/books/search/', params={**params, 'q': 'dune'})).json()[0], expected)
+
+    async def test_list_and_stream_project_the_query(self):
+        with mock.patch.object(repo.books, 'page', wraps=repo.books.page) as page:
+            await self.client.get('/books/', params={'fields': 'year,reviews'})
+        self.assertEqual(page.call_args.kwargs['fields'], ('id', 'year', 'latest_reviews'))
+
+        with mock.patch.object(repo.books, 'scan', wraps=repo.books.scan) as scan:
+            response = await self.client.get('/books/', params={'stream': 'true', 'fields': 'title'})
+        self.assertEqual(scan.call_args.kwargs['fields'], ('id', 'title'))
+        self.assertEqual([orjson.loads(line) for line in response.content.splitlines()], [{'ID': 1, 'Title': "Dune"}, {'ID': 2, 'Title': "Dune Messiah"}])
+
+    async def test_unknown_field_is_rejected_before_any_read(self):
+        with mock.patch.object(repo.books, 'get', wraps=repo.books.get) as get:
+            response = await self.client.get('/books/1', params={'fields': 'title,secret'})
+        self.assertEqual(response.status_code, 422)
+        get.assert_not_called()
+        for path in ('/books/', '/books/search/?q=dune', '/users/recommend/?user_id=1'):
+            self.assertEqual((await self.client.get(path, params={'fields': 'secret'})).status_code, 422, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from cleanup import cleanup_tasks
+from jobs import JobRunner, INTERRUPTED, job_runner
+from memory_repository import MemoryJobRepository
+from service import get_job
+from storage import repo
+
+
+class Item(BaseModel):
+    id: int
+
+
+class Handler:
+    """A job handler that records the ids it was given and can be made to fail."""
+
+    def __init__(self):
+        self.seen = []
+
+    async def __call__(self, items):
+        self.seen.extend(item.id for item in items)
+        return {'added': [item.id for item in items]}
+
+
+class JobTakeoverTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.repo = SimpleNamespace(jobs=MemoryJobRepository())
+        self.handler = Handler()
+
+    def runner(self, retry_safe, max_attempts=3):
+        runner = JobRunner(concurrency=1, chunk_size=2, lease=60, max_attempts=max_attempts)
+        runner.register('add', Item, self.handler, retry_safe)
+        return runner
+
+    async def abandoned_job(self, retry_safe):
+        # A job whose worker died with chunk 0 done and chunk 1 mid-way; chunk 2 never started
+        with mock.patch.object(JobRunner, 'start'):
+            job = await self.runner(retry_safe).submit(self.repo, 'add', [{'id': i} for i in range(6)])
+        await self.repo.jobs.set_chunk(job['id'], 0, 'done', result={'added': [0, 1]}, processed=2)
+        await self.repo.jobs.set_chunk(job['id'], 1, 'running')
+        await self.repo.jobs.update(job['id'], {'status': 'running', 'heartbeat': datetime.now(timezone.utc) - timedelta(minutes=5)})
+        return job['id']
+
+    async def take_over(self, runner):
+        # One pass of the claim loop in run(); returns the claimed job id once its run is over
+        now = datetime.now(timezone.utc)
+        job_id = await self.repo.jobs.claim(runner.owner, now - timedelta(seconds=runner.lease), now)
+        if job_id is not None:
+            runner.start(self.repo, job_id)
+            await asyncio.gather(*runner.active.values())
+        return job_id
+
+    async def test_live_job_is_not_claimed(self):
+        job_id = await self.abandoned_job(retry_safe=True)
+        await self.repo.jobs.update(job_id, {'heartbeat': datetime.now(timezone.utc)})
+        self.assertIsNone(await self.take_over(self.runner(True)))
+
+    async def test_retry_safe_job_reruns_the_interrupted_chunk(self):
+        job_id = await self.abandoned_job(retry_safe=True)
+        runner = self.runner(True)
+        self.assertEqual(await self.take_over(runner), job_id)
+
+        job = await self.repo.jobs.get(job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['processed'], 6)
+        self.assertEqual(job['owner'], runner.owner)
+        self.assertEqual(job['attempts'], 2)
+        # The finished chunk is not redone
+        self.assertEqual(self.handler.seen, [2, 3, 4, 5])
+
+    async def test_interrupted_chunk_is_failed_when_not_retry_safe(self):
+        job_id = await self.abandoned_job(retry_safe=False)
+        self.assertEqual(await self.take_over(self.runner(False)), job_id)
+
+        job = await self.repo.jobs.get(job_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['failed_chunks'], 1)
+        self.assertEqual(self.handler.seen, [4, 5])
+        states = [(chunk['state'], chunk['error']) for chunk in await self.repo.jobs.chunks(job_id)]
+        self.assertEqual(states, [('done', None), ('failed', INTERRUPTED), ('done', None)])
+
+    async def test_persistent_error_fails_the_job_after_max_attempts(self):
+        job_id = await self.abandoned_job(retry_safe=True)
+        runner = self.runner(True, max_attempts=3)
+        with mock.patch.object(self.repo.jobs, 'chunks', side_effect=RuntimeError("corrupt chunk")):
+            for _ in range(5):
+                # Every run errors out and leaves the lease to lapse
+                if await self.take_over(runner) is None:
+                    break
+                await self.repo.jobs.update(job_id, {'heartbeat': datetime.now(timezone.utc) - timedelta(minutes=5)})
+
+        job = await self.repo.jobs.get(job_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['attempts'], 4)
+        self.assertIn("gave up after 3 attempts", job['error'])
+        self.assertIn("corrupt chunk", job['error'])
+        self.assertIsNone(await self.take_over(runner))
+        self.assertEqual(self.handler.seen, [])
+
+    async def test_stopping_worker_releases_the_job_without_using_an_attempt(self):
+        job_id = await self.abandoned_job(retry_safe=True)
+        runner = self.runner(True)
+        runner.stopping = True
+        await self.take_over(runner)
+
+        job = await self.repo.jobs.get(job_id)
+        self.assertEqual(job['status'], 'running')
+        self.assertIsNone(job['owner'])
+        self.assertEqual(job['attempts'], 1)
+        self.assertEqual(self.handler.seen, [])
+        # The next worker picks it up straight away and finishes it
+        self.assertEqual(await self.take_over(self.runner(True)), job_id)
+        self.assertEqual((await self.repo.jobs.get(job_id))['status'], 'done')
+
+
+class JobReportTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await repo.reset()
+
+    async def test_failed_chunk_is_reported_with_its_item_range(self):
+        async def handler(items):
+            ids = [item.id for item in items]
+            if 3 in ids:
+                raise ValueError("item 3 is broken")
+            return {'message': "ok", 'added': ids}
+
+        with mock.patch.dict(job_runner.kinds, {'add': (Item, handler, True)}), mock.patch.object(job_runner, 'chunk_size', 2):
+            job = await job_runner.submit(repo, 'add', [{'id': i} for i in range(6)])
+            await asyncio.gather(*job_runner.active.values())
+            report = await get_job(job['id'])
+
+        self.assertEqual(report['status'], 'failed')
+        self.assertEqual((report['processed'], report['failed_chunks'], report['error']), (6, 1, "1 of 3 chunks failed"))
+        self.assertEqual(report['failed'], [{'items': [2, 4], 'error': "item 3 is broken"}])
+        self.assertEqual(report['results'], {'added': [0, 1, 4, 5]})
+        self.assertNotIn('owner', report)
+
+    async def test_cleanup_status_is_not_a_job(self):
+        task_id = await cleanup_tasks.start(repo, 'books', lambda deleted: asyncio.sleep(0))
+        await cleanup_tasks.drain()
+        self.assertIsNotNone(await cleanup_tasks.get(repo, task_id))
+        with self.assertRaises(HTTPException) as raised:
+            await get_job(task_id)
+        self.assertEqual(raised.exception.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from unittest import mock
+
+import httpx
+
+from cache import book_cache
+from libfastapi import app
+from service import get_book_by_id
+from storage import repo
+
+
+class LibFastAPITest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await repo.reset()
+        book_cache.clear()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def add(self, book_id, title):
+        response = await self.client.post('/books/', json={'id': book_id, 'title': title, 'author': "Author", 'year': 2000, 'isbn': str(book_id)})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_added_book_has_the_main_api_document_shape(self):
+        await self.add(1, "Dune")
+        book = await repo.books.get(1)
+        self.assertEqual((book['version'], book['review_count'], book['review_histogram'], book['latest_reviews']), (1, 0, {}, []))
+        self.assertIsNotNone(book['updated_at'])
+        self.assertEqual((await self.client.post('/books/', json={'id': 1, 'title': "Again", 'author': "A", 'year': 1, 'isbn': "1"})).status_code, 400)
+
+    async def test_update_and_delete_reach_the_main_api_cache(self):
+        await self.add(1, "Dune")
+        self.assertEqual((await get_book_by_id(1))['Title'], "Dune")
+
+        self.assertEqual((await self.client.put('/books/1', json={'title': "Dune Messiah"})).status_code, 200)
+        self.assertEqual((await get_book_by_id(1))['Title'], "Dune Messiah")
+        self.assertEqual((await self.client.put('/books/2', json={'title': "Missing"})).status_code, 404)
+
+        response = await self.client.delete('/books/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('cleanup_task', response.json())
+        self.assertIsNone(book_cache.peek(1))
+        self.assertEqual((await self.client.delete('/books/1')).status_code, 404)
+
+    async def test_all_books_streams_a_json_array(self):
+        self.assertEqual((await self.client.get('/books/all')).status_code, 404)
+        for book_id in (2, 1, 3):
+            await self.add(book_id, f"Book {book_id}")
+        with mock.patch('libfastapi.STREAM_BATCH_SIZE', 2):
+            response = await self.client.get('/books/all')
+        self.assertEqual(response.headers['content-type'], 'application/json')
+        self.assertEqual([book['ID'] for book in response.json()], [1, 2, 3])
+        self.assertEqual(set(response.json()[0]), {'ID', 'Title', 'Author', 'Year', 'ISBN'})
+
+
+if __name__ == '__main__':
+    unittest.main()
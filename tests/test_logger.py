@@ -0,0 +1,64 @@
+import json
+import logging
+import logging.config
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import logger
+from uvicorn.config import LOGGING_CONFIG
+
+
+class UvicornLoggersTest(unittest.TestCase):
+    def setUp(self):
+        # setup_logging() replaces process-wide state; put it back afterwards
+        self.directory = tempfile.TemporaryDirectory()
+        root = logging.getLogger()
+        saved = [(root, root.handlers[:], root.level, root.propagate)]
+        for name in logger.UVICORN_LOGGERS:
+            named = logging.getLogger(name)
+            saved.append((named, named.handlers[:], named.level, named.propagate))
+
+        def restore():
+            logger.shutdown_logging()
+            for saved_logger, handlers, level, propagate in saved:
+                saved_logger.handlers[:] = handlers
+                saved_logger.setLevel(level)
+                saved_logger.propagate = propagate
+            self.directory.cleanup()
+        self.addCleanup(restore)
+        self.log_file = os.path.join(self.directory.name, 'app.log')
+        for name, value in (('LOG_FILE', self.log_file), ('LOG_CONSOLE', False), ('LOG_LEVEL', 'INFO'), ('LOG_LEVELS', '')):
+            patcher = mock.patch.object(logger, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def records(self):
+        logger.shutdown_logging()  # flushes the queue
+        with open(self.log_file) as f:
+            return [json.loads(line) for line in f]
+
+    def test_uvicorn_default_handlers_are_replaced_by_the_queue(self):
+        logging.config.dictConfig(LOGGING_CONFIG)
+        logger.setup_logging()
+        for name in logger.UVICORN_LOGGERS:
+            self.assertEqual(logging.getLogger(name).handlers, [])
+        logging.getLogger('uvicorn.access').info('%s - "%s %s HTTP/%s" %d', '127.0.0.1', 'GET', '/health', '1.1', 200)
+        logging.getLogger('uvicorn.error').info("Application startup complete.")
+
+        self.assertEqual(
+            [(record['logger'], record['message']) for record in self.records()],
+            [('uvicorn.access', '127.0.0.1 - "GET /health HTTP/1.1" 200'), ('uvicorn.error', "Application startup complete.")]
+        )
+
+    def test_access_log_disabled_by_uvicorn_stays_off(self):
+        access = logging.getLogger('uvicorn.access')
+        access.handlers = []
+        access.propagate = False
+        logger.setup_logging()
+        self.assertFalse(access.hasHandlers())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from memory_repository import MemoryRepositories
+
+
+def book(book_id, title=None):
+    return {'id': book_id, 'title': title or f"Book {book_id}", 'author': "Author"}
+
+
+class DocumentsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.repo = MemoryRepositories(snapshot_path=None)
+
+    async def test_insert_unique_reports_duplicates(self):
+        await self.repo.books.insert_unique([book(1)])
+        inserted, duplicates = await self.repo.books.insert_unique([book(3), book(1, "Again"), book(2), book(3, "Twice")])
+
+        self.assertEqual([doc['id'] for doc in inserted], [3, 2])
+        self.assertEqual(duplicates, [1, 3])
+        # The first copy wins, as with a unique index
+        self.assertEqual((await self.repo.books.get(1))['title'], "Book 1")
+        self.assertEqual((await self.repo.books.get(3))['title'], "Book 3")
+        self.assertEqual(self.repo.books.ids, [1, 2, 3])
+
+    async def test_reads_return_copies(self):
+        await self.repo.books.insert_unique([{**book(1), 'latest_reviews': []}])
+        doc = await self.repo.books.get(1)
+        doc['latest_reviews'].append('changed')
+        doc['title'] = "Changed"
+        self.assertEqual(await self.repo.books.get(1), {**book(1), 'latest_reviews': []})
+        self.assertEqual(await self.repo.books.get(1, fields=('id', 'title')), {'id': 1, 'title': "Book 1"})
+
+    async def test_page_scan_and_delete_keep_id_order(self):
+        await self.repo.books.insert_unique([book(book_id) for book_id in (5, 1, 4, 2, 3)])
+        self.assertEqual(await self.repo.books.delete([4, 4, 9]), 1)
+
+        self.assertEqual([doc['id'] for doc in await self.repo.books.page(after=1, limit=2)], [2, 3])
+        scanned = [doc['id'] async for doc in self.repo.books.scan(batch_size=2)]
+        self.assertEqual(scanned, [1, 2, 3, 5])
+        self.assertEqual(await self.repo.books.existing_ids([1, 4, 5]), {1, 5})
+
+    async def test_writes_bump_the_version(self):
+        await self.repo.books.insert_unique([{**book(1), 'version': 1}])
+        self.assertEqual(await self.repo.books.update_fields({1: {'title': "New"}, 2: {'title': "Missing"}}), 1)
+        self.assertEqual(await self.repo.books.add_ratings({1: (9, 2), 2: (5, 1)}), 1)
+
+        doc = await self.repo.books.get(1)
+        self.assertEqual((doc['title'], doc['version'], doc['average_rating']), ("New", 3, 4.5))
+        self.assertIsNotNone(doc['updated_at'])
+
+
+class ChildCollectionsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.repo = MemoryRepositories(snapshot_path=None)
+
+    async def test_review_pages_newest_first(self):
+        await self.repo.reviews.insert_many([{'user_id': 1, 'book_id': 7, 'content': str(n), 'rating': 5} for n in range(5)])
+        first, cursor = await self.repo.reviews.page(7, limit=2)
+        second, cursor = await self.repo.reviews.page(7, cursor, limit=2)
+        last, cursor = await self.repo.reviews.page(7, cursor, limit=2)
+
+        self.assertEqual([review['content'] for review in first + second + last], ['4', '3', '2', '1', '0'])
+        self.assertIsNone(cursor)
+        self.assertEqual(await self.repo.reviews.delete_where('user_id', [1]), 5)
+        self.assertEqual(await self.repo.reviews.page(7), ([], None))
+
+    async def test_progress_upserts_one_row_per_book(self):
+        now = datetime.now(timezone.utc)
+        self.assertEqual(await self.repo.reading_progress.upsert(1, {3: 10, 1: 50}, now), (2, 0))
+        self.assertEqual(await self.repo.reading_progress.upsert(1, {3: 90, 2: 5}, now), (1, 1))
+
+        rows = await self.repo.reading_progress.page(1)
+        self.assertEqual([(row['book_id'], row['percentage_read']) for row in rows], [(1, 50), (2, 5), (3, 90)])
+        self.assertEqual(await self.repo.reading_progress.delete_where('book_id', [3]), 1)
+        self.assertEqual([row['book_id'] for row in await self.repo.reading_progress.page(1, after=1)], [2])
+
+
+class SnapshotTest(unittest.IsolatedAsyncioTestCase):
+    async def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshot.pkl')
+            repo = MemoryRepositories(snapshot_path=path)
+            await repo.books.insert_unique([book(1), book(2)])
+            await repo.close()
+
+            restored = MemoryRepositories(snapshot_path=path)
+            await restored.initialize()
+            self.assertEqual(await restored.books.get(2), book(2))
+            self.assertEqual(restored.books.ids, [1, 2])
+            self.assertFalse(os.path.exists(f"{path}.tmp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
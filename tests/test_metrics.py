@@ -0,0 +1,123 @@
+import os
+import pickle
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from fastapi import HTTPException
+
+import metrics
+from metrics import CommandMetrics, Histogram, InstrumentedRoute, RouteMetrics
+
+
+def command_event(request_id, name='find', collection='books', micros=1500):
+    return SimpleNamespace(command={name: collection}, command_name=name, request_id=request_id, duration_micros=micros)
+
+
+async def endpoint(scope, receive, send):
+    # Issues two MongoDB commands, then answers with the status the path asks for
+    for request_id in (1, 2):
+        metrics.command_metrics.started(command_event(request_id))
+        metrics.command_metrics.succeeded(command_event(request_id))
+    if scope['path'] == '/missing':
+        raise HTTPException(status_code=404)
+    if scope['path'] == '/broken':
+        raise RuntimeError("boom")
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def call(route, path):
+    async def send(message):
+        pass
+    try:
+        await route({'type': 'http', 'method': 'GET', 'path': path}, None, send)
+    except Exception:
+        pass
+
+
+class ExpositionTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        for patcher in (mock.patch.dict(metrics.route_metrics, clear=True), mock.patch.object(metrics, 'command_metrics', CommandMetrics()),
+                        mock.patch.object(metrics, 'METRICS_DIR', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_requests_are_counted_by_route_template_and_status(self):
+        route = InstrumentedRoute(endpoint, '/books/{book_id}', {'GET'})
+        for path in ('/ok', '/ok', '/missing', '/broken'):
+            await call(route, path)
+
+        text = metrics.render()
+        for line in (
+            'http_requests_total{route="GET /books/{book_id}",status="200"} 2',
+            'http_requests_total{route="GET /books/{book_id}",status="404"} 1',
+            'http_requests_total{route="GET /books/{book_id}",status="500"} 1',
+            'http_request_errors_total{route="GET /books/{book_id}"} 1',
+            'http_requests_in_flight{route="GET /books/{book_id}"} 0',
+            'http_request_duration_seconds_count{route="GET /books/{book_id}"} 4',
+            # Every request issued two commands
+            'http_request_db_queries_bucket{route="GET /books/{book_id}",le="1"} 0',
+            'http_request_db_queries_bucket{route="GET /books/{book_id}",le="2"} 4',
+            'mongodb_command_duration_seconds_count{command="find",collection="books"} 8',
+            'mongodb_command_failures_total{command="find",collection="books"} 0',
+        ):
+            self.assertIn(line, text.splitlines())
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertTrue(text.endswith('\n'))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        lines = []
+        metrics.write_histogram(lines, 'latency', (('route', 'a"b'),), histogram)
+        self.assertEqual(lines, [
+            'latency_bucket{route="a\\"b",le="0.1"} 2',
+            'latency_bucket{route="a\\"b",le="1.0"} 3',
+            'latency_bucket{route="a\\"b",le="+Inf"} 4',
+            'latency_sum{route="a\\"b"} 3.65',
+            'latency_count{route="a\\"b"} 4',
+        ])
+
+    def test_command_shards_of_every_thread_are_summed(self):
+        listener = CommandMetrics()
+
+        def record(first_id):
+            for request_id in range(first_id, first_id + 3):
+                listener.started(command_event(request_id, 'insert', 'reviews'))
+                listener.failed(command_event(request_id, 'insert', 'reviews'))
+
+        threads = [threading.Thread(target=record, args=(first_id,)) for first_id in (0, 100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        histogram, failures = listener.snapshot()[('insert', 'reviews')]
+        self.assertEqual((sum(histogram.counts), failures), (6, 6))
+        self.assertEqual(len(listener.shards), 2)
+
+    def test_workers_are_merged_without_the_gauges_of_exited_ones(self):
+        other = RouteMetrics()
+        other.responses[200] = 5
+        other.in_flight = 3
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(metrics, 'METRICS_DIR', directory), \
+                mock.patch.object(metrics, 'process_alive', return_value=False):
+            own = metrics.route_metrics.setdefault('GET /health', RouteMetrics())
+            own.responses[200] = 2
+            own.in_flight = 1
+            data = {'pid': os.getpid() + 1, 'routes': {'GET /health': other}, 'commands': {},
+                    'admission': {'in_flight': 4, 'routes': {}}}
+            with open(os.path.join(directory, f"{data['pid']}.pickle"), 'wb') as f:
+                pickle.dump(data, f)
+            text = metrics.render().splitlines()
+
+        self.assertIn('http_requests_total{route="GET /health",status="200"} 7', text)
+        self.assertIn('http_requests_in_flight{route="GET /health"} 1', text)
+        self.assertIn('http_admission_in_flight 0', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
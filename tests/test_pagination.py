@@ -0,0 +1,85 @@
+import unittest
+
+import httpx
+import orjson
+from fastapi import FastAPI
+
+from models import Book
+from routing import router
+from service import add_books, delete_books
+from storage import repo
+
+app = FastAPI()
+app.include_router(router)
+
+
+def books(*book_ids):
+    return [Book(id=book_id, title=f"Book {book_id}", author="Author", year=2000, isbn=str(book_id)) for book_id in book_ids]
+
+
+class KeysetPaginationTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await repo.reset()
+        # Out of order, with gaps, so the order has to come from the ids
+        await add_books(books(*range(20, 0, -2)))
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def page(self, after=None, limit=3):
+        params = {'limit': limit} if after is None else {'after': after, 'limit': limit}
+        response = await self.client.get('/books/', params=params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def test_next_after_walks_every_book_once(self):
+        seen, after = [], None
+        while True:
+            page = await self.page(after)
+            seen += [book['ID'] for book in page['books']]
+            after = page['next_after']
+            if after is None:
+                break
+            self.assertEqual(after, seen[-1])
+        self.assertEqual(seen, list(range(2, 21, 2)))
+
+    async def test_writes_between_pages_neither_skip_nor_repeat(self):
+        first = await self.page()
+        self.assertEqual([book['ID'] for book in first['books']], [2, 4, 6])
+        # An offset would shift under these; the cursor does not
+        await delete_books([2, 8])
+        await add_books(books(1, 9))
+        second = await self.page(first['next_after'])
+        self.assertEqual([book['ID'] for book in second['books']], [9, 10, 12])
+
+    async def test_exact_last_page_ends_with_an_empty_one(self):
+        page = await self.page(limit=10)
+        self.assertEqual(page['next_after'], 20)
+        self.assertEqual(await self.page(20, limit=10), {'books': [], 'next_after': None})
+
+    async def test_limit_is_bounded(self):
+        for limit in (0, 1001):
+            self.assertEqual((await self.client.get('/books/', params={'limit': limit})).status_code, 422)
+
+
+class StreamTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await repo.reset()
+        await add_books(books(*range(1, 8)))
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_stream_matches_the_pages(self):
+        pages = await self.client.get('/books/', params={'after': 2, 'limit': 100})
+        # limit is the batch size of the stream; 3 splits the books across batches
+        response = await self.client.get('/books/', params={'after': 2, 'limit': 3, 'stream': 'true'})
+        self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+        lines = response.content.splitlines()
+        self.assertEqual([orjson.loads(line) for line in lines], pages.json()['books'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pyinstrument_profiler
+from pyinstrument_profiler import ProfilerMiddleware, ProfileStore, download_profile
+
+
+async def app(scope, receive, send):
+    await asyncio.sleep(0.01)
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+async def call(middleware):
+    async def send(message):
+        pass
+    await middleware({'type': 'http', 'method': 'GET', 'path': '/books/1'}, None, send)
+
+
+class ProfilerMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = ProfileStore(5)
+        patcher = mock.patch.object(pyinstrument_profiler, 'profile_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_store_keeps_the_session_and_renders_it(self):
+        await call(ProfilerMiddleware(app, enabled=True, sample_every=1))
+
+        [record] = self.store.recent(10)
+        self.assertEqual(record['route'], "GET <unmatched>")
+        self.assertNotIn('profiler', record)
+        self.assertIn('<html', download_profile(record['id']).body.decode().lower())
+
+    async def test_failed_report_write_is_logged(self):
+        missing = os.path.join(tempfile.gettempdir(), 'no-such-profile-dir', 'nested')
+        with mock.patch.object(pyinstrument_profiler, 'PROFILER_OUTPUT_DIR', missing), \
+                self.assertLogs('pyinstrument_profiler', 'ERROR') as logs:
+            await call(ProfilerMiddleware(app, enabled=True, sample_every=1))
+            for _ in range(100):
+                if logs.records:
+                    break
+                await asyncio.sleep(0.01)
+
+        self.assertIn("Could not write profile 1 of GET <unmatched>", logs.output[0])
+        self.assertIsInstance(logs.records[0].exc_info[1], FileNotFoundError)
+
+
+if __name__ == '__main__':
+    unittest.main()
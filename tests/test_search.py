@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+
+from memory_repository import MemoryRepositories
+from search import SearchIndex
+
+
+def catalog():
+    index = SearchIndex()
+    index.add(1, "The Hobbit", "J. R. R. Tolkien")
+    index.add(2, "The Lord of the Rings", "J. R. R. Tolkien")
+    index.add(3, "Wuthering Heights", "Emily Brontë")
+    index.add(4, "Tolkien: A Biography", "Humphrey Carpenter")
+    index.add(5, "The Hobbit Companion", "David Day")
+    return index
+
+
+class RankingTest(unittest.TestCase):
+    def setUp(self):
+        self.index = catalog()
+
+    def test_whole_title_match_ranks_first(self):
+        self.assertEqual(self.index.search("the hobbit"), ([1, 5, 2], 3))
+
+    def test_title_match_outranks_author_match(self):
+        book_ids, _ = self.index.search("tolkien")
+        self.assertEqual(book_ids[0], 4)
+        self.assertEqual(set(book_ids), {1, 2, 4})
+
+    def test_prefix_and_fuzzy_matches(self):
+        self.assertEqual(self.index.search("wuther")[0], [3])
+        self.assertEqual(self.index.search("hobit")[0][:2], [1, 5])
+        # Case and accents are folded on both sides
+        self.assertEqual(self.index.search("BRONTE")[0], [3])
+
+    def test_offset_pages_through_the_ranking(self):
+        everything, total = self.index.search("the hobbit")
+        self.assertEqual(self.index.search("the hobbit", limit=1, offset=1), (everything[1:2], total))
+        self.assertEqual(self.index.search("!!!"), ([], 0))
+
+
+class ReindexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = catalog()
+
+    def test_rename_replaces_the_old_tokens(self):
+        self.index.update(3, title="Jane Eyre")
+        self.assertEqual(self.index.search("wuthering"), ([], 0))
+        self.assertEqual(self.index.search("eyre")[0], [3])
+        # The untouched author stays indexed, and the old token left the vocabulary
+        self.assertEqual(self.index.search("bronte")[0], [3])
+        self.assertNotIn("wuthering", self.index.sorted_vocabulary())
+
+    def test_remove_and_update_of_unknown_book(self):
+        self.index.remove(4)
+        self.assertEqual(sorted(self.index.search("tolkien")[0]), [1, 2])
+        self.assertNotIn("biography", self.index.postings)
+        self.index.update(99, title="Ghost")
+        self.assertEqual(self.index.search("ghost"), ([], 0))
+
+
+class RebuildTest(unittest.IsolatedAsyncioTestCase):
+    async def test_writes_during_a_rebuild_are_kept(self):
+        repo = MemoryRepositories(snapshot_path=None)
+        await repo.books.insert_unique([{'id': i, 'title': f"Book {i}", 'author': "Author"} for i in range(1, 4)])
+        index = SearchIndex()
+        scan = repo.books.scan
+
+        async def slow_scan(*args, **kwargs):
+            async for book in scan(*args, **kwargs):
+                yield book
+                await asyncio.sleep(0)
+
+        repo.books.scan = slow_scan
+        rebuild = asyncio.create_task(index.rebuild(repo))
+        await asyncio.sleep(0)
+        # Written through this worker while the scan is under way
+        index.add(10, "Dune", "Frank Herbert")
+        index.update(1, title="Renamed")
+        index.remove(2)
+        await rebuild
+
+        self.assertEqual(index.search("dune")[0], [10])
+        self.assertEqual(index.search("renamed")[0], [1])
+        self.assertEqual(sorted(index.documents), [1, 3, 10])
+        self.assertIsNone(index._journal)
+
+
+if __name__ == '__main__':
+    unittest.main()